@@ -4,9 +4,14 @@
 ## Modules
 #
 
+from time import perf_counter
+
+# Record when the addon started loading, to report how long it takes if asked
+startup_tstamp = perf_counter()
+
 import streamdeck_addon as addon
 
 
 
 ## Entry point
-addon.start(FreeCAD)
+addon.start(FreeCAD, startup_tstamp)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Key compositor benchmark
+
+Compose keys with text and brackets for the key image formats of the Stream
+Deck models, with the key labels drawn afresh for every key and with the
+labels taken from the key label cache, check that both give the same images
+and report how long each takes per key
+Run from anywhere, outside FreeCAD:
+
+  python3 benchmarks/benchmark_compositor.py [-n keys] [-f font.ttf]
+"""
+
+## Modules
+#
+
+import os
+import sys
+import argparse
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+import streamdeck_comm
+from streamdeck_comm import import_imaging_modules, compose_key_image
+
+
+
+## Parameters
+#
+
+# Key image formats of the Stream Deck models
+key_image_formats = {
+	"Mini":		{"size": (80, 80), "format": "BMP",
+			 "flip": (False, True), "rotation": 90},
+	"Original":	{"size": (72, 72), "format": "BMP",
+			 "flip": (True, True), "rotation": 0},
+	"Original V2":	{"size": (72, 72), "format": "JPEG",
+			 "flip": (True, True), "rotation": 0},
+	"XL":		{"size": (96, 96), "format": "JPEG",
+			 "flip": (True, True), "rotation": 0},
+	"Plus":		{"size": (120, 120), "format": "JPEG",
+			 "flip": (False, False), "rotation": 0}}
+
+# Texts and bracket colors of the keys
+key_overlays = [("Sketch", "Part", "Blue", None),
+		("", "Pad", None, "Red"),
+		("Draft", "", "Blue", "Blue"),
+		("View", "Fit all", None, None),
+		("", "", "Red", "Red"),
+		("Constraint horizontal distance", "Sketcher constraints",
+			None, "Red")]
+
+
+
+## Classes
+#
+
+class KeyImageFormat():
+  """Stand-in for a Stream Deck device that only knows its key image format
+  """
+
+  def __init__(self, image_format):
+    """__init__ method
+    """
+
+    self.image_format = image_format
+
+
+
+  def key_image_format(self):
+    """Return the format of the key images
+    """
+
+    return self.image_format
+
+
+
+## Routines
+#
+
+def time_per_key(compose, scaled_images, nbkeys, cached_labels):
+  """Compose nbkeys keys and return the average time per key in milliseconds,
+  with the images of the first round of keys. If cached_labels is False, the
+  key label cache is emptied before each key
+  """
+
+  images = []
+
+  start = perf_counter()
+  for i in range(nbkeys):
+    if not cached_labels:
+      streamdeck_comm.key_labels.clear()
+    tt, bt, lbc, rbc = key_overlays[i % len(key_overlays)]
+    native_image = compose(scaled_images[i % len(scaled_images)].copy(),
+				tt, bt, lbc, rbc)
+    if i < len(key_overlays) * len(scaled_images):
+      images.append(native_image)
+
+  return (perf_counter() - start) * 1000 / nbkeys, images
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-n", "--nbkeys", type = int, default = 500,
+				help = "Number of keys to compose per model "
+					"(default: %(default)s)")
+  argparser.add_argument("-f", "--font", default = "OpenSans-Regular.ttf",
+				help = "TrueType font to write the text with "
+					"(default: %(default)s)")
+  args = argparser.parse_args()
+
+  import_imaging_modules()
+  Image = streamdeck_comm.Image
+  ImageFont = streamdeck_comm.ImageFont
+  PILHelper = streamdeck_comm.PILHelper
+
+  try:
+    font = ImageFont.truetype(args.font, 14)
+  except:
+    print("Font {} not found: using PIL's default font".format(args.font))
+    font = ImageFont.load_default(14)
+
+  _, font_text_min_y, _, font_text_max_y = font.getbbox("A!_j")
+  margins = [font_text_max_y - font_text_min_y + 1] * 4
+
+  addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+  icons = [Image.open(os.path.join(addon_dir, f)) \
+		for f in ("prev.png", "next.png", "broken.png")]
+
+  print("{:<12} {:>10} {:>10} {:>8} {:>10}".
+		format("Model", "Uncached", "Cached", "Speedup", "Identical"))
+
+  for model, image_format in key_image_formats.items():
+    deck = KeyImageFormat(image_format)
+
+    scaled_images = [PILHelper.create_scaled_image(deck, icon,
+							margins = margins) \
+			for icon in icons]
+
+    compose = lambda image, *a: compose_key_image(deck, font, margins, image,
+							None, *a, prescaled = True)
+
+    uncached_ms, uncached_images = time_per_key(compose, scaled_images,
+						args.nbkeys, False)
+    cached_ms, cached_images = time_per_key(compose, scaled_images,
+						args.nbkeys, True)
+
+    print("{:<12} {:>10.3f} {:>10.3f} {:>7.2f}x {:>10}".
+		format(model, uncached_ms, cached_ms, uncached_ms / cached_ms,
+			"yes" if uncached_images == cached_images else "NO"))
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Key output path benchmark
+
+Render and upload full pages of keys with icons and labels to simulated Stream
+Deck devices of all the models with displays, stage by stage - icon
+conversion, scaling, composition and encoding, device write - then as the
+update loop does it, through the render cache: with a cold cache, with a warm
+cache and with all the tools disabled. Report how long each stage takes per
+key, how long rendering a full page takes and the keys rendered per second,
+and how long uploading a full page takes
+Needs PySide6 or PySide2. Run from anywhere, outside FreeCAD:
+
+  python3 benchmarks/benchmark_keys.py [-p pages] [-j threads] [-l latency]
+					[-w bandwidth] [-f font.ttf]
+"""
+
+## Modules
+#
+
+import os
+import sys
+import argparse
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+# Render offscreen if there's no display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+
+## Parameters
+#
+
+# Tool titles and toolbar names written on the keys
+titles = ("Pad", "Pocket", "Fillet", "Constraint horizontal distance",
+		"Mirror", "Fit all", "Create sketch", "Boolean")
+toolbar_names = ("Part Design helper features", "Sketcher", "View", "Part")
+
+
+
+## Classes
+#
+
+class ToolbarActionsStandIn():
+  """Stand-in for a ToolbarActions object holding the actions of the benchmark
+  """
+
+  def __init__(self, actions):
+    """__init__ method
+    """
+
+    self.actions = {a.name: a for a in actions}
+
+
+
+## Routines
+#
+
+def create_actions(QtGui, QtWidgets, window, nbactions):
+  """Create nbactions Actions for QActions with the standard icons of the Qt
+  style, scaled up from their largest size like FreeCAD's icons
+  """
+
+  from gui_actions import Action
+
+  style = window.style()
+
+  actions = []
+  for i in range(nbactions):
+    qaction = QtGui.QAction(style.standardIcon(
+				QtWidgets.QStyle.StandardPixmap(i % 60)),
+				titles[i % len(titles)], window)
+    qaction.setObjectName("Std_Tool_{}".format(i))
+    actions.append(Action(qaction.objectName(),
+				toolbar_names[i % len(toolbar_names)], qaction))
+    actions[-1].refresh()
+
+  return actions
+
+
+
+def key_desc(sv, action, i):
+  """Return the description of the key of an action, with brackets on some of
+  the keys like the first and last keys of the repeated toolbars
+  """
+
+  return sv.join([action.name, "1" if action.enabled else "0",
+			str(action.iconid), action.title, action.toolbar,
+			"blue" if i % 5 == 0 else "",
+			"red" if i % 7 == 0 else ""])
+
+
+
+def per_key_ms(f, items):
+  """Call f(item) for each item and return the results and the average time
+  per item in milliseconds
+  """
+
+  start = perf_counter()
+  results = [f(item) for item in items]
+
+  return results, (perf_counter() - start) * 1000 / len(items)
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-p", "--pages", type = int, default = 10,
+				help = "Number of pages of different keys to "
+					"display per model "
+					"(default: %(default)s)")
+  argparser.add_argument("-j", "--threads", type = int, default = 0,
+				help = "Number of threads rendering the keys, 0 "
+					"for as many as there are processors "
+					"(default: %(default)s)")
+  argparser.add_argument("-l", "--latency", type = float, default = 1,
+				help = "Simulated write latency in milliseconds "
+					"(default: %(default)s)")
+  argparser.add_argument("-w", "--bandwidth", type = float, default = 1000,
+				help = "Simulated write bandwidth in kilobytes "
+					"per second, 0 for unlimited "
+					"(default: %(default)s)")
+  argparser.add_argument("-f", "--font", default = "OpenSans-Regular.ttf",
+				help = "TrueType font to write the text with "
+					"(default: %(default)s)")
+  args = argparser.parse_args()
+
+  from PIL import ImageFont
+  try:
+    ImageFont.truetype(args.font, 14)
+  except:
+    print("Font {} not found".format(args.font))
+    return 1
+
+  from benchmark_updates import install_stand_ins
+  app, QtCore, QtGui, QtWidgets, gui = install_stand_ins()
+
+  import streamdeck_comm
+  from streamdeck_comm import StreamDeck, scale_key_image, compose_key_image
+  from streamdeck_sim import simulated_streamdeck, SimulatedDeviceManager, \
+				SimulatedStreamDeck
+  from streamdeck_pages import StreamDeckPages
+  from render_cache import RenderCache
+  from key_renderer import KeyRenderer
+
+  addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+  image_files = [os.path.join(addon_dir, f) \
+			for f in ("prev.png", "next.png", "blank.png",
+					"broken.png")]
+
+  window = QtWidgets.QMainWindow()
+  sv = StreamDeckPages.SV
+
+  print("Stages per key in ms - composing includes encoding - full pages "
+	"rendered with {} in ms, and full pages uploaded in ms".
+		format("{} thread{}".format(args.threads,
+					"" if args.threads == 1 else "s") \
+			if args.threads else "a thread per processor"))
+  print()
+  print("{:<24} {:>5} {:>6} {:>7} {:>7} {:>7}  {:>8} {:>8}  {:>8} {:>8}  "
+	"{:>8} {:>8}  {:>9}".
+		format("Model", "Icon", "Scale", "Compose", "Encode", "Write",
+			"Cold ms", "Keys/s", "Warm ms", "Keys/s", "Disab ms",
+			"Keys/s", "Upload ms"))
+
+  # Only the models with displays are used by the addon
+  for model in [m for m, f in SimulatedStreamDeck.MODELS.items() \
+			if f.get("visual", True)]:
+
+    dev = simulated_streamdeck(model, write_latency = args.latency / 1000,
+				write_bandwidth = args.bandwidth * 1000)
+    sd = StreamDeck(args.font, 14, *image_files,
+			SimulatedDeviceManager([dev]))
+    sd.open(dev.deck_type(), None)
+    if not sd.is_open():
+      print("{:<24} could not be opened".format(model))
+      continue
+
+    nbkeys = sd.nbkeys
+    actions = create_actions(QtGui, QtWidgets, window, nbkeys * args.pages)
+    tbactions = ToolbarActionsStandIn(actions)
+
+    # Time each stage of the output path separately, key by key
+    icons, icon_ms = per_key_ms(lambda a: a.icon_as_pil_image(), actions)
+    scaled, scale_ms = per_key_ms(lambda i: scale_key_image(sd.dev, i,
+							sd.margins,
+							sd.broken_image), icons)
+    pil_images, compose_ms = per_key_ms(lambda ia: \
+			compose_key_image(sd.dev, sd.font, sd.margins, ia[1],
+						sd.broken_image, ia[0].title,
+						ia[0].toolbar, "blue", "red",
+						True),
+			list(zip(actions, scaled)))
+    _, encode_ms = per_key_ms(lambda i: streamdeck_comm.PILHelper.\
+						to_native_key_format(sd.dev, i),
+				scaled)
+    _, write_ms = per_key_ms(lambda ki: sd.set_key_image(*ki),
+				[(i % nbkeys, image) \
+					for i, image in enumerate(pil_images)])
+
+    # Display full pages as the update loop does, through the render cache
+    renderer = KeyRenderer(RenderCache(), None, args.threads)
+
+    def display_pages():
+      """Display all the pages, converting the icons of each page once like the
+      update loop does. Return the average times per page to render the keys
+      and to upload them in milliseconds. The uploads take as long whether
+      the keys come from the render cache or not, so they're timed apart
+      """
+
+      render_time = 0
+      upload_time = 0
+
+      for p in range(args.pages):
+        icon_images = {}
+
+        def describe_key(kd):
+          n, enabled, iconid, tt, bt, lbc, rbc = kd.split(sv)
+          if (n, enabled, iconid) not in icon_images:
+            icon_images[(n, enabled, iconid)] = \
+			tbactions.actions[n].icon_as_pil_image()
+          return icon_images[(n, enabled, iconid)], tt, bt, lbc, rbc
+
+        page = actions[p * nbkeys:(p + 1) * nbkeys]
+
+        start = perf_counter()
+        native_images = renderer.render_keys([(sd, key_desc(sv, a, i),
+							describe_key) \
+						for i, a in enumerate(page)])
+        render_time += perf_counter() - start
+
+        start = perf_counter()
+        sd.set_key_images(list(enumerate(native_images)))
+        upload_time += perf_counter() - start
+
+      return render_time * 1000 / args.pages, upload_time * 1000 / args.pages
+
+    cold_ms, upload_ms = display_pages()
+    warm_ms, _ = display_pages()
+
+    # Disable all the tools: their key descriptions change, so the disabled
+    # versions of their icons are converted and their keys rendered again
+    for a in actions:
+      a.action.setEnabled(False)
+      a.refresh()
+    disabled_ms, _ = display_pages()
+
+    sd.close()
+
+    keys_per_sec = lambda ms: nbkeys * 1000 / ms
+
+    print("{:<24} {:>5.2f} {:>6.2f} {:>7.2f} {:>7.2f} {:>7.2f}  {:>8.2f} "
+	"{:>8.0f}  {:>8.2f} {:>8.0f}  {:>8.2f} {:>8.0f}  {:>9.2f}".
+		format(model, icon_ms, scale_ms, compose_ms, encode_ms,
+			write_ms, cold_ms, keys_per_sec(cold_ms), warm_ms,
+			keys_per_sec(warm_ms), disabled_ms,
+			keys_per_sec(disabled_ms), upload_ms))
+
+  return 0
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Stream Deck pages benchmark
+
+Rebuild the Stream Deck pages from synthetic toolbars and actions - from a few
+tools to far more than any workbench setup - for all the numbers of keys of the
+Stream Deck models, with and without repeated toolbars and page navigation
+keys, optionally with the small toolbars packed together, locate the current
+page in the rebuilt pages and flip through them.
+Report how long each takes and the peak memory used by the rebuilds, save the
+results as a baseline and compare later results with it
+Run from anywhere, outside FreeCAD:
+
+  python3 benchmarks/benchmark_pages.py [-q] [-p] [-r repeats]
+						[-s baseline.json]
+					[-c baseline.json [-t threshold]]
+"""
+
+## Modules
+#
+
+import os
+import sys
+import json
+import random
+import argparse
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+from streamdeck_pages import StreamDeckPages
+from streamdeck_sim import SimulatedStreamDeck
+
+
+
+## Parameters
+#
+
+# Numbers of keys of the Stream Deck models with displays
+nbs_keys = tuple(sorted(set([m["key_count"] \
+				for m in SimulatedStreamDeck.MODELS.values() \
+				if m.get("visual", True)])))
+
+# Numbers of actions and toolbars
+nbs_actions = (10, 100, 1000, 5000)
+nbs_toolbars = (1, 10, 100)
+
+# Number of actions of the toolbar repeated on every page
+nbrepeated_actions = 3
+
+# Subset of the above for a quick run
+quick_nbs_actions = (10, 1000)
+quick_nbs_toolbars = (1, 10)
+
+# Bracket colors
+ptbc = "Blue"
+nkbc = "Red"
+exbc = "Green"
+
+
+
+## Classes
+#
+
+class SyntheticAction():
+  """Stand-in for an Action, with only what the pages need
+  """
+
+  def __init__(self, toolbar, name, title, iconid, issubactionof = None,
+		islastsubaction = False):
+    """__init__ method
+    """
+
+    self.toolbar = toolbar
+    self.name = name
+    self.title = title
+    self.iconid = iconid
+    self.enabled = True
+    self.issubactionof = issubactionof
+    self.islastsubaction = islastsubaction
+
+
+
+class SyntheticToolbarActions():
+  """Stand-in for a ToolbarActions object with nbactions actions spread
+  unevenly over nbtoolbars toolbars, every 10th of them expanded into 3
+  subactions like the tools with a menu, plus a first toolbar with
+  nbrepeated actions to repeat on every page if nbrepeated isn't 0
+  """
+
+  def __init__(self, nbactions, nbtoolbars, nbrepeated = 0, seed = 0):
+    """__init__ method
+    """
+
+    rng = random.Random(seed)
+
+    # Spread the actions over the toolbars, each getting at least one
+    weights = [rng.random() + 0.1 for _ in range(nbtoolbars)]
+    sizes = [1 + int((nbactions - nbtoolbars) * w / sum(weights)) \
+		for w in weights]
+    sizes[0] += nbactions - sum(sizes)
+
+    self.toolbars = ["Toolbar{}".format(t) for t in range(nbtoolbars)]
+    self.toolbar_actions = {}
+    self.actions = {}
+    self.expanded_actions = {}
+
+    if nbrepeated:
+      self.toolbars.insert(0, "Repeated")
+      sizes.insert(0, nbrepeated)
+
+    for t, size in zip(self.toolbars, sizes):
+      self.toolbar_actions[t] = []
+
+      while len(self.toolbar_actions[t]) < size:
+        n = "Std_Tool_{}".format(len(self.actions))
+        self.actions[n] = SyntheticAction(t, n, "Tool {}".format(n),
+						rng.randrange(1 << 30))
+        self.toolbar_actions[t].append(n)
+
+        if len(self.actions) % 10 == 0 and \
+		len(self.toolbar_actions[t]) + 3 <= size:
+          self.expanded_actions[n] = True
+          for i in range(3):
+            sn = "{}_Variant_{}".format(n, i)
+            self.actions[sn] = SyntheticAction(t, sn, "Variant {}".format(i),
+						rng.randrange(1 << 30), n, i == 2)
+            self.toolbar_actions[t].append(sn)
+
+
+
+## Routines
+#
+
+def rebuild(pages, tbactions, repeated_toolbars, pack_toolbars = False):
+  """Rebuild the pages, with the small toolbars packed together if
+  pack_toolbars is True
+  """
+
+  pages.rebuild_pages(tbactions, repeated_toolbars, ptbc, nkbc, exbc,
+			pack_toolbars)
+
+
+
+def best_time(f, repeats):
+  """Run f() repeats times and return the shortest time it took in
+  milliseconds
+  """
+
+  best = None
+  for _ in range(repeats):
+    start = perf_counter()
+    f()
+    t = (perf_counter() - start) * 1000
+    best = t if best is None else min(best, t)
+
+  return best
+
+
+
+def run_case(nbkeys, nbactions, nbtoolbars, repeated, with_nav_keys,
+		pack_toolbars, repeats):
+  """Benchmark one combination of parameters. If repeated is True, a toolbar
+  with nbrepeated_actions actions is repeated on every page. If pack_toolbars
+  is True, the small toolbars are packed together
+  Return the number of pages, the rebuild time, the locate time, the flip time
+  in milliseconds and the peak memory used by the rebuild in kilobytes
+  """
+
+  tbactions = SyntheticToolbarActions(nbactions, nbtoolbars,
+					nbrepeated_actions if repeated else 0)
+  repeated_toolbars = ["Repeated"] if repeated else []
+
+  pages = StreamDeckPages(nbkeys, with_nav_keys)
+
+  # Time the rebuilds
+  rebuild_ms = best_time(lambda: rebuild(pages, tbactions, repeated_toolbars,
+					pack_toolbars), repeats)
+
+  # Measure the peak memory used by one rebuild
+  tracemalloc.start()
+  rebuild(pages, tbactions, repeated_toolbars, pack_toolbars)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  nbpages = len(pages.pages)
+
+  # Time locating the current page - in the middle of the pages - after an
+  # action on it was disabled, which changes the pages and makes the current
+  # page be looked for
+  locate_ms = 0
+  if nbpages:
+    page_no = nbpages // 2
+    n = [ks.split(pages.SV)[1] \
+		for ks in pages.pages[page_no].split(pages.SK)][-3]
+    action = tbactions.actions.get(n)
+
+    for i in range(repeats):
+      pages.current_page = None
+      pages.locate_current_page()
+      pages.flip(page_no)
+      if action is not None:
+        action.enabled = not action.enabled
+      rebuild(pages, tbactions, repeated_toolbars, pack_toolbars)
+
+      start = perf_counter()
+      pages.locate_current_page()
+      t = (perf_counter() - start) * 1000
+      locate_ms = t if i == 0 else min(locate_ms, t)
+
+  # Time flipping through all the pages forward and back
+  flip_ms = 0
+  if nbpages > 1:
+    def flip_through():
+      for _ in range(nbpages - 1):
+        pages.flip(1)
+      for _ in range(nbpages - 1):
+        pages.flip(-1)
+
+    pages.flip(-nbpages)
+    flip_ms = best_time(flip_through, repeats) / (2 * (nbpages - 1))
+
+  return nbpages, rebuild_ms, locate_ms, flip_ms, peak / 1024
+
+
+
+def case_name(nbkeys, nbactions, nbtoolbars, repeated, with_nav_keys,
+		pack_toolbars):
+  """Return the name of a combination of parameters, used to find it in the
+  baselines
+  """
+
+  return "{}k {}a {}t {} {}{}".format(nbkeys, nbactions, nbtoolbars,
+					"rep" if repeated else "norep",
+					"nav" if with_nav_keys else "nonav",
+					" pack" if pack_toolbars else "")
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-q", "--quick", action = "store_true",
+				help = "Only benchmark a subset of the numbers of "
+					"actions and toolbars")
+  argparser.add_argument("-p", "--pack", action = "store_true",
+				help = "Pack the small toolbars together")
+  argparser.add_argument("-r", "--repeats", type = int, default = 5,
+				help = "Number of times to repeat each "
+					"measurement, keeping the best "
+					"(default: %(default)s)")
+  argparser.add_argument("-s", "--save-baseline",
+				help = "Save the results in this file as a "
+					"baseline")
+  argparser.add_argument("-c", "--check-baseline",
+				help = "Compare the results with the baseline "
+					"saved in this file, and exit with "
+					"status 1 if any of them regressed")
+  argparser.add_argument("-t", "--threshold", type = float, default = 25,
+				help = "Percentage over the baseline above "
+					"which a result is deemed a regression "
+					"(default: %(default)s)")
+  argparser.add_argument("-m", "--min-ms", type = float, default = 0.05,
+				help = "Times under which a result is never "
+					"deemed a regression, as they're too "
+					"short to be measured reliably "
+					"(default: %(default)s)")
+  args = argparser.parse_args()
+
+  baseline = None
+  if args.check_baseline:
+    try:
+      with open(args.check_baseline, "r") as f:
+        baseline = json.load(f)
+    except Exception as e:
+      print("Error loading baseline {}: {}".format(args.check_baseline, e))
+      return 1
+
+  results = {}
+  regressions = []
+
+  print("{:<31} {:>6} {:>11} {:>10} {:>9} {:>10}  {}".
+		format("Case", "Pages", "Rebuild ms", "Locate ms", "Flip us",
+			"Peak KiB", "Regressions" if baseline else ""))
+
+  for nbactions in quick_nbs_actions if args.quick else nbs_actions:
+    for nbtoolbars in quick_nbs_toolbars if args.quick else nbs_toolbars:
+
+      if nbtoolbars > nbactions:
+        continue
+
+      for nbkeys in nbs_keys:
+        for repeated in (False, True):
+          for with_nav_keys in (True, False):
+
+            name = case_name(nbkeys, nbactions, nbtoolbars, repeated,
+				with_nav_keys, args.pack)
+
+            nbpages, rebuild_ms, locate_ms, flip_ms, peak_kib = \
+			run_case(nbkeys, nbactions, nbtoolbars, repeated,
+					with_nav_keys, args.pack, args.repeats)
+
+            results[name] = {"pages": nbpages, "rebuild_ms": rebuild_ms,
+				"locate_ms": locate_ms, "flip_ms": flip_ms,
+				"peak_kib": peak_kib}
+
+            # Compare the results with the baseline
+            regressed = []
+            if baseline and name in baseline:
+              for k, v in results[name].items():
+                b = baseline[name].get(k)
+                if b is None or k == "pages" or \
+			(k.endswith("_ms") and v < args.min_ms):
+                  continue
+                if v > b * (1 + args.threshold / 100):
+                  regressed.append("{} +{:.0f}%".format(k, (v / b - 1) * 100 \
+								if b else 100))
+              regressions.extend([(name, r) for r in regressed])
+
+            print("{:<31} {:>6} {:>11.3f} {:>10.3f} {:>9.3f} {:>10.1f}  {}".
+			format(name, nbpages, rebuild_ms, locate_ms,
+				flip_ms * 1000, peak_kib, ", ".join(regressed)))
+
+  if args.save_baseline:
+    try:
+      with open(args.save_baseline, "w") as f:
+        json.dump(results, f, indent = 1)
+    except Exception as e:
+      print("Error saving baseline {}: {}".format(args.save_baseline, e))
+      return 1
+
+  if baseline:
+    print()
+    print("{} regression{} over {}% of the baseline".
+		format(len(regressions), "" if len(regressions) == 1 else "s",
+			args.threshold))
+    return 1 if regressions else 0
+
+  return 0
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Update loop benchmark
+
+Run the addon's real update loop outside FreeCAD, against a synthetic main
+window with toolbars, buttons, menus and actions and a simulated Stream Deck,
+with stand-ins for FreeCAD's parameters and FreeCADGui. Play scenarios - idle,
+page flips, workbench switches, selection storms - and report the latency
+distribution of the updates in each scenario
+Needs PySide6 or PySide2. Run from anywhere, outside FreeCAD:
+
+  python3 benchmarks/benchmark_updates.py [-m model] [-t toolbars] [-b buttons]
+					[-s scenario[,scenario...]]
+					[-r trace.jsonl] ...
+"""
+
+## Modules
+#
+
+import os
+import sys
+import types
+import argparse
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				"..", "tests"))
+
+from freecad_stand_ins import FreeCADStandIn
+
+# Render offscreen if there's no display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+
+## Parameters
+#
+
+scenarios = ("idle", "flips", "switches", "storms")
+
+
+
+## Routines
+#
+
+def install_stand_ins():
+  """Make PySide6 or PySide2 importable as FreeCAD's PySide module - whose
+  QtGui also holds the widgets - and install a FreeCADGui module whose main
+  window is created with build_main_window()
+  Return the Qt application, the QtCore, QtGui and QtWidgets modules and the
+  FreeCADGui stand-in
+  """
+
+  try:
+    from PySide6 import QtCore, QtGui, QtWidgets
+  except ImportError:
+    from PySide2 import QtCore, QtGui, QtWidgets
+
+  # Some PySide6 versions - 6.12 at least - release a reference to None they
+  # don't hold every time a Qt method returning nothing is called. None is
+  # immortal from Python 3.12 on, but before that the interpreter aborts with
+  # "none_dealloc" once None runs out of references, which the benchmarks
+  # reach in seconds: give None enough references to never run out
+  if sys.implementation.name == "cpython" and sys.version_info < (3, 12):
+    import ctypes
+    ctypes.c_ssize_t.from_address(id(None)).value += 1 << 30
+
+  qtgui = types.ModuleType("PySide.QtGui")
+  for m in (QtGui, QtWidgets):
+    for n in dir(m):
+      if not n.startswith("_"):
+        setattr(qtgui, n, getattr(m, n))
+
+  pyside = types.ModuleType("PySide")
+  pyside.QtCore = QtCore
+  pyside.QtGui = qtgui
+
+  sys.modules["PySide"] = pyside
+  sys.modules["PySide.QtCore"] = QtCore
+  sys.modules["PySide.QtGui"] = qtgui
+
+  app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+  gui = types.ModuleType("FreeCADGui")
+  gui.main_window = None
+  gui.getMainWindow = lambda: gui.main_window
+  sys.modules["FreeCADGui"] = gui
+
+  return app, QtCore, QtGui, QtWidgets, gui
+
+
+
+def build_main_window(QtGui, QtWidgets, toolbar_sizes, menu_every,
+			nb_menu_items):
+  """Build an offscreen main window with toolbars given as a list of (toolbar
+  name, number of buttons). Every menu_every-th button - none if menu_every is
+  0 - has a menu with nb_menu_items items, like FreeCAD's tools with variants
+  Return the main window, the toolbars and the actions of the buttons
+  """
+
+  window = QtWidgets.QMainWindow()
+  style = window.style()
+  icons = [style.standardIcon(QtWidgets.QStyle.StandardPixmap(i)) \
+		for i in range(60)]
+
+  toolbars = []
+  actions = []
+  for t, (name, nb_buttons) in enumerate(toolbar_sizes):
+    toolbar = QtWidgets.QToolBar(name)
+    toolbar.setObjectName(name)
+    window.addToolBar(toolbar)
+
+    for b in range(nb_buttons):
+      action = QtGui.QAction(icons[(t * 17 + b) % len(icons)],
+				"Tool {}.{}".format(t, b), window)
+      action.setObjectName("Std_Tool_{}_{}".format(t, b))
+      actions.append(action)
+
+      if menu_every and b % menu_every == menu_every - 1:
+        button = QtWidgets.QToolButton(toolbar)
+        button.setDefaultAction(action)
+        menu = QtWidgets.QMenu(button)
+        for m in range(nb_menu_items):
+          item = menu.addAction(icons[m % len(icons)],
+				"Variant {}.{}.{}".format(t, b, m))
+          item.setObjectName("Std_Variant_{}_{}_{}".format(t, b, m))
+        button.setMenu(menu)
+        toolbar.addWidget(button)
+
+      else:
+        toolbar.addAction(action)
+
+    toolbars.append(toolbar)
+
+  window.show()
+
+  return window, toolbars, actions
+
+
+
+def percentile(durations, p):
+  """Return the p-th quantile of sorted durations
+  """
+
+  return durations[min(len(durations) - 1, int(len(durations) * p))]
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-m", "--model", default = "Stream Deck XL",
+				help = "Simulated Stream Deck model "
+					"(default: %(default)s)")
+  argparser.add_argument("-t", "--toolbars", type = int, default = 20,
+				help = "Number of toolbars "
+					"(default: %(default)s)")
+  argparser.add_argument("-b", "--buttons", type = int, default = 12,
+				help = "Number of buttons per toolbar "
+					"(default: %(default)s)")
+  argparser.add_argument("-M", "--menu-every", type = int, default = 4,
+				help = "Give every n-th button a menu, 0 for "
+					"none (default: %(default)s)")
+  argparser.add_argument("-i", "--menu-items", type = int, default = 4,
+				help = "Number of items per menu "
+					"(default: %(default)s)")
+  argparser.add_argument("-s", "--scenarios", default = ",".join(scenarios),
+				help = "Comma-separated scenarios to play among "
+					"{} (default: %(default)s)".
+					format(", ".join(scenarios)))
+  argparser.add_argument("-d", "--duration", type = float, default = 5,
+				help = "Seconds to play each scenario "
+					"(default: %(default)s)")
+  argparser.add_argument("-l", "--latency", type = float, default = 0,
+				help = "Simulated write latency in milliseconds "
+					"(default: %(default)s)")
+  argparser.add_argument("-r", "--record-trace",
+				help = "Record the input trace of the benchmark "
+					"in this file, to replay it with "
+					"replay_trace.py")
+  argparser.add_argument("-f", "--font", default = "OpenSans-Regular.ttf",
+				help = "TrueType font to write the text with "
+					"(default: %(default)s)")
+  args = argparser.parse_args()
+
+  for scenario in args.scenarios.split(","):
+    if scenario not in scenarios:
+      print("Unknown scenario {}".format(scenario))
+      return 1
+
+  from PIL import ImageFont
+  try:
+    ImageFont.truetype(args.font, 14)
+  except:
+    print("Font {} not found".format(args.font))
+    return 1
+
+  app, QtCore, QtGui, QtWidgets, gui = install_stand_ins()
+
+  window, toolbars, actions = build_main_window(QtGui, QtWidgets,
+					[("Toolbar{}".format(t), args.buttons) \
+						for t in range(args.toolbars)],
+					args.menu_every, args.menu_items)
+  gui.main_window = window
+
+  fc = FreeCADStandIn()
+  fc.set_param("/Device/Filters", "String", "UseDeviceType",
+		"Simulated " + args.model)
+  fc.set_param("/Device/Simulation", "Float", "WriteLatencyMilliseconds",
+		args.latency)
+  if args.record_trace:
+    fc.set_param("/Debug", "String", "RecordInputTraceFile", args.record_trace)
+
+  import streamdeck_addon
+
+  # Time the updates, recorded per scenario
+  durations = []
+  streamdeck_update = streamdeck_addon.streamdeck_update
+
+  def timed_streamdeck_update():
+    start = perf_counter()
+    streamdeck_update()
+    durations.append(perf_counter() - start)
+
+  streamdeck_addon.streamdeck_update = timed_streamdeck_update
+
+  streamdeck_addon.start(fc)
+  streamdeck_addon.params.streamdeck_key_text_font_filename_linux = args.font
+  streamdeck_addon.params.streamdeck_key_text_font_filename_windows = args.font
+
+  def run(secs, every = None, action = None):
+    """Process Qt events for secs seconds, calling action() every every
+    seconds
+    """
+
+    now = perf_counter()
+    end = now + secs
+    next_action = now
+
+    while now < end:
+      if action is not None and now >= next_action:
+        action()
+        next_action += every
+      app.processEvents()
+      sleep(0.001)
+      now = perf_counter()
+
+  # Wait for the simulated device to be opened and its keys to be displayed
+  run(2)
+  if not streamdeck_addon.decks:
+    print("Simulated Stream Deck {} could not be opened".format(args.model))
+    return 1
+
+  deck = streamdeck_addon.decks[0]
+  dev = deck.streamdecks[0].dev
+
+  print("{}: {} keys, {} dials - {} toolbars of {} buttons - {} pages".
+		format(dev.deck_type(), dev.key_count(), dev.dial_count(),
+			args.toolbars, args.buttons, len(deck.pages.pages)))
+  print()
+  print("{:<10} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}".
+		format("Scenario", "Updates", "Mean ms", "p50 ms", "p95 ms",
+			"p99 ms", "Max ms", ">16 ms"))
+
+  state = {"flip": 0, "switch": 0, "storm": 0}
+
+  def flip():
+    """Flip to the next page with the last key or the dials, and back to the
+    first page once the last page is reached
+    """
+
+    forward = state["flip"] < len(deck.pages.pages) - 1
+    state["flip"] = state["flip"] + 1 if forward else 0
+    if dev.dial_count():
+      dev.script_input([(0, "turn", 1 if forward else -len(deck.pages.pages))])
+    else:
+      keyno = dev.key_count() - 1 if forward else 0
+      dev.script_input([(0, "press", keyno), (0.05, "release", keyno)])
+
+  def switch():
+    """Show every other toolbar in turn, like switching between workbenches
+    """
+
+    state["switch"] ^= 1
+    for i, toolbar in enumerate(toolbars):
+      toolbar.setVisible(i % 2 == state["switch"])
+
+  def storm():
+    """Enable or disable all the tools at once, like a selection change
+    """
+
+    state["storm"] ^= 1
+    for action in actions:
+      action.setEnabled(bool(state["storm"]))
+
+  for scenario in args.scenarios.split(","):
+    durations.clear()
+
+    if scenario == "idle":
+      run(args.duration)
+    elif scenario == "flips":
+      run(args.duration, 0.5, flip)
+    elif scenario == "switches":
+      run(args.duration, 1, switch)
+    elif scenario == "storms":
+      run(args.duration, 0.5, storm)
+
+    d = sorted([d * 1000 for d in durations])
+    if not d:
+      print("{:<10} {:>7}".format(scenario, 0))
+      continue
+
+    print("{:<10} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>8}".
+		format(scenario, len(d), sum(d) / len(d), percentile(d, 0.5),
+			percentile(d, 0.95), percentile(d, 0.99), d[-1],
+			len([x for x in d if x > 16])))
+
+    # Put things back the way they were before the next scenario
+    if state["switch"]:
+      switch()
+    if not state["storm"]:
+      storm()
+    run(1)
+
+  streamdeck_addon.shutdown()
+
+  return 0
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Input trace replay
+
+Replay an input trace recorded by the addon - see the RecordInputTraceFile
+parameter - outside FreeCAD: run the addon's real update loop against a
+simulated Stream Deck of the model the trace was recorded with, and a
+synthetic main window with the toolbars of the trace. Feed the recorded input
+to the simulated device, and apply the recorded parameter and toolbar changes,
+at the pace they were recorded at or faster, then report the latency
+distribution of the updates
+Only the input of the first device in the trace is replayed. Replaying faster
+shortens the key presses too, so long key presses may become short ones
+Needs PySide6 or PySide2. Run from anywhere, outside FreeCAD:
+
+  python3 benchmarks/replay_trace.py [-s speed] [-m model] [-l latency]
+					[-f font.ttf] trace.jsonl
+"""
+
+## Modules
+#
+
+import os
+import sys
+import argparse
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+# Render offscreen if there's no display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from benchmark_updates import install_stand_ins, build_main_window, \
+				FreeCADStandIn, percentile
+from input_trace import read_trace, decode_control_states
+
+
+
+## Parameters
+#
+
+# Parameter Editor groups and parameters of the trace that aren't replayed:
+# the replay sets its own device, doesn't run the start and stop commands and
+# doesn't record another trace
+skipped_param_groups = ("/Device/Filters", "/Device/Simulation",
+			"/StartStopCommands")
+skipped_params = ("RecordInputTraceFile",)
+
+
+
+## Routines
+#
+
+def apply_params(fc, params):
+  """Set the parameters of a "params" event of the trace, except the skipped
+  ones
+  """
+
+  for pgpath, name, vartype, value in params:
+    if not pgpath.endswith(skipped_param_groups) and \
+		name not in skipped_params:
+      fc.ParamGet(pgpath).set(vartype, name, value)
+
+
+
+def show_toolbars(toolbars, names):
+  """Show the toolbars whose names are in names and hide the others
+  """
+
+  for toolbar in toolbars:
+    toolbar.setVisible(toolbar.objectName() in names)
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-s", "--speed", type = float, default = 1,
+				help = "Replay speed: 1 for the recorded pace, "
+					"more to replay faster "
+					"(default: %(default)s)")
+  argparser.add_argument("-m", "--model",
+				help = "Simulated Stream Deck model to replay the "
+					"trace on instead of the model it was "
+					"recorded with")
+  argparser.add_argument("-l", "--latency", type = float, default = 0,
+				help = "Simulated write latency in milliseconds "
+					"(default: %(default)s)")
+  argparser.add_argument("-f", "--font", default = "OpenSans-Regular.ttf",
+				help = "TrueType font to write the text with "
+					"(default: %(default)s)")
+  argparser.add_argument("trace",
+				help = "Input trace file")
+  args = argparser.parse_args()
+
+  try:
+    events = read_trace(args.trace)
+  except Exception as e:
+    print("Error reading trace {}: {}".format(args.trace, e))
+    return 1
+
+  devices = [e for e in events if e["ev"] == "device"]
+  if not devices:
+    print("No device in trace {}".format(args.trace))
+    return 1
+
+  # Find the model of the first device, without the prefix of the simulated
+  # devices if the trace was recorded with one
+  device = devices[0]
+  model = args.model or device["type"]
+  if model.startswith("Simulated "):
+    model = model[len("Simulated "):]
+
+  # Replay from the moment the first device was opened
+  t0 = device["t"]
+  events = [e for e in events if e["t"] >= t0 or e["ev"] != "read"]
+
+  # Create all the toolbars the trace ever shows, with as many buttons as they
+  # ever have
+  toolbar_sizes = {}
+  for e in events:
+    if e["ev"] == "toolbars":
+      for name, nbactions in e["toolbars"]:
+        toolbar_sizes[name] = max(toolbar_sizes.get(name, 0), nbactions)
+
+  from PIL import ImageFont
+  try:
+    ImageFont.truetype(args.font, 14)
+  except:
+    print("Font {} not found".format(args.font))
+    return 1
+
+  app, QtCore, QtGui, QtWidgets, gui = install_stand_ins()
+
+  window, toolbars, _ = build_main_window(QtGui, QtWidgets,
+					list(toolbar_sizes.items()), 0, 0)
+  gui.main_window = window
+
+  # Set the parameters and show the toolbars as they were when the first
+  # device was opened, and use the simulated device
+  fc = FreeCADStandIn()
+
+  for e in events:
+    if e["t"] > t0:
+      break
+    if e["ev"] == "params":
+      apply_params(fc, e["params"])
+    elif e["ev"] == "toolbars":
+      show_toolbars(toolbars, [name for name, _ in e["toolbars"]])
+
+  fc.set_param("/Device/Filters", "String", "UseDeviceType",
+		"Simulated " + model)
+  fc.set_param("/Device/Simulation", "Float", "WriteLatencyMilliseconds",
+		args.latency)
+
+  import streamdeck_addon
+
+  # Time the updates
+  durations = []
+  streamdeck_update = streamdeck_addon.streamdeck_update
+
+  def timed_streamdeck_update():
+    start = perf_counter()
+    streamdeck_update()
+    durations.append(perf_counter() - start)
+
+  streamdeck_addon.streamdeck_update = timed_streamdeck_update
+
+  streamdeck_addon.start(fc)
+  streamdeck_addon.params.streamdeck_key_text_font_filename_linux = args.font
+  streamdeck_addon.params.streamdeck_key_text_font_filename_windows = args.font
+
+  # Wait for the simulated device to be opened and its keys to be displayed
+  end = perf_counter() + 2
+  while perf_counter() < end:
+    app.processEvents()
+    sleep(0.001)
+
+  if not streamdeck_addon.decks:
+    print("Simulated Stream Deck {} could not be opened".format(model))
+    return 1
+
+  dev = streamdeck_addon.decks[0].streamdecks[0].dev
+  nb_key_writes = dev.nb_key_writes
+  durations.clear()
+
+  # Script the recorded input of the first device on the simulated device,
+  # and apply the other events when they're due
+  reads = [e for e in events if e["ev"] == "read" and e["id"] == device["id"]]
+  dev.script_input([((e["t"] - t0) / args.speed, "states",
+			decode_control_states(e["states"])) for e in reads])
+
+  others = [e for e in events if e["t"] > t0 and e["ev"] in ("params",
+								"toolbars")]
+
+  print("Replaying {} reads, {} parameter and toolbar changes on a simulated "
+	"{} at {}x".format(len(reads), len(others), model, args.speed))
+
+  start = perf_counter()
+
+  while others or dev.script_pending():
+    now = perf_counter()
+
+    while others and (others[0]["t"] - t0) / args.speed <= now - start:
+      e = others.pop(0)
+      if e["ev"] == "params":
+        apply_params(fc, e["params"])
+      else:
+        show_toolbars(toolbars, [name for name, _ in e["toolbars"]])
+
+    app.processEvents()
+    sleep(0.001)
+
+  # Let the last events be processed
+  end = perf_counter() + 1
+  while perf_counter() < end:
+    app.processEvents()
+    sleep(0.001)
+
+  elapsed = perf_counter() - start
+
+  streamdeck_addon.shutdown()
+
+  d = sorted([d * 1000 for d in durations])
+  if not d:
+    print("No updates")
+    return 1
+
+  print("Replayed in {:.1f} s: {} updates, {} keys written".
+		format(elapsed, len(d), dev.nb_key_writes - nb_key_writes))
+  print()
+  print("{:>9} {:>9} {:>9} {:>9} {:>9} {:>8}".
+		format("Mean ms", "p50 ms", "p95 ms", "p99 ms", "Max ms",
+			">16 ms"))
+  print("{:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>8}".
+		format(sum(d) / len(d), percentile(d, 0.5), percentile(d, 0.95),
+			percentile(d, 0.99), d[-1], len([x for x in d if x > 16])))
+
+  return 0
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
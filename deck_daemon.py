@@ -0,0 +1,1074 @@
+#!/usr/bin/env python3
+"""FreeCAD Stream Deck Addon - Device daemon and client classes
+
+The daemon is a separate process that owns the Stream Deck devices: it keeps
+them open across FreeCAD restarts, holds the key images each FreeCAD instance
+sent them, reads their input and lets several FreeCAD instances share them.
+The addon talks to it over a Unix domain socket through RemoteStreamDeck
+objects, which look like the StreamDeck library's devices to the rest of the
+addon, so FreeCAD itself does no USB I/O at all
+
+Run standalone:
+
+  python3 deck_daemon.py [-s socket] [-l linger] [-x exit_after]
+				[-S "Stream Deck model"] ...
+"""
+
+## Modules
+#
+
+import os
+import sys
+import stat
+import json
+import socket
+import struct
+import argparse
+import subprocess
+import socketserver
+from time import time, sleep
+from threading import Thread, RLock, Lock
+from contextlib import nullcontext
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from input_trace import encode_control_states, decode_control_states
+
+
+
+## Classes
+#
+
+class _OwnedDevice():
+  """Stream Deck device owned by the daemon, with the clients attached to it -
+  the last one attached is the active client, whose key images are displayed
+  and which gets the input - and what's currently displayed on it
+  """
+
+  def __init__(self, dev, info):
+    """__init__ method
+    """
+
+    self.dev = dev
+    self.info = info
+
+    self.lock = RLock()
+
+    self.clients = []
+    self.lost = False
+
+    self.displayed_keys = [None] * info["keys"]
+    self.displayed_touchscreen = {}	# (x, y, width, height): image
+    self.displayed_brightness = None
+
+    self.released_tstamp = time()	# When the last client detached
+
+
+
+class _Client():
+  """Connection of a FreeCAD instance to the daemon, with the key images,
+  touchscreen images and brightness it last set on the device it's attached
+  to, and the input of the device queued for it
+  """
+
+  def __init__(self):
+    """__init__ method
+    """
+
+    self.odev = None
+
+    self.keys = {}		# Key number: image
+    self.touchscreen = {}	# (x, y, width, height): image
+    self.brightness = None
+
+    self.input = deque(maxlen = 1000)
+    self.error = None
+
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+  """Handler of the requests of one client connection
+  """
+
+  def handle(self):
+    """Handle requests until the client disconnects
+    """
+
+    client = _Client()
+
+    try:
+      while True:
+        request, payload = recv_message(self.request)
+        reply = self.server.daemon.handle_request(client, request, payload)
+        if reply is not None:
+          send_message(self.request, reply)
+
+    except (EOFError, OSError):
+      pass
+
+    finally:
+      self.server.daemon.detach(client)
+
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """Unix domain socket server handling each client in its own thread
+  """
+
+  daemon_threads = True
+
+
+
+class DeckDaemon():
+  """Daemon owning the Stream Deck devices, serving their input and displaying
+  the key images of the FreeCAD instances connected to it
+
+  Key images are only written to a device when they differ from what it
+  displays, so a FreeCAD instance reconnecting after a restart gets its deck
+  back without a single key being written again, as long as it comes back
+  within linger seconds. After that, the devices without clients are blanked
+  """
+
+  def __init__(self, socket_path, linger = 10, exit_after = 0,
+		simulated_models = (), poll_every = 0.01):
+    """__init__ method
+    exit_after is how many seconds the daemon keeps running without clients.
+    If it's 0, it runs until it's stopped
+    simulated_models is a list of Stream Deck models to simulate along with
+    the real devices - see streamdeck_sim
+    """
+
+    self.socket_path = socket_path
+    self.linger = linger
+    self.exit_after = exit_after
+    self.poll_every = poll_every
+
+    self.__lock = Lock()
+    self.__devices = {}		# Device ID: _OwnedDevice
+    self.__nb_clients = 0
+    self.__last_client_tstamp = time()
+
+    self.__simulated = []
+    if simulated_models:
+      from streamdeck_sim import simulated_streamdeck
+      self.__simulated = [simulated_streamdeck(m, "SIM{:09d}".format(i + 1)) \
+				for i, m in enumerate(simulated_models)]
+
+    self.__server = None
+
+
+
+  def serve(self):
+    """Listen on the socket and serve the clients until stopped
+    Return an error message, or None if the daemon was stopped normally
+    """
+
+    # Don't start if another daemon is already listening on the socket, but
+    # replace a stale socket left by a daemon that died
+    if os.path.exists(self.socket_path):
+      try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.socket_path)
+        s.close()
+        return "another daemon is already listening on {}".\
+								format(self.socket_path)
+      except OSError:
+        os.unlink(self.socket_path)
+
+    # Only let our user connect
+    umask = os.umask(0o077)
+    try:
+      self.__server = _UnixServer(self.socket_path, _ClientHandler)
+    except Exception as e:
+      return str(e)
+    finally:
+      os.umask(umask)
+
+    self.__server.daemon = self
+
+    self.enumerate()
+
+    Thread(target = self.__poll_loop, daemon = True,
+		name = "Stream Deck daemon poll").start()
+
+    try:
+      self.__server.serve_forever()
+
+    finally:
+      self.__server.server_close()
+      try:
+        os.unlink(self.socket_path)
+      except:
+        pass
+
+      for odev in list(self.__devices.values()):
+        self.__close_device(odev, True)
+
+    return None
+
+
+
+  def stop(self):
+    """Stop serving - from another thread
+    """
+
+    if self.__server is not None:
+      self.__server.shutdown()
+
+
+
+  def enumerate(self):
+    """Open the devices that aren't open yet
+    Return the descriptions of all the open devices
+    """
+
+    try:
+      from StreamDeck.DeviceManager import DeviceManager
+      devs = DeviceManager().enumerate()
+    except:
+      devs = []
+
+    devs = devs + [d for d in self.__simulated if d.is_plugged()]
+
+    with self.__lock:
+      for dev in devs:
+
+        # Ignore the devices already open and the devices without displays
+        try:
+          dev_id = dev.id()
+          if dev_id in self.__devices or not dev.is_visual():
+            continue
+
+          dev.device.open()
+          dev._reset_key_stream()
+          dev.reset()
+
+          info = {"id": dev_id, "type": dev.deck_type(),
+			"serial": dev.get_serial_number(),
+			"keys": dev.key_count(), "dials": dev.dial_count(),
+			"touch_keys": dev.touch_key_count() \
+					if hasattr(dev, "touch_key_count") else 0,
+			"layout": list(dev.key_layout()),
+			"visual": dev.is_visual(),
+			"key_format": dev.key_image_format(),
+			"touchscreen_format": dev.touchscreen_image_format(),
+			"screen_format": dev.screen_image_format() \
+					if hasattr(dev, "screen_image_format") \
+					else {}}
+
+        except:
+          try:
+            dev.close()
+          except:
+            pass
+          continue
+
+        self.__devices[dev_id] = _OwnedDevice(dev, info)
+
+      return [odev.info for odev in self.__devices.values() \
+		if not odev.lost]
+
+
+
+  def handle_request(self, client, request, payload):
+    """Handle a client request
+    Return the reply, or None for the requests without replies
+    """
+
+    op = request.get("op")
+
+    if op == "enumerate":
+      return {"devices": self.enumerate()}
+
+    if op == "open":
+      with self.__lock:
+        odev = self.__devices.get(request.get("id"))
+      if odev is None or odev.lost:
+        return {"error": "device not found"}
+      self.attach(client, odev)
+      return {"ok": True}
+
+    if op == "close":
+      self.detach(client)
+      return {"ok": True}
+
+    odev = client.odev
+
+    # Return the input queued for the client and the error of the last write
+    # if any
+    if op == "read":
+      if client.error is None and (odev is None or odev.lost):
+        client.error = "device not open"
+
+      # The poll thread queues the input under the device's lock
+      with odev.lock if odev is not None else nullcontext():
+        reply = {"states": list(client.input), "error": client.error}
+        client.input.clear()
+        client.error = None
+
+      return reply
+
+    if odev is None:
+      client.error = "device not open"
+      return None
+
+    with odev.lock:
+
+      if op == "set_key_image":
+        client.keys[request["key"]] = payload
+
+      elif op == "set_touchscreen_image":
+        region = tuple(request["region"])
+        client.touchscreen[region] = payload
+
+      elif op == "set_brightness":
+        client.brightness = request["percent"]
+
+      elif op == "reset":
+        client.keys.clear()
+        client.touchscreen.clear()
+        return None
+
+      # Only display what the active client sets
+      if odev.clients and odev.clients[-1] is client:
+        self.__display(odev, client)
+
+    return None
+
+
+
+  def attach(self, client, odev):
+    """Attach a client to a device, making it the active client
+    """
+
+    self.detach(client)
+
+    with odev.lock:
+      client.odev = odev
+      odev.clients.append(client)
+
+    with self.__lock:
+      self.__nb_clients += 1
+
+
+
+  def detach(self, client):
+    """Detach a client from its device if it's attached. If it was the active
+    client, display the images of the client that was active before it
+    """
+
+    odev = client.odev
+    if odev is None:
+      return
+
+    with odev.lock:
+      was_active = odev.clients and odev.clients[-1] is client
+      odev.clients.remove(client)
+      client.odev = None
+
+      if not odev.clients:
+        odev.released_tstamp = time()
+      elif was_active:
+        self.__display(odev, odev.clients[-1])
+
+    with self.__lock:
+      self.__nb_clients -= 1
+      self.__last_client_tstamp = time()
+
+
+
+  def __display(self, odev, client):
+    """Write what differs between what a client set and what the device
+    displays. If the device fails, it's closed and reported lost to its
+    clients
+    """
+
+    if odev.lost:
+      return
+
+    try:
+      with odev.dev:
+        for keyno, image in client.keys.items():
+          if image != odev.displayed_keys[keyno]:
+            odev.dev.set_key_image(keyno, image)
+            odev.displayed_keys[keyno] = image
+
+        for region, image in client.touchscreen.items():
+          if image != odev.displayed_touchscreen.get(region):
+            odev.dev.set_touchscreen_image(image, *region)
+            odev.displayed_touchscreen[region] = image
+
+        if client.brightness is not None and \
+		client.brightness != odev.displayed_brightness:
+          odev.dev.set_brightness(client.brightness)
+          odev.displayed_brightness = client.brightness
+
+    except Exception as e:
+      self.__device_lost(odev, str(e) or type(e).__name__)
+
+
+
+  def __device_lost(self, odev, error):
+    """Report a failed device to its clients and forget about it, so it's
+    reopened at the next enumeration if it's still there
+    """
+
+    with odev.lock:
+      for client in odev.clients:
+        client.error = error
+
+    self.__close_device(odev, False)
+
+
+
+  def __close_device(self, odev, reset):
+    """Close a device, resetting it first if reset is True. Ignore errors
+    """
+
+    with odev.lock:
+      odev.lost = True
+
+      try:
+        with odev.dev:
+          if reset:
+            odev.dev.reset()
+          odev.dev.close()
+      except:
+        pass
+
+    with self.__lock:
+      if self.__devices.get(odev.info["id"]) is odev:
+        del(self.__devices[odev.info["id"]])
+
+
+
+  def __poll_loop(self):
+    """Poll thread: read the input of the devices and queue it for their
+    active clients, blank the devices left without clients for longer than
+    linger seconds, and stop the daemon when it's been without clients for
+    longer than exit_after seconds
+    """
+
+    while True:
+
+      now = time()
+
+      with self.__lock:
+        odevs = list(self.__devices.values())
+        nb_clients = self.__nb_clients
+        last_client_tstamp = self.__last_client_tstamp
+
+      if self.exit_after and not nb_clients and \
+		now - last_client_tstamp > self.exit_after:
+        self.stop()
+        return
+
+      for odev in odevs:
+        with odev.lock:
+
+          try:
+            while True:
+              with odev.dev:
+                states = odev.dev._read_control_states()
+              if states is None:
+                break
+              if odev.clients:
+                odev.clients[-1].input.append(encode_control_states(states))
+
+            # Blank the device if it's been left without clients for too long
+            if not odev.clients and \
+		now - odev.released_tstamp > self.linger and \
+		(any(odev.displayed_keys) or odev.displayed_touchscreen):
+              with odev.dev:
+                odev.dev.reset()
+              odev.displayed_keys = [None] * odev.info["keys"]
+              odev.displayed_touchscreen = {}
+
+          except Exception as e:
+            self.__device_lost(odev, str(e) or type(e).__name__)
+
+      sleep(self.poll_every)
+
+
+
+class _RemoteTransport():
+  """Stand-in for the low-level transport device of the StreamDeck library's
+  devices for a device owned by the daemon: opening it only connects to the
+  daemon - see RemoteStreamDeck.attach()
+  """
+
+  def __init__(self, deck):
+    """__init__ method
+    """
+
+    self.deck = deck
+
+
+
+  def open(self):
+    """Connect to the daemon
+    """
+
+    self.deck.connect()
+
+
+
+  def close(self):
+    """Detach from the device and disconnect from the daemon
+    """
+
+    self.deck.disconnect()
+
+
+
+  def is_open(self):
+    """Return whether we're attached to the device
+    """
+
+    return self.deck.is_open()
+
+
+
+  def connected(self):
+    """Return whether the device is still available
+    """
+
+    return self.deck.is_open()
+
+
+
+class RemoteStreamDeck():
+  """Stream Deck device owned by the daemon, with the same interface as the
+  StreamDeck library's devices. Writes are sent to the daemon without waiting,
+  and their errors are raised by the next read
+
+  Opening the device only connects to the daemon, so the device can be probed
+  for its serial number without taking it over from the FreeCAD instance
+  using it. It's only attached when it's actually used - see attach()
+  """
+
+  # The daemon keeps displaying our keys for a while after we close the device,
+  # so we get them back if FreeCAD restarts, and blanks the device itself
+  owned_by_daemon = True
+
+  def __init__(self, manager, info):
+    """__init__ method
+    info is the description of the device sent by the daemon
+    """
+
+    self.manager = manager
+    self.info = info
+
+    self.KEY_COUNT = info["keys"]
+    self.DIAL_COUNT = info["dials"]
+
+    self.device = _RemoteTransport(self)
+    self.update_lock = RLock()
+
+    self.__sock = None
+    self.__sock_lock = Lock()
+    self.__input = []
+
+
+
+  def connect(self):
+    """Connect to the daemon
+    """
+
+    self.disconnect()
+
+    self.__sock = self.manager.connect()
+    self.__input = []
+
+
+
+  def attach(self):
+    """Attach to the device, making us its active client: the device displays
+    our key images and sends us its input
+    """
+
+    reply = self.__send({"op": "open", "id": self.info["id"]}, reply = True)
+
+    if reply.get("error"):
+      self.disconnect()
+      raise IOError("Stream Deck daemon: {}".format(reply["error"]))
+
+
+
+  def disconnect(self):
+    """Detach from the device and disconnect from the daemon. Ignore errors
+    """
+
+    with self.__sock_lock:
+      if self.__sock is not None:
+        try:
+          send_message(self.__sock, {"op": "close"})
+          recv_message(self.__sock)
+        except:
+          pass
+        try:
+          self.__sock.close()
+        except:
+          pass
+        self.__sock = None
+
+
+
+  def __send(self, request, payload = b"", reply = False):
+    """Send a request to the daemon, and return its reply if reply is True
+    """
+
+    with self.__sock_lock:
+      if self.__sock is None:
+        raise IOError("Stream Deck daemon: device not open")
+
+      send_message(self.__sock, request, payload)
+
+      return recv_message(self.__sock)[0] if reply else None
+
+
+
+  # StreamDeck library device interface
+
+  def __enter__(self):
+    """Lock the device for exclusive use
+    """
+
+    self.update_lock.acquire()
+
+
+
+  def __exit__(self, type, value, traceback):
+    """Release the device
+    """
+
+    self.update_lock.release()
+
+
+
+  def id(self):
+    """Return the unique ID of the device
+    """
+
+    return "daemon:" + self.info["id"]
+
+
+
+  def deck_type(self):
+    """Return the type of the device
+    """
+
+    return self.info["type"]
+
+
+
+  def get_serial_number(self):
+    """Return the serial number of the device
+    """
+
+    return self.info["serial"]
+
+
+
+  def key_count(self):
+    """Return the number of keys
+    """
+
+    return self.KEY_COUNT
+
+
+
+  def touch_key_count(self):
+    """Return the number of touch keys
+    """
+
+    return self.info["touch_keys"]
+
+
+
+  def dial_count(self):
+    """Return the number of dials
+    """
+
+    return self.DIAL_COUNT
+
+
+
+  def key_layout(self):
+    """Return the number of rows and columns of keys
+    """
+
+    return tuple(self.info["layout"])
+
+
+
+  def is_visual(self):
+    """Return whether the keys have displays
+    """
+
+    return self.info["visual"]
+
+
+
+  def __image_format(self, f):
+    """Return an image format with the sizes and flips as tuples, like the
+    StreamDeck library's
+    """
+
+    return {k: tuple(v) if isinstance(v, list) else v for k, v in f.items()}
+
+
+
+  def key_image_format(self):
+    """Return the format of the key images
+    """
+
+    return self.__image_format(self.info["key_format"])
+
+
+
+  def touchscreen_image_format(self):
+    """Return the format of the touchscreen images
+    """
+
+    return self.__image_format(self.info["touchscreen_format"])
+
+
+
+  def screen_image_format(self):
+    """Return the format of the screen images
+    """
+
+    return self.__image_format(self.info["screen_format"])
+
+
+
+  def is_open(self):
+    """Return whether we're attached to the device
+    """
+
+    return self.__sock is not None
+
+
+
+  def connected(self):
+    """Return whether the device is still available
+    """
+
+    return self.is_open()
+
+
+
+  def close(self):
+    """Detach from the device
+    """
+
+    self.disconnect()
+
+
+
+  def _reset_key_stream(self):
+    """Reset the key image stream, which the StreamDeck library does when it
+    opens a device for use: the daemon takes care of the stream, so attach to
+    the device
+    """
+
+    self.attach()
+
+
+
+  def reset(self):
+    """Forget about the images we set on the device. The device keeps
+    displaying them until another client sets its own, or the daemon blanks it
+    """
+
+    self.__send({"op": "reset"})
+
+
+
+  def set_brightness(self, percent):
+    """Set the brightness of the display
+    """
+
+    self.__send({"op": "set_brightness", "percent": int(percent)})
+
+
+
+  def set_key_image(self, key, image):
+    """Set the image of a key, already in the native format
+    """
+
+    self.__send({"op": "set_key_image", "key": key}, bytes(image))
+
+
+
+  def set_touchscreen_image(self, image, x_pos = 0, y_pos = 0, width = 0,
+				height = 0):
+    """Set the image of a region of the touchscreen, already in the native
+    format
+    """
+
+    self.__send({"op": "set_touchscreen_image",
+			"region": [x_pos, y_pos, width, height]}, bytes(image))
+
+
+
+  def _read_control_states(self):
+    """Return the next input event of the device, fetching the events queued
+    by the daemon if we don't have any left, or None if there isn't any
+    Raise the error of the last write if it failed
+    """
+
+    if not self.__input:
+      reply = self.__send({"op": "read"}, reply = True)
+
+      if reply.get("error"):
+        self.disconnect()
+        raise IOError("Stream Deck daemon: {}".format(reply["error"]))
+
+      self.__input = [decode_control_states(s) for s in reply["states"]]
+
+    return self.__input.pop(0) if self.__input else None
+
+
+
+class RemoteDeviceManager():
+  """Stand-in for the StreamDeck library's DeviceManager, which enumerates the
+  devices owned by the daemon, starting the daemon if it isn't running
+  """
+
+  # Seconds to wait for a daemon we started to be ready
+  START_TIMEOUT = 3
+
+  # Seconds after which a daemon we started exits when it has no clients left
+  EXIT_AFTER = 600
+
+
+
+  def __init__(self, socket_path = "", python_executable = "",
+		start_daemon = True):
+    """__init__ method
+    If socket_path is empty, use the default socket - see
+    default_socket_path()
+    python_executable is the Python interpreter to start the daemon with - see
+    render_worker.find_python_executable()
+    """
+
+    self.socket_path = socket_path
+    self.python_executable = python_executable
+    self.start_daemon = start_daemon
+
+
+
+  def connect(self):
+    """Connect to the daemon, starting it first if it isn't running
+    Return the connected socket
+    """
+
+    if not hasattr(socket, "AF_UNIX"):
+      raise IOError("Stream Deck daemon not supported on this platform")
+
+    if not self.socket_path:
+      self.socket_path = default_socket_path()
+
+    try:
+      return self.__connect()
+
+    except OSError as e:
+      if not self.start_daemon:
+        raise IOError("Stream Deck daemon not running: {}".format(e))
+
+    self.start()
+
+    timeout = time() + self.START_TIMEOUT
+    while True:
+      try:
+        return self.__connect()
+      except OSError as e:
+        if time() > timeout:
+          raise IOError("Stream Deck daemon not started: {}".format(e))
+      sleep(0.05)
+
+
+
+  def __connect(self):
+    """Connect to the daemon's socket
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      sock.connect(self.socket_path)
+    except:
+      sock.close()
+      raise
+
+    return sock
+
+
+
+  def start(self):
+    """Start the daemon in the background, in its own session so it outlives
+    FreeCAD, until it's been left without clients for EXIT_AFTER seconds
+    """
+
+    from render_worker import find_python_executable
+
+    python = find_python_executable(self.python_executable)
+    if python is None:
+      raise IOError("Python interpreter to start the Stream Deck daemon "
+			"with not found")
+
+    subprocess.Popen([python, os.path.abspath(__file__),
+			"--socket", self.socket_path,
+			"--exit-after", str(self.EXIT_AFTER)],
+			stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL,
+			stderr = subprocess.DEVNULL, close_fds = True,
+			start_new_session = True)
+
+
+
+  def enumerate(self):
+    """Return the devices owned by the daemon
+    """
+
+    sock = self.connect()
+    try:
+      send_message(sock, {"op": "enumerate"})
+      reply, _ = recv_message(sock)
+    finally:
+      sock.close()
+
+    return [RemoteStreamDeck(self, info) for info in reply["devices"]]
+
+
+
+## Routines
+#
+
+def default_socket_path():
+  """Return the path of the daemon's socket in the user's runtime directory,
+  or if there isn't one, in a directory of the temporary directory that only
+  the user can access, created if it doesn't exist
+  Raise IOError if that directory can be accessed by other users
+  """
+
+  runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+  if runtime_dir:
+    return os.path.join(runtime_dir, "freecad-streamdeck.sock")
+
+  import tempfile
+
+  private_dir = os.path.join(tempfile.gettempdir(),
+				"freecad-streamdeck-{}".format(os.getuid()))
+
+  # Don't use a directory another user created or can write to, or they could
+  # put their own socket in it
+  try:
+    os.mkdir(private_dir, 0o700)
+  except FileExistsError:
+    pass
+
+  st = os.lstat(private_dir)
+  if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+		st.st_mode & 0o077:
+    raise IOError("{} is not a directory only the user can access".\
+								format(private_dir))
+
+  return os.path.join(private_dir, "daemon.sock")
+
+
+
+def send_message(sock, header, payload = b""):
+  """Send a message: a JSON header followed by a binary payload, preceded by
+  their lengths
+  """
+
+  h = json.dumps(header, separators = (",", ":")).encode()
+  sock.sendall(struct.pack("!II", len(h), len(payload)) + h + payload)
+
+
+
+def recv_message(sock):
+  """Receive a message sent by send_message()
+  Return the header and the payload
+  Raise EOFError if the connection was closed
+  """
+
+  header_len, payload_len = struct.unpack("!II", _recv_exactly(sock, 8))
+
+  return json.loads(_recv_exactly(sock, header_len)), \
+		_recv_exactly(sock, payload_len)
+
+
+
+def _recv_exactly(sock, n):
+  """Receive exactly n bytes
+  """
+
+  data = bytearray()
+  while len(data) < n:
+    chunk = sock.recv(n - len(data))
+    if not chunk:
+      raise EOFError("connection closed")
+    data.extend(chunk)
+
+  return bytes(data)
+
+
+
+## Main routine
+#
+
+def main():
+  """Main routine
+  """
+
+  argparser = argparse.ArgumentParser(description = __doc__.split("\n")[2],
+					formatter_class = \
+					argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("-s", "--socket", default = "",
+				help = "Socket to listen on (default: "
+					"freecad-streamdeck.sock in "
+					"$XDG_RUNTIME_DIR, or a directory of "
+					"the temporary directory only the "
+					"user can access)")
+  argparser.add_argument("-l", "--linger", type = float, default = 10,
+				help = "Seconds to keep displaying the keys of "
+					"a client after it disconnects, so it "
+					"gets its keys back if it reconnects "
+					"(default: %(default)s)")
+  argparser.add_argument("-x", "--exit-after", type = float, default = 0,
+				help = "Seconds after which to exit without "
+					"clients, 0 to never exit "
+					"(default: %(default)s)")
+  argparser.add_argument("-S", "--simulate", action = "append",
+				default = [],
+				help = "Stream Deck model to simulate, along "
+					"with the real devices. Can be repeated")
+  args = argparser.parse_args()
+
+  import signal
+
+  try:
+    daemon = DeckDaemon(args.socket or default_socket_path(), args.linger,
+			args.exit_after, args.simulate)
+  except (ValueError, IOError) as e:
+    print("Stream Deck daemon: {}".format(e))
+    return 1
+
+  # Stop serving cleanly when terminated
+  signal.signal(signal.SIGTERM,
+		lambda *_: Thread(target = daemon.stop, daemon = True).start())
+
+  error = daemon.serve()
+  if error is not None:
+    print("Stream Deck daemon: {}".format(error))
+    return 1
+
+  return 0
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,547 @@
+"""FreeCAD Stream Deck Addon - Stream Deck key surface pipeline class
+"""
+
+## Modules
+#
+
+from time import perf_counter
+
+from streamdeck_comm import StreamDeck
+from streamdeck_pages import StreamDeckPages
+from tick_profiler import profiler
+from perf_counters import counters
+
+
+
+## Classes
+#
+
+class DeckPipeline():
+  """Key surface made of a single Stream Deck device, or of several devices
+  acting as one combined key surface, with its own pages, input handling and
+  writer threads
+  The toolbar actions and the rendered key images are shared between all the
+  pipelines
+  """
+
+  def __init__(self, streamdecks):
+    """__init__ method
+    streamdecks is the list of open StreamDeck objects making up the key
+    surface, in the order their keys are laid out on the surface
+    """
+
+    self.streamdecks = streamdecks
+
+    # Map the key numbers of the key surface to the devices' key numbers
+    self.key_map = [(sd, keyno) for sd in streamdecks \
+				for keyno in range(sd.nbkeys)]
+    self.key_offsets = {}
+    for keyno, (sd, sd_keyno) in enumerate(self.key_map):
+      self.key_offsets.setdefault(sd, keyno)
+
+    self.nbkeys = len(self.key_map)
+
+    # Position of each key of the key surface: device and row and column on
+    # the device
+    self.__key_positions = []
+    for sd, sd_keyno in self.key_map:
+      _, nbcols = sd.dev.key_layout()
+      self.__key_positions.append((sd, *divmod(sd_keyno, nbcols)))
+
+    self.nbdials = sum([sd.nbdials for sd in streamdecks])
+    self.__sd_nbkeys = {sd: sd.nbkeys for sd in streamdecks}
+
+    self.name = " + ".join(['"{}"'.format(sd.dev.deck_type()) \
+				for sd in streamdecks])
+
+    self.pages = StreamDeckPages(self.nbkeys, self.nbdials == 0)
+
+    self.last_action_pressed = None
+    self.last_key_pressed = None
+    self.update_keys_needed = False
+    self.keys_pending = False
+
+    # Descriptions of the images last uploaded to the keys of the key surface,
+    # or None if unknown
+    self.__uploaded = [None] * self.nbkeys
+
+    # Regions of the touchscreens of the devices that have one, above each
+    # dial, the (title, text) last uploaded to each region or None if unknown,
+    # and the pages and current page number they were last updated for
+    self.__touchscreen_regions = {sd: sd.touchscreen_regions() \
+					for sd in streamdecks}
+    self.__touchscreen_uploaded = {sd: [None] * len(regions) \
+					for sd, regions in \
+					self.__touchscreen_regions.items()}
+    self.__touchscreen_shown = None
+
+    # Devices closed because of an error, with the number of attempts to
+    # reconnect them and when to try next
+    self.__reconnect = {}
+
+    # Write to the devices from their own threads
+    for sd in streamdecks:
+      sd.start_writer()
+
+
+
+  def is_open(self):
+    """Return whether all the devices of the key surface are open
+    """
+
+    return not self.__reconnect
+
+
+
+  def close(self):
+    """Close all the devices of the key surface
+    """
+
+    for sd in self.streamdecks:
+      sd.close()
+
+    self.__reconnect.clear()
+
+
+
+  def device_lost(self, streamdeck):
+    """Close a device after an I/O error and schedule its first reconnection
+    attempt right away
+    """
+
+    streamdeck.close()
+    self.__reconnect[streamdeck] = (0, 0)
+
+
+
+  def reconnect(self, now, max_attempts, first_delay, max_delay,
+		exclude_ids = ()):
+    """Try to reopen the devices closed because of an error whose reconnection
+    attempts are due, backing off exponentially between attempts
+    If a device comes back with the same key geometry, keep the pages and only
+    upload its keys of the current page again
+    exclude_ids are the IDs of the devices open by other key surfaces, which
+    shouldn't be touched
+    Return False if a device couldn't be reopened after max_attempts attempts,
+    True otherwise
+    """
+
+    for sd in list(self.__reconnect):
+      attempt, at_tstamp = self.__reconnect[sd]
+
+      if now < at_tstamp:
+        continue
+
+      geometry = sd.geometry
+      if sd.reopen(exclude_ids) and sd.geometry == geometry and \
+		sd.nbkeys == self.__sd_nbkeys[sd]:
+        print('Stream Deck {} reconnected after {} attempt{}'.
+		format(self.name, attempt + 1, "" if not attempt else "s"))
+
+        sd.start_writer()
+        del(self.__reconnect[sd])
+        counters.count("reconnects")
+
+        # Upload all the keys of the device again, and its touchscreen
+        for keyno, (s, _) in enumerate(self.key_map):
+          if s is sd:
+            self.__uploaded[keyno] = None
+        self.update_keys_needed = True
+
+        self.__touchscreen_uploaded[sd] = \
+			[None] * len(self.__touchscreen_regions[sd])
+        self.__touchscreen_shown = None
+
+      else:
+        sd.close()
+        attempt += 1
+
+        if attempt >= max_attempts:
+          return False
+
+        self.__reconnect[sd] = (attempt, now + min(max_delay, first_delay * \
+							2 ** (attempt - 1)))
+
+    return True
+
+
+
+  def reconnect_delay(self, now):
+    """Return how long until the next reconnection attempt is due, or None if
+    no device needs reconnecting
+    """
+
+    if not self.__reconnect:
+      return None
+
+    return max(0, min([at for _, at in self.__reconnect.values()]) - now)
+
+
+
+  def get_input_events(self, long_keypress_duration):
+    """Get the input events of all the devices, with the key numbers mapped
+    to the key surface
+    Return a list of (event_type, keyno or dial_spin_clicks) tuples
+    """
+
+    input_events = []
+
+    for sd in self.streamdecks:
+
+      try:
+        for event_type, val in sd.get_input_events(long_keypress_duration):
+          input_events.append((event_type,
+				val if event_type == sd.DIAL_SPIN_CLICKS \
+					else val + self.key_offsets[sd]))
+
+      except:
+        self.device_lost(sd)
+
+    return input_events
+
+
+
+  def process_input_events(self, input_events, tbactions):
+    """Act upon the input events: trigger actions, flip pages, expand or
+    collapse actions
+    Return True if an action's expansion was toggled, and therefore the toolbar
+    actions should be updated and the pages rebuilt right away
+    """
+
+    update_actions = False
+
+    # Process Stream Deck input events if a current page is displayed
+    if not self.pages.current_page:
+      return update_actions
+
+    keystrings = self.pages.current_page.split(self.pages.SK)
+
+    for event_type, val in input_events:
+
+      # Is the event a key press?
+      if event_type in (StreamDeck.SHORT_KEYPRESS, StreamDeck.LONG_KEYPRESS):
+
+        self.last_key_pressed = val
+
+        # Get the action name
+        n = keystrings[val].split(self.pages.SV)[1]
+
+        # Is the key occupied?
+        if n:
+
+          # Change the page
+          if n in ("PAGEPREV", "PAGENEXT"):
+            self.last_action_pressed = None
+            if self.pages.flip(1 if n == "PAGENEXT" else -1):
+              self.update_keys_needed = True
+
+          # Act upon a real action
+          else:
+            self.last_action_pressed = tbactions.actions[n]
+
+            # Is the event a long key press?
+            if event_type == StreamDeck.LONG_KEYPRESS:
+
+              # If the action is expandable, toggle its expansion and
+              # force-rebuild all the pages
+              if n in tbactions.expanded_actions:
+                tbactions.expanded_actions[n] = \
+			not tbactions.expanded_actions[n]
+                update_actions = True
+
+              # If the action is a subaction of another action toggle the
+              # parent action's expansion and force-rebuild all the pages
+              elif tbactions.actions[n].issubactionof is not None and \
+			tbactions.actions[n].issubactionof in \
+					tbactions.expanded_actions:
+                tbactions.expanded_actions[
+				tbactions.actions[n].issubactionof] = \
+			not tbactions.expanded_actions[
+				tbactions.actions[n].issubactionof]
+                update_actions = True
+
+            # If the event is a short key press and the action is enabled,
+            # execute it
+            elif tbactions.actions[n].enabled:
+              tbactions.actions[n].action.trigger()
+              tbactions.record_use(n)
+
+      # Is the event a dial spin?
+      elif event_type == StreamDeck.DIAL_SPIN_CLICKS:
+
+        # Flip as many pages as we got dial clicks
+        self.last_action_pressed = None
+        if self.pages.flip(val):
+          self.update_keys_needed = True
+
+    return update_actions
+
+
+
+  def rebuild_pages(self, tbactions, params, new_toolbar, built_pages):
+    """Rebuild the pages using the toolbar actions, then find the new location
+    of the current page in the newly-rebuilt pages and update it
+    built_pages holds the pages already rebuilt for other key surfaces during
+    the same update, keyed by number of keys and navigation keys, so key
+    surfaces of the same size share them instead of rebuilding them
+    """
+
+    surface = (self.pages.nb_streamdeck_keys, self.pages.with_nav_keys)
+
+    if surface in built_pages:
+      self.pages.share_pages(built_pages[surface])
+
+    else:
+      with profiler.phase("page rebuild"):
+        self.pages.rebuild_pages(tbactions, params.repeated_toolbars,
+				params.bracket_color_repeated_toolbars,
+				params.bracket_color_page_nav_keys,
+				params.bracket_color_expandable_tools,
+				params.pack_toolbars,
+				tbactions.toolbar_ranks \
+					if params.order_toolbars_by_usage \
+					else None)
+      built_pages[surface] = self.pages
+      counters.count("page_rebuilds")
+
+    with profiler.phase("page locate"):
+      self.pages.locate_current_page(new_toolbar, self.last_action_pressed)
+
+    self.update_keys_needed = True
+
+
+
+  def prerender_static_keys(self, renderer, bracket_colors):
+    """Render the keys that don't depend on the toolbars ahead of time for the
+    devices of the key surface, so blank keys and page navigation placeholders
+    only cost a USB write when they're displayed
+    """
+
+    describe_key = lambda key_desc: self.__describe_key(key_desc, None, None)
+
+    renderer.render_keys([(sd, key_desc, describe_key) \
+				for sd in self.streamdecks if sd.is_open() \
+				for key_desc in \
+					self.pages.static_key_descs(bracket_colors)],
+				static = True)
+
+
+
+  def update_keys(self, tbactions, renderer, icon_images, deadline = None):
+    """Upload the keys of the current page whose images differ from the images
+    last uploaded to them - all the keys of the devices that were just
+    reconnected for instance. Clear all the keys if there isn't a current page
+    The keys are updated starting from the key last pressed and moving outward
+    If deadline - a perf_counter() timestamp - is passed before all the keys
+    are updated, stop and leave update_keys_needed set, so the remaining keys
+    are updated by the next call
+    Keys being rendered by the render worker process are uploaded by a later
+    call, once their images are rendered: keys_pending is set in the meantime
+    icon_images holds the icons already converted during the same update, so
+    key surfaces with different geometries don't convert them again
+    """
+
+    if not self.is_open():
+      return
+
+    self.update_keys_needed = False
+    self.keys_pending = False
+
+    # Get the descriptions of the keys - i.e. the key strings without the
+    # toolbar marker - to display
+    if self.pages.current_page:
+      key_descs = [ks.split(self.pages.SV, 1)[1] \
+			for ks in self.pages.current_page.split(self.pages.SK)]
+    else:
+      key_descs = [""] * self.nbkeys
+
+    # Find the keys that need updating, closest to the key last pressed first
+    keynos = sorted([keyno for keyno, key_desc in enumerate(key_descs) \
+				if key_desc != self.__uploaded[keyno]],
+			key = self.__distance_to_last_key_pressed)
+
+    describe_key = lambda key_desc: self.__describe_key(key_desc, tbactions,
+								icon_images)
+
+    # Update the keys in chunks of as many keys as can be rendered in parallel,
+    # until we run out of keys or time
+    chunk_size = max(1, renderer.nb_threads)
+
+    for i in range(0, len(keynos), chunk_size):
+
+      if deadline is not None and i and perf_counter() >= deadline:
+        self.update_keys_needed = True
+        return
+
+      chunk = keynos[i:i + chunk_size]
+
+      # Render the keys all at once - or get them from the render cache - and
+      # hand them over to each device in one batch
+      native_images = renderer.render_keys([(self.key_map[keyno][0],
+						key_descs[keyno], describe_key) \
+						for keyno in chunk])
+
+      batches = {}
+      for keyno, native_image in zip(chunk, native_images):
+        if native_image is None:
+          self.keys_pending = True
+        else:
+          sd, sd_keyno = self.key_map[keyno]
+          batches.setdefault(sd, []).append((keyno, sd_keyno, native_image))
+
+      for sd, batch in batches.items():
+        try:
+          sd.set_key_images([(sd_keyno, native_image) \
+				for _, sd_keyno, native_image in batch])
+        except:
+          self.device_lost(sd)
+          return
+
+        for keyno, _, _ in batch:
+          self.__uploaded[keyno] = key_descs[keyno]
+
+
+
+  def update_touchscreens(self, enabled):
+    """Show where the current page is on the touchscreens of the devices that
+    have one, one piece of information above each dial: the toolbars before
+    and after the current toolbar's pages, the current toolbar and the page
+    number. Only the regions whose content has changed are rendered and
+    uploaded again. If enabled is False, blank the touchscreens
+    """
+
+    if not self.is_open() or not any(self.__touchscreen_regions.values()):
+      return
+
+    # Don't do anything if the pages haven't changed and the same page is
+    # still displayed
+    shown = (self.pages.pages, self.pages.current_page_no, enabled)
+    if self.__touchscreen_shown is not None and \
+		shown[0] is self.__touchscreen_shown[0] and \
+		shown[1:] == self.__touchscreen_shown[1:]:
+      return
+
+    self.__touchscreen_shown = shown
+
+    position = self.pages.current_page_position() if enabled else None
+
+    for sd, regions in self.__touchscreen_regions.items():
+      if not regions:
+        continue
+
+      # Lay out what to show in the regions: the toolbars around the current
+      # toolbar if there are enough regions
+      contents = []
+      if position is not None:
+        t, tp, tnb, prev_t, next_t, p, nb = position
+        current = ("Toolbar {}/{}".format(tp, tnb) if tnb > 1 \
+			else "Toolbar", t)
+        page = ("Page", "{} / {}".format(p, nb))
+
+        contents = [("Previous", prev_t) if prev_t else ("", ""), current,
+			page, ("Next", next_t) if next_t else ("", "")] \
+			if len(regions) >= 4 else [current, page]
+
+      contents = (contents + [("", "")] * len(regions))[:len(regions)]
+
+      for i, (region, content) in enumerate(zip(regions, contents)):
+        if content == self.__touchscreen_uploaded[sd][i]:
+          continue
+
+        x, y, width, height = region
+        try:
+          sd.set_touchscreen_image(sd.render_touchscreen_region(
+							(width, height),
+							*content),
+					x, y, width, height)
+        except:
+          self.device_lost(sd)
+          return
+
+        self.__touchscreen_uploaded[sd][i] = content
+
+
+
+  def __distance_to_last_key_pressed(self, keyno):
+    """Sort key for the keys of the key surface: keys of the device the last
+    key was pressed on first, ordered by their distance to that key, then the
+    keys of the other devices. Keep the keys in order if no key was pressed
+    """
+
+    if self.last_key_pressed is None:
+      return (0, 0, keyno)
+
+    sd, row, col = self.__key_positions[keyno]
+    pressed_sd, pressed_row, pressed_col = \
+			self.__key_positions[self.last_key_pressed]
+
+    return (0 if sd is pressed_sd else 1,
+		(row - pressed_row) ** 2 + (col - pressed_col) ** 2, keyno)
+
+
+
+  def __describe_key(self, key_desc, tbactions, icon_images):
+    """Return the image, top text, bottom text and bracket colors to render a
+    key described by its key description. If key_desc is empty, the key is
+    blank
+    """
+
+    if not key_desc:
+      return None, None, None, None, None
+
+    n, enabled, iconid, tt, bt, lbc, rbc = key_desc.split(self.pages.SV)
+
+    if n in ("", "PAGEPREV", "PAGENEXT"):
+      img = n
+
+    else:
+      if (n, enabled, iconid) not in icon_images:
+        icon_images[(n, enabled, iconid)] = \
+			tbactions.actions[n].icon_as_pil_image()
+      img = icon_images[(n, enabled, iconid)]
+
+    return img, tt, bt, lbc, rbc
+
+
+
+  def power_down(self, wake, poll_every):
+    """Blank the displays of all the devices and wait for input from them in
+    watcher threads instead of reading them in the update loop, until
+    power_up() is called. wake() is called from a watcher thread as soon as
+    any device is touched or fails. Devices that can't be read blocking are
+    read every poll_every seconds - see StreamDeck.start_wake_watcher()
+    """
+
+    for sd in self.streamdecks:
+      if sd.is_open():
+        try:
+          sd.blank()
+          sd.start_wake_watcher(wake, poll_every)
+        except:
+          self.device_lost(sd)
+
+
+
+  def power_up(self):
+    """Stop watching the devices, so the update loop reads them again once
+    their watchers are done with their last read, without waiting for them.
+    Their displays are turned back on by the next set_brightness()
+    """
+
+    for sd in self.streamdecks:
+      sd.stop_wake_watcher()
+
+
+
+  def set_brightness(self, min_brightness, max_brightness, fade_time,
+			user_active, fade_gamma = 1):
+    """Set the brightness of the displays of all the devices
+    """
+
+    for sd in self.streamdecks:
+      if sd.is_open():
+        try:
+          sd.set_brightness(min_brightness, max_brightness, fade_time,
+				user_active, fade_gamma)
+        except:
+          self.device_lost(sd)
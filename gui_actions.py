@@ -6,6 +6,8 @@
 
 import re
 import io
+import sys
+from time import time
 from PIL import Image
 
 from PySide import QtCore, QtGui
@@ -19,6 +21,12 @@ class Action():
   """Single known displayed action descriptor
   """
 
+  __slots__ = ("name", "toolbar", "action", "enabled", "title", "iconid",
+		"stale", "__title_stale", "issubactionof", "islastsubaction",
+		"last_seen_refresh", "last_seen_tstamp")
+
+
+
   def __init__(self, name, toolbar, action, issubactionof = None):
     """__init__ method
     """
@@ -28,28 +36,61 @@ class Action():
     self.toolbar = toolbar
     self.action = action
 
-    self.enabled = action.isEnabled()
-    self.title = action.iconText()
-    self.iconid = action.icon().cacheKey()
+    # The state of the action isn't queried until the first refresh(), so the
+    # actions on the pages that aren't displayed cost nothing to create
+    self.enabled = False
+    self.title = ""
+    self.iconid = None
+
+    self.stale = True			# Whether the state of the action may
+					# have changed since it was last queried
+    self.__title_stale = True
 
     self.issubactionof = issubactionof	# If the action is a menu item,
 					# of which action
     self.islastsubaction = False	# If the action is a menu item, whether
 					# it's the last item in the menu
 
+    self.last_seen_refresh = None	# When the action was last found in
+    self.last_seen_tstamp = None	# the toolbars
 
 
-  def update(self, toolbar, action):
+
+  def update(self, toolbar, action, refresh = True):
     """Update this Action object with new toolbar and action data as needed
+    If refresh is not asserted, don't query the state of the action yet: only
+    mark it stale
     """
 
     if self.toolbar != toolbar:
       self.toolbar = toolbar
       self.action = action
-      self.title = action.iconText()
+      self.__title_stale = True
+
+    self.stale = True
+
+    if refresh:
+      self.refresh()
+
 
-    self.iconid = action.icon().cacheKey()
-    self.enabled = action.isEnabled()
+
+  def refresh(self):
+    """Query the current state of the action from the GUI
+    Return True if it has changed
+    """
+
+    state = (self.title, self.iconid, self.enabled)
+
+    if self.__title_stale:
+      self.title = self.action.iconText()
+      self.__title_stale = False
+
+    self.iconid = self.action.icon().cacheKey()
+    self.enabled = self.action.isEnabled()
+
+    self.stale = False
+
+    return (self.title, self.iconid, self.enabled) != state
 
 
 
@@ -79,6 +120,10 @@ class ToolbarActions():
   """Toolbar and toolbar actions extracted from the GUI
   """
 
+  # Half-life of the toolbar usage scores in seconds: a use counts half as
+  # much an hour later
+  usage_half_life = 3600
+
   def __init__(self, main_window, action_changed_callback):
     """__init__ method
     """
@@ -94,16 +139,32 @@ class ToolbarActions():
 
     self.expanded_actions = {}
 
+    self.nb_refreshes = 0		# Number of times the toolbars were
+					# walked through
+    self.nb_connections = 0		# Number of changed signals connected
+					# to our callback
+    self.nb_forgotten = 0		# Number of actions forgotten so far
+
+    self.toolbar_usage = {}		# Toolbar name: (usage score, when
+					# the score was last updated)
+    self.toolbar_ranks = None		# Toolbar name: rank by usage when
+					# the toolbars were last ranked
+
 
 
   def extract_toolbar_actions_from_gui(self, excluded_toolbars,
-					update_actions = True):
+					update_actions = True,
+					refreshed_actions = None):
     """update the ordered list of toolbar names, toolbar actions and subactions
     from the GUI
     Excluded_toolbars is the list of toolbar names that should be ignored
     If update_actions is asserted, unconditionally update all the known actions
     If update_actions is not asserted, only update all the known actions if
     the toolbars have changed
+    refreshed_actions is the set of names of the actions whose state should be
+    queried when they're updated. The other actions, new ones included, are
+    only marked stale - see refresh_actions(). If refreshed_actions is None,
+    query the state of all the actions
     Return True if the toolbars or the actions have changed
     """
 
@@ -133,6 +194,9 @@ class ToolbarActions():
     # Should we update all the toolbar actions?
     if update_actions:
 
+      self.nb_refreshes += 1
+      now = time()
+
       self.toolbar_actions.clear()
       for i, toolbar in enumerate(tbs):
 
@@ -159,14 +223,18 @@ class ToolbarActions():
 
               # Add the action to the list of known actions if it isn't
               # already known and connect its changed signal to our callback,
-              # otherwise update the known action
+              # then update the known action
               if n not in self.actions:
                 self.actions[n] = Action(n, t, action)
                 action.changed.connect(self.action_changed_callback)
-              else:
-                self.actions[n].update(t, action)
+                self.nb_connections += 1
+              self.actions[n].update(t, action, refreshed_actions is None \
+						or n in refreshed_actions)
               self.toolbar_actions[t].append(n)
 
+              self.actions[n].last_seen_refresh = self.nb_refreshes
+              self.actions[n].last_seen_tstamp = now
+
               # Does the button have a menu associated with it?
               m = button.findChildren(QtGui.QMenu)
               if m:
@@ -197,15 +265,20 @@ class ToolbarActions():
 
                       # Add the subaction to the list of known actions if it
                       # isn't already known and connect its changed signal to
-                      # our callback, otherwise update the known action
+                      # our callback, then update the known action
                       if sn not in self.actions:
                         self.actions[sn] = Action(sn, t, subaction,
 							issubactionof = n)
                         subaction.changed.connect(self.action_changed_callback)
-                      else:
-                        self.actions[sn].update(t, subaction)
+                        self.nb_connections += 1
+                      self.actions[sn].update(t, subaction,
+						refreshed_actions is None or \
+						sn in refreshed_actions)
                       self.toolbar_actions[t].append(sn)
 
+                      self.actions[sn].last_seen_refresh = self.nb_refreshes
+                      self.actions[sn].last_seen_tstamp = now
+
                       last_subaction = sn
 
                   # Mark the last subaction in this menu
@@ -217,3 +290,119 @@ class ToolbarActions():
 
     # Signal that the actions have not been updated
     return False
+
+
+
+  def refresh_actions(self, names):
+    """Query the state of the stale actions among the named actions, typically
+    because they're about to be displayed
+    Return True if the state of any of them has changed
+    """
+
+    changed = False
+
+    for n in names:
+      action = self.actions.get(n)
+      if action is not None and action.stale and action.refresh():
+        changed = True
+
+    return changed
+
+
+
+  def record_use(self, name):
+    """Record that an action was used in the usage score of its toolbar. The
+    score decays over time, so recent uses count more than older ones
+    """
+
+    action = self.actions.get(name)
+    if action is None:
+      return
+
+    now = time()
+    score, tstamp = self.toolbar_usage.get(action.toolbar, (0, now))
+    self.toolbar_usage[action.toolbar] = \
+		(score * 0.5 ** ((now - tstamp) / self.usage_half_life) + 1, now)
+
+
+
+  def rank_toolbars(self):
+    """Rank the current toolbars by usage score, most used first, keeping the
+    order of the GUI for toolbars used as much. The ranks are only updated
+    when this is called, so the pages don't move while they're being used
+    """
+
+    now = time()
+
+    scores = {t: score * 0.5 ** ((now - tstamp) / self.usage_half_life) \
+		for t, (score, tstamp) in self.toolbar_usage.items()}
+
+    self.toolbar_ranks = {t: i for i, t in \
+				enumerate(sorted(self.toolbars,
+						key = lambda t: -scores.get(t, 0)))}
+
+
+
+  def forget_unseen_actions(self, max_refreshes, max_secs):
+    """Forget about the known actions that haven't been found in the toolbars
+    for more than max_refreshes walks through the toolbars or more than
+    max_secs seconds - typically the actions of workbenches that haven't been
+    used in a while - and disconnect their changed signals. If max_refreshes or
+    max_secs is 0, don't forget actions based on it
+    Actions found in the toolbars again later are simply rediscovered
+    Return the number of actions forgotten
+    """
+
+    now = time()
+
+    names = [n for n, a in self.actions.items() \
+		if a.last_seen_refresh is not None and \
+			((max_refreshes and self.nb_refreshes - \
+				a.last_seen_refresh > max_refreshes) or \
+			(max_secs and now - a.last_seen_tstamp > max_secs))]
+
+    self.forget_actions(names)
+
+    return len(names)
+
+
+
+  def forget_actions(self, names = None):
+    """Forget about the named known actions, or about all the known actions if
+    names is None, and disconnect their changed signals. The expansion state
+    of expanded actions is kept
+    """
+
+    for n in list(self.actions) if names is None else names:
+      a = self.actions.pop(n)
+
+      # The action may have been deleted already along with its toolbar
+      try:
+        a.action.changed.disconnect(self.action_changed_callback)
+      except:
+        pass
+      self.nb_connections -= 1
+      self.nb_forgotten += 1
+
+      if not self.expanded_actions.get(n, True):
+        del(self.expanded_actions[n])
+
+
+
+  def stats(self):
+    """Return statistics about the known actions as a dictionary: how many are
+    known, how many signals are connected, how many actions were forgotten,
+    how many times the toolbars were walked through and the approximate memory
+    used by the known actions in bytes
+    """
+
+    memory = sys.getsizeof(self.actions) + \
+		sys.getsizeof(self.expanded_actions) + \
+		sum([sys.getsizeof(n) + sys.getsizeof(a) + \
+			sys.getsizeof(a.title) for n, a in self.actions.items()])
+
+    return {"actions": len(self.actions),
+		"connections": self.nb_connections,
+		"forgotten": self.nb_forgotten,
+		"refreshes": self.nb_refreshes,
+		"memory_bytes": memory}
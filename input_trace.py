@@ -0,0 +1,166 @@
+"""FreeCAD Stream Deck Addon - Input trace recorder class
+"""
+
+## Modules
+#
+
+import json
+from time import perf_counter
+from enum import Enum
+
+
+
+## Classes
+#
+
+class InputTrace():
+  """Recorder of what drives the addon - the raw control states read from the
+  Stream Deck devices, the devices opened, the parameter changes and the
+  toolbar changes - with their timestamps, one JSON object per line, so a
+  session can be replayed against a simulated device later on
+
+  Each line holds the seconds since the recording started in "t", the type of
+  event in "ev" and the event's data:
+
+    {"t": 0, "ev": "start", "version": 1}
+    {"t": ..., "ev": "params", "params": [[group path, name, type, value]...]}
+    {"t": ..., "ev": "device", "id": ..., "type": ..., "keys": ...,
+							"dials": ...}
+    {"t": ..., "ev": "read", "id": ..., "states": {control type: ...}}
+    {"t": ..., "ev": "toolbars", "toolbars": [[name, nb actions]...]}
+
+  When the recorder isn't recording, recording an event costs next to nothing
+  """
+
+  version = 1
+
+
+
+  def __init__(self):
+    """__init__ method
+    """
+
+    self.filename = ""
+    self.recording = False
+
+    self.__f = None
+    self.__t0 = None
+
+
+
+  def start(self, filename):
+    """Start recording to a file, after stopping the current recording if any
+    Return an error message, or None if the recording has started
+    """
+
+    self.stop()
+
+    try:
+      self.__f = open(filename, "w")
+
+    except Exception as e:
+      return str(e)
+
+    self.filename = filename
+    self.recording = True
+    self.__t0 = perf_counter()
+
+    self.record("start", version = self.version)
+
+    return None
+
+
+
+  def stop(self):
+    """Stop recording and close the file. Ignore errors
+    """
+
+    if self.__f is not None:
+      try:
+        self.__f.close()
+      except:
+        pass
+
+    self.__f = None
+    self.recording = False
+
+
+
+  def record(self, ev, **data):
+    """Record an event with its data, if recording. Stop recording if the
+    event can't be written
+    """
+
+    if not self.recording:
+      return
+
+    event = {"t": round(perf_counter() - self.__t0, 6), "ev": ev}
+    event.update(data)
+
+    try:
+      self.__f.write(json.dumps(event, separators = (",", ":")) + "\n")
+
+    except:
+      self.stop()
+
+
+
+## Routines
+#
+
+def encode_control_states(states):
+  """Return control states returned by a device's _read_control_states() with
+  their enums replaced by their names, ready to be written as JSON
+  """
+
+  if isinstance(states, Enum):
+    return states.name
+
+  if isinstance(states, dict):
+    return {encode_control_states(k): encode_control_states(v) \
+		for k, v in states.items()}
+
+  if isinstance(states, (list, tuple)):
+    return [encode_control_states(v) for v in states]
+
+  return states
+
+
+
+def decode_control_states(states):
+  """Turn control states read from a trace back into what a device's
+  _read_control_states() returns
+  """
+
+  from StreamDeck.Devices.StreamDeck import ControlType, DialEventType, \
+						TouchscreenEventType
+
+  decoded = {}
+
+  for ct, v in states.items():
+    ct = ControlType[ct]
+
+    if ct == ControlType.DIAL:
+      v = {DialEventType[dt]: dv for dt, dv in v.items()}
+
+    elif ct == ControlType.TOUCHSCREEN:
+      v = (TouchscreenEventType[v[0]], v[1])
+
+    decoded[ct] = v
+
+  return decoded
+
+
+
+def read_trace(filename):
+  """Read the events of a trace file
+  Return the list of events as dictionaries
+  """
+
+  with open(filename, "r") as f:
+    return [json.loads(l) for l in f if l.strip()]
+
+
+
+# Input trace recorder shared by the whole addon
+input_trace = InputTrace()
@@ -0,0 +1,158 @@
+"""FreeCAD Stream Deck Addon - Key label cache class
+"""
+
+## Modules
+#
+
+from collections import OrderedDict
+from threading import Lock
+
+from PIL import Image, ImageDraw
+
+
+
+## Classes
+#
+
+class KeyLabels():
+  """Least-recently-used cache of the labels written at the top and bottom of
+  the keys, fitted to the width of the keys and pre-rendered as masks, keyed
+  by text, position, font and key size, so composing a key only blits the
+  label masks onto the canvas
+
+  Labels too wide for the keys are written with a smaller font, down to a
+  minimum size, and ellipsized if they're still too wide
+  """
+
+  # Horizontal space left on each side of the labels, in pixels
+  side_margin = 2
+
+  ellipsis = "…"
+
+
+
+  def __init__(self, max_entries = 4096):
+    """__init__ method
+    """
+
+    self.max_entries = max_entries
+
+    self.__cache = OrderedDict()
+    self.__lock = Lock()
+    self.__font_variants = {}
+
+    self.hits = 0
+    self.misses = 0
+
+
+
+  def __font_variant(self, font, size):
+    """Return the same font as font in a different size
+    """
+
+    key = (font.path, font.size, size)
+
+    if key not in self.__font_variants:
+      self.__font_variants[key] = font if size == font.size else \
+					font.font_variant(size = size)
+
+    return self.__font_variants[key]
+
+
+
+  def fit(self, text, font, width):
+    """Fit a text within a width: use the font if the text fits, or a smaller
+    version of the font down to 3/4 of its size, and ellipsize the text if it
+    still doesn't fit at the smallest size
+    Return the fitted text and the font to write it with
+    """
+
+    if font.getlength(text) <= width:
+      return text, font
+
+    min_size = max(8, round(font.size * 3 / 4))
+
+    # If the font is already at or below the minimum size, the text is only
+    # ellipsized
+    f = font
+
+    for size in range(font.size - 1, min_size - 1, -1):
+      f = self.__font_variant(font, size)
+      if f.getlength(text) <= width:
+        return text, f
+
+    # Find the longest beginning of the text that fits with an ellipsis
+    lo, hi = 0, len(text)
+    while lo < hi:
+      n = (lo + hi + 1) // 2
+      if f.getlength(text[:n].rstrip() + self.ellipsis) <= width:
+        lo = n
+      else:
+        hi = n - 1
+
+    return text[:lo].rstrip() + self.ellipsis, f
+
+
+
+  def get(self, text, anchor, font, size):
+    """Return the mask of a label at the top ("mt") or at the bottom ("mb") of
+    a key of the given size, fitted to the width of the key, as a PIL image
+    cropped to the pixels the label covers, and the position of its top left
+    corner in the key. The mask is None if the label is empty
+    """
+
+    key = (text, anchor, font.path, font.size, size)
+
+    with self.__lock:
+      label = self.__cache.get(key)
+
+      if label is not None:
+        self.hits += 1
+        self.__cache.move_to_end(key)
+        return label
+
+      self.misses += 1
+
+    w, h = size
+    text, font = self.fit(text, font, w - 2 * self.side_margin)
+
+    # Draw the text in white over black, which gives the coverage of each
+    # pixel by the text
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).text((w / 2, 0 if anchor == "mt" else h - 1),
+				text = text, font = font, anchor = anchor,
+				fill = 255)
+
+    bbox = mask.getbbox()
+
+    label = (mask.crop(bbox), bbox[:2]) if bbox else (None, None)
+
+    with self.__lock:
+      self.__cache[key] = label
+
+      while len(self.__cache) > self.max_entries:
+        self.__cache.popitem(last = False)
+
+    return label
+
+
+
+  def clear(self):
+    """Empty the cache
+    """
+
+    with self.__lock:
+      self.__cache.clear()
+
+
+
+  def __len__(self):
+    """Return the number of labels in the cache
+    """
+
+    return len(self.__cache)
+
+
+
+# Labels shared by all the devices and render threads
+key_labels = KeyLabels()
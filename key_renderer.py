@@ -0,0 +1,221 @@
+"""FreeCAD Stream Deck Addon - Key image rendering class
+"""
+
+## Modules
+#
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from perf_counters import counters
+
+
+
+## Classes
+#
+
+class KeyRenderer():
+  """Render stage turning key descriptions into images in the native format of
+  the Stream Deck devices, through the render cache
+
+  Keys are rendered in-process right away by a pool of threads, or by the
+  render worker process if one is ready, in which case their images land in
+  the render cache when the worker's results are collected during a later
+  update
+  """
+
+  def __init__(self, render_cache, worker = None, nb_threads = 0):
+    """__init__ method
+    nb_threads is the number of threads rendering keys in-process. If it's 0,
+    use as many threads as there are processors
+    """
+
+    self.render_cache = render_cache
+    self.worker = worker
+
+    self.nb_threads = nb_threads if nb_threads else (os.cpu_count() or 1)
+    self.__pool = None
+
+    self.__next_job_id = 0
+    self.__jobs = {}			# Job ID: (geometry, key description)
+    self.__pending = set()		# (geometry, key description) being
+					# rendered by the worker
+    self.__worker_failed = set()	# (geometry, key description) the
+					# worker couldn't render
+
+    # Images of the keys that don't depend on the toolbars, rendered ahead of
+    # time and never evicted, keyed by geometry and key description
+    self.__static_keys = {}
+
+
+
+  def render_keys(self, requests, static = False):
+    """Return the images of key descriptions rendered for devices, from the
+    render cache or rendered right away, or None for the keys the worker
+    process is rendering
+    requests is a list of (streamdeck, key_desc, describe_key).
+    describe_key(key_desc) is only called if the key needs rendering, and
+    returns the (image, top_text, bottom_text, left_bracket_color,
+    right_bracket_color) to pass to the renderer - see StreamDeck.render_key()
+    The keys rendered in-process are composed and encoded in parallel by the
+    rendering threads, and the images are returned in the order of the requests
+    If static is True, the keys are static keys rendered ahead of time: they're
+    rendered in-process right away and kept for good
+    """
+
+    native_images = [None] * len(requests)
+    to_render = {}	# (geometry, key description): (streamdeck,
+			# render_key() arguments, indexes in the requests)
+
+    for i, (sd, key_desc, describe_key) in enumerate(requests):
+      job = (sd.geometry, key_desc)
+
+      if job in self.__pending:
+        continue
+
+      if job in to_render:
+        to_render[job][-1].append(i)
+        continue
+
+      native_images[i] = self.__static_keys.get(job)
+      if native_images[i] is not None:
+        continue
+
+      if not static:
+        native_images[i] = self.render_cache.get(*job)
+        if native_images[i] is not None:
+          continue
+
+      # Describe the key here, as the icons can only be rasterized in the GUI
+      # thread
+      image, tt, bt, lbc, rbc = describe_key(key_desc)
+
+      # Send the key to the worker process if it's ready and has room for it
+      if not static and self.worker is not None and \
+		job not in self.__worker_failed and \
+		self.worker.submit(self.__next_job_id,
+					sd.dev.key_image_format(), sd.margins,
+					image, tt, bt, lbc, rbc):
+        self.__jobs[self.__next_job_id] = job
+        self.__pending.add(job)
+        self.__next_job_id += 1
+        continue
+
+      to_render[job] = (sd, (image, tt, bt, lbc, rbc), [i])
+
+    if not to_render:
+      return native_images
+
+    # Render the keys, in parallel if there's more than one and we have more
+    # than one thread. PIL releases the interpreter while scaling and encoding
+    render = lambda r: r[0].render_key(*r[1])
+
+    if len(to_render) > 1 and self.nb_threads > 1:
+      if self.__pool is None:
+        self.__pool = ThreadPoolExecutor(max_workers = self.nb_threads,
+				thread_name_prefix = "Stream Deck renderer")
+      rendered = self.__pool.map(render, to_render.values())
+
+    else:
+      rendered = map(render, to_render.values())
+
+    counters.count("keys_rendered", len(to_render))
+
+    for (job, (_, _, indexes)), native_image in zip(to_render.items(),
+							rendered):
+      if static:
+        self.__static_keys[job] = native_image
+      else:
+        self.render_cache.put(*job, native_image)
+      for i in indexes:
+        native_images[i] = native_image
+
+    return native_images
+
+
+
+  def clear_static_keys(self):
+    """Forget about the static keys rendered ahead of time, when the styling of
+    the keys changes
+    """
+
+    self.__static_keys.clear()
+
+
+
+  def has_pending(self):
+    """Return whether the worker process is rendering keys
+    """
+
+    return bool(self.__pending)
+
+
+
+  def collect(self):
+    """Add the images rendered by the worker process since the last call to the
+    render cache. Keys the worker couldn't render are rendered in-process the
+    next time they're requested
+    Return True if any key was finished
+    """
+
+    if self.worker is None:
+      return False
+
+    results = self.worker.collect()
+
+    for job_id, native_image in results:
+      job = self.__jobs.pop(job_id, None)
+      if job is None:
+        continue
+
+      self.__pending.discard(job)
+
+      if native_image is None:
+        self.__worker_failed.add(job)
+      else:
+        self.render_cache.put(*job, native_image)
+        counters.count("keys_rendered")
+
+    return bool(results)
+
+
+
+  def stop_worker(self):
+    """Stop the worker process if there is one, and forget about the keys it
+    was rendering so they're rendered in-process when they're requested again
+    """
+
+    if self.worker is not None:
+      self.worker.stop()
+      self.worker = None
+
+    self.__jobs.clear()
+    self.__pending.clear()
+    self.__worker_failed.clear()
+
+
+
+  def stop(self):
+    """Stop the worker process if there is one and the rendering threads
+    """
+
+    self.stop_worker()
+
+    if self.__pool is not None:
+      self.__pool.shutdown(wait = True)
+      self.__pool = None
+
+
+
+  def set_nb_threads(self, nb_threads):
+    """Change the number of threads rendering keys in-process. If nb_threads is
+    0, use as many threads as there are processors
+    """
+
+    nb_threads = nb_threads if nb_threads else (os.cpu_count() or 1)
+
+    if nb_threads != self.nb_threads and self.__pool is not None:
+      self.__pool.shutdown(wait = False)
+      self.__pool = None
+
+    self.nb_threads = nb_threads
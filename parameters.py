@@ -19,16 +19,23 @@ class _ParamObserver:
     """__init__ method
     """
 
-    self.params_changed = False
+    self.changes = set()	# (group name, parameter name, parameter type,
+				# value) of the changed parameters
+    self.resync_all = False
 
 
 
-  def slotParamChanged(self, group, pname, ptype, value):
-    """Callbacl for when any elements in the Parameter Editor groups
-    is changed
+  def slotParamChanged(self, group, ptype, pname, value):
+    """Callback for when any elements in the Parameter Editor groups
+    is changed: record which parameter of which group has changed, or that
+    everything should be resynchronized if a group was added or removed
     """
 
-    self.params_changed = True
+    if ptype == "FCParamGroup":
+      self.resync_all = True
+
+    else:
+      self.changes.add((group.GetGroupName(), pname, ptype, value))
 
 
 
@@ -80,7 +87,52 @@ class UserParameters():
 	    ("FadeToBrightness", "Unsigned Long", 0),
 
 	  "fade_time":
-	    ("FadeTimeSeconds", "Unsigned Long", 10)},
+	    ("FadeTimeSeconds", "Unsigned Long", 10),
+
+	  "fade_gamma":
+	    ("FadeGamma", "Float", 1.0)},
+
+	__top_level_group + "/Device/Display/Touchscreen": {
+
+	  "touchscreen_enabled":
+	    ("ShowPagePosition", "Boolean", True)},
+
+	__top_level_group + "/Device/Display/PowerDown": {
+
+	  "deep_idle_enabled":
+	    ("Enabled", "Boolean", False),
+
+	  "deep_idle_after_secs":
+	    ("PowerDownWhenUserInactiveForSeconds", "Unsigned Long", 1800),
+
+	  "deep_idle_when_minimized":
+	    ("PowerDownWhenMinimized", "Boolean", True)},
+
+	__top_level_group + "/Debug": {
+
+	  "report_startup_time":
+	    ("ReportStartupTime", "Boolean", False),
+
+	  "profile_updates":
+	    ("ProfileUpdates", "Boolean", False),
+
+	  "profile_report_every":
+	    ("ProfileReportEverySeconds", "Float", 60.0),
+
+	  "profile_trace_file":
+	    ("ProfileTraceFile", "String", ""),
+
+	  "stats_report_every":
+	    ("ReportStatisticsEverySeconds", "Float", 0.0),
+
+	  "stats_in_report_view":
+	    ("ReportStatisticsInReportView", "Boolean", True),
+
+	  "stats_file":
+	    ("StatisticsFile", "String", ""),
+
+	  "input_trace_file":
+	    ("RecordInputTraceFile", "String", "")},
 
 	__top_level_group + "/Device/Filters": {
 
@@ -88,20 +140,101 @@ class UserParameters():
 	    ("UseDeviceType", "String", ""),
 
 	  "use_streamdeck_serial":
-	    ("UseDeviceSerial", "String", "")},
+	    ("UseDeviceSerial", "String", ""),
+
+	  "use_all_streamdecks":
+	    ("UseAllMatchingDevices", "Boolean", False),
+
+	  "combine_streamdecks":
+	    ("CombineDevicesIntoOneSurface", "Boolean", False)},
+
+	__top_level_group + "/Device/Reconnection": {
+
+	  "reconnect_max_attempts":
+	    ("QuickReconnectionAttempts", "Unsigned Long", 8),
+
+	  "reconnect_first_delay":
+	    ("FirstRetryDelaySeconds", "Float", 0.1),
+
+	  "reconnect_max_delay":
+	    ("MaxRetryDelaySeconds", "Float", 2.0)},
+
+	__top_level_group + "/Device/Simulation": {
+
+	  "sim_write_latency":
+	    ("WriteLatencyMilliseconds", "Float", 0.0),
+
+	  "sim_write_bandwidth":
+	    ("WriteBandwidthKilobytesPerSecond", "Float", 0.0),
+
+	  "sim_fault_rate":
+	    ("FaultRatePercent", "Float", 0.0)},
+
+	__top_level_group + "/Device/Daemon": {
+
+	  "daemon_enabled":
+	    ("UseDeviceDaemon", "Boolean", False),
+
+	  "daemon_socket":
+	    ("SocketPath", "String", ""),
+
+	  "daemon_python":
+	    ("PythonExecutable", "String", "")},
 
 	__top_level_group + "/Device/keys": {
 
 	  "long_keypress_duration":
 	    ("LongKeyPressDurationSeconds", "Float", 0.5)},
 
+	__top_level_group + "/Rendering": {
+
+	  "render_worker_enabled":
+	    ("UseWorkerProcess", "Boolean", False),
+
+	  "render_worker_python":
+	    ("WorkerPythonExecutable", "String", ""),
+
+	  "render_threads":
+	    ("RenderingThreads", "Unsigned Long", 0),
+
+	  "key_update_budget":
+	    ("KeyUpdateBudgetMilliseconds", "Float", 8.0),
+
+	  "prefetch_pages":
+	    ("PrefetchPages", "Unsigned Long", 1)},
+
+	__top_level_group + "/PageLayout": {
+
+	  "pack_toolbars":
+	    ("PackSmallToolbarsTogether", "Boolean", False),
+
+	  "order_toolbars_by_usage":
+	    ("OrderToolbarsByRecentUse", "Boolean", False)},
+
 	__top_level_group + "/StartStopCommands": {
 
 	  "exec_cmd_start":
 	    ("ExecuteShellCommandWhenStarting", "String", ""),
 
+	  "exec_cmd_start_timeout":
+	    ("StartingCommandTimeoutSeconds", "Float", 30.0),
+
+	  "exec_cmd_start_wait":
+	    ("WaitForStartingCommandBeforeOpeningDevice", "Boolean", True),
+
 	  "exec_cmd_stop":
-	    ("ExecuteShellCommandWhenStopping", "String", "")},
+	    ("ExecuteShellCommandWhenStopping", "String", ""),
+
+	  "exec_cmd_stop_wait":
+	    ("WaitForStoppingCommandSeconds", "Float", 0.0)},
+
+	__top_level_group + "/ToolbarActions": {
+
+	  "forget_actions_after_refreshes":
+	    ("ForgetToolsUnseenForToolbarChecks", "Unsigned Long", 1000),
+
+	  "forget_actions_after_minutes":
+	    ("ForgetToolsUnseenForMinutes", "Float", 30.0)},
 
 	__top_level_group + "/ToolbarLists": {
 
@@ -111,6 +244,34 @@ class UserParameters():
 	  "repeated_toolbars":
 	    ("ToolbarsOnEveryPage_CommaSeparated", "String", "")}}
 
+  # Parameter Editor type names as reported to the parameter change observer
+  __fc_types = {"String": "FCText",
+		"Integer": "FCInt",
+		"Float": "FCFloat",
+		"Boolean": "FCBool",
+		"Unsigned Long": "FCUInt"}
+
+  # Parameters stored as comma-separated strings in the Parameter Editor but
+  # used as lists
+  __list_params = ("excluded_toolbars", "repeated_toolbars")
+
+  # Parameters grouped by what needs to happen when they change
+  RECONNECT_PARAMS = {"addon_enabled", "use_streamdeck_type",
+			"use_streamdeck_serial", "use_all_streamdecks",
+			"combine_streamdecks", "sim_write_latency",
+			"sim_write_bandwidth", "sim_fault_rate",
+			"daemon_enabled", "daemon_socket", "daemon_python"}
+  REBUILD_PARAMS = {"excluded_toolbars", "repeated_toolbars", "pack_toolbars",
+			"order_toolbars_by_usage"}
+  RESTYLE_PARAMS = {"bracket_color_repeated_toolbars",
+			"bracket_color_page_nav_keys",
+			"bracket_color_expandable_tools"}
+  BRIGHTNESS_PARAMS = {"max_brightness", "fading_enabled",
+			"fade_after_secs_inactivity", "min_brightness",
+			"fade_time", "fade_gamma"}
+  RENDER_PARAMS = {"render_worker_enabled", "render_worker_python"}
+  PROFILE_PARAMS = {"profile_updates", "profile_trace_file"}
+  TRACE_PARAMS = {"input_trace_file"}
 
 
 
@@ -125,8 +286,10 @@ class UserParameters():
       for varname in self.__pgtree[pgpath]:
          setattr(self, varname, self.__pgtree[pgpath][varname][2])
 
-    self.excluded_toolbars = []
-    self.repeated_toolbars = []
+    # Turn the default excluded_toolbars and repeated_toolbars strings into
+    # lists
+    for varname in self.__list_params:
+      setattr(self, varname, self.__split_list(getattr(self, varname)))
 
     # Add the non user-editable parameters
     self.streamdeck_key_text_font_filename_linux = "OpenSans-Regular.ttf"
@@ -139,6 +302,16 @@ class UserParameters():
     self.check_streamdeck_every = 0.1 #s
     self.check_toolbar_updates_every = 0.5 #s
 
+    # Index the parameter variable names by Parameter Editor group name - the
+    # last component of the group path, which is all the parameter change
+    # observer gets - and parameter name
+    self.__varnames = {(pgpath.rsplit("/", 1)[-1],
+			self.__pgtree[pgpath][varname][0]): (pgpath, varname) \
+				for pgpath in self.__pgtree \
+				for varname in self.__pgtree[pgpath]}
+    self.__group_paths = {pgpath.rsplit("/", 1)[-1]: pgpath \
+				for pgpath in self.__pgtree}
+
     # Attach our callback to detect when parameters are changed by the user
     self.__paramobserver = _ParamObserver()
     self.__top_level_param_group = self.__FC.ParamGet(self.__top_level_group)
@@ -150,103 +323,210 @@ class UserParameters():
 
 
   def sync(self, force_sync = False):
-    """Maintain the correct Parameter Editor group / subgroups structure if
-    needed, then update the parameters from them
-    If force_sync is not asserted and no parameter change is reported by the
-    observer, simply return False
-    If the parameters are synchronized, return True
+    """Update the parameters that the observer reported as changed, or all the
+    parameters if force_sync is asserted or if Parameter Editor groups were
+    added or removed
+    The Parameter Editor group / subgroups structure is only checked and
+    corrected for the groups that need it
+    Return the set of variable names of the parameters whose values have
+    changed
     """
 
-    # Save the current parameters as "prev_" attributes
+    changed = set()
+
+    # Should we synchronize all the parameters?
+    if force_sync or self.__paramobserver.resync_all:
+      self.__paramobserver.resync_all = False
+      self.__paramobserver.changes.clear()
+
+      for pgpath in self.__pgtree:
+        changed.update(self.__sync_group(pgpath))
+
+      return changed
+
+    # Get the changes reported by the observer since the last time
+    changes = self.__paramobserver.changes
+    if not changes:
+      return changed
+    self.__paramobserver.changes = set()
+
+    groups_to_check = set()
+
+    for gname, pname, ptype, value in changes:
+
+      # If the parameter is unknown, the group needs fixing if it's one of
+      # ours. Otherwise ignore it
+      if (gname, pname) not in self.__varnames:
+        if gname in self.__group_paths:
+          groups_to_check.add(self.__group_paths[gname])
+        continue
+
+      pgpath, varname = self.__varnames[(gname, pname)]
+      vartype = self.__pgtree[pgpath][varname][1]
+
+      # If the parameter has the wrong type, or it was removed - which is
+      # reported as a non-string parameter with an empty value - the group
+      # needs fixing
+      if ptype != self.__fc_types[vartype] or \
+		(not value and vartype != "String"):
+        groups_to_check.add(pgpath)
+        continue
+
+      # Reread the parameter
+      pg = self.__FC.ParamGet(pgpath)
+      if vartype == "String":
+
+        # Removed string parameters are also reported with an empty value:
+        # tell them apart from empty strings with a default value that can't
+        # be entered in the Parameter Editor
+        v = pg.GetString(pname, "\n")
+        if v == "\n":
+          groups_to_check.add(pgpath)
+          continue
+
+      else:
+        v = {"Integer": pg.GetInt,
+		"Float": pg.GetFloat,
+		"Boolean": pg.GetBool,
+		"Unsigned Long": pg.GetUnsigned}[vartype](pname)
+
+      if self.__set_var(varname, v):
+        changed.add(varname)
+
+    # Check and correct the groups that need it
+    for pgpath in groups_to_check:
+      changed.update(self.__sync_group(pgpath))
+
+    return changed
+
+
+
+  def editor_values(self, varnames = None):
+    """Return the Parameter Editor group paths, names, types and values of the
+    user-editable parameters - all of them, or those whose variable names are
+    in varnames - as a list of (group path, name, type, value). The lists are
+    turned back into comma-separated strings
+    """
+
+    values = []
+
     for pgpath in self.__pgtree:
-      for varname in self.__pgtree[pgpath]:
-        setattr(self, "prev_" + varname, getattr(self, varname))
+      for varname, (pname, vartype, _) in self.__pgtree[pgpath].items():
+        if varnames is None or varname in varnames:
+          value = getattr(self, varname)
+          values.append((pgpath, pname, vartype,
+				",".join(value) if varname in self.__list_params \
+				else value))
+
+    return values
 
-    # Should we synchronize the parameters?
-    if not force_sync and not self.__paramobserver.params_changed:
+
+
+  @staticmethod
+  def __split_list(value):
+    """Split a comma-separated string into a list. Split the string also on
+    semicolons, colons, spaces and tabs while we're at it
+    """
+
+    return re.split("[,;: \t]", value)
+
+
+
+  def __set_var(self, varname, value):
+    """Set a parameter variable from its Parameter Editor value, turning the
+    comma-separated strings into lists as needed
+    Return True if the value has changed
+    """
+
+    if varname in self.__list_params:
+      value = self.__split_list(value)
+
+    if getattr(self, varname) == value:
       return False
 
-    self.__paramobserver.params_changed = False
+    setattr(self, varname, value)
+    return True
 
-    # Temporarily turn the excluded_toolbars and repeated_toolbars lists into
-    # comma-separated strings for storage in the Parameter Editor groups
-    # We do this because we can't store ordered lists in the groups
-    self.excluded_toolbars = ",".join(self.excluded_toolbars)
-    self.repeated_toolbars = ",".join(self.repeated_toolbars)
 
-    # Make sure the parameter tree exists and has the correct structure. Create
-    # it and correct it as needed
-    for pgpath in self.__pgtree:
 
-      # Get / create the Parameter Editor group
-      pg = self.__FC.ParamGet(pgpath)
+  def __sync_group(self, pgpath):
+    """Maintain the correct structure of a Parameter Editor group, then update
+    the parameters from it. Parameters missing from the group get their
+    default values back
+    Return the set of variable names of the parameters whose values have
+    changed
+    """
+
+    changed = set()
 
-      # Determine the suitable functions to get, set and remove parameters in
-      # the group
-      pg_get = {"String": pg.GetString,
+    # Get / create the Parameter Editor group
+    pg = self.__FC.ParamGet(pgpath)
+
+    # Determine the suitable functions to get, set and remove parameters in
+    # the group
+    pg_get = {"String": pg.GetString,
 		"Integer": pg.GetInt,
 		"Float": pg.GetFloat,
 		"Boolean": pg.GetBool,
 		"Unsigned Long": pg.GetUnsigned}
 
-      pg_set = {"String": pg.SetString,
+    pg_set = {"String": pg.SetString,
 		"Integer": pg.SetInt,
 		"Float": pg.SetFloat,
 		"Boolean": pg.SetBool,
 		"Unsigned Long": pg.SetUnsigned}
 
-      pg_rem = {"String": pg.RemString,
+    pg_rem = {"String": pg.RemString,
 		"Integer": pg.RemInt,
 		"Float": pg.RemFloat,
 		"Boolean": pg.RemBool,
 		"Unsigned Long": pg.RemUnsigned}
 
-      # Get the Parameter Editor group's content as a dictionary keyed by
-      # (name, type)
-      pgcs = pg.GetContents()
-      pgcontent = {(pgc[1], pgc[0]): pgc[2] for pgc in pgcs} \
+    # Get the Parameter Editor group's content as a dictionary keyed by
+    # (name, type)
+    pgcs = pg.GetContents()
+    pgcontent = {(pgc[1], pgc[0]): pgc[2] for pgc in pgcs} \
 			if pgcs is not None else {}
 
-      # Remove unknown parameters in the group, if there are known parameters
-      # for this group
-      known_pnames = [self.__pgtree[pgpath][varname][0] \
+    # Remove unknown parameters in the group, if there are known parameters
+    # for this group
+    known_pnames = [self.__pgtree[pgpath][varname][0] \
 			for varname in self.__pgtree[pgpath]]
-      if known_pnames:
-        for pname, ptype in pgcontent:
-          if pname not in known_pnames:
-            pg_rem[ptype](pname)
+    if known_pnames:
+      for pname, ptype in pgcontent:
+        if pname not in known_pnames:
+          pg_rem[ptype](pname)
 
-      # Add or correct known parameters in the group
-      for varname in self.__pgtree[pgpath]:
+    # Add or correct known parameters in the group
+    for varname in self.__pgtree[pgpath]:
 
-        param_not_found = True
+      param_not_found = True
 
-        # Iterate over the group's parameters
-        for pname, ptype in pgcontent:
+      # Iterate over the group's parameters
+      for pname, ptype in pgcontent:
 
-          # Is this parameter known?
-          if pname == self.__pgtree[pgpath][varname][0]:
+        # Is this parameter known?
+        if pname == self.__pgtree[pgpath][varname][0]:
 
-            # If the group parameter has the wrong type, remove it
-            if ptype != self.__pgtree[pgpath][varname][1]:
-              pg_rem[ptype](pname)
-
-            # If the group parameter has the correct type, update our parameter
-            else:
-              param_not_found = False
-              setattr(self, varname, pg_get[ptype](pname))
-
-        # If the parameter was not found in the group, create it
-        if param_not_found:
-          pname, ptype = self.__pgtree[pgpath][varname][:2]
-          pg_set[ptype](pname, getattr(self, varname))
-
-    # Turn the excluded_toolbars and repeated_toolbars comma-separated strings
-    # back into lists
-    # Split the strings also on semicolons, colons, spaces and tabs while w're
-    # at it
-    self.excluded_toolbars = re.split("[,;: \t]", self.excluded_toolbars)
-    self.repeated_toolbars = re.split("[,;: \t]", self.repeated_toolbars)
+          # If the group parameter has the wrong type, remove it
+          if ptype != self.__pgtree[pgpath][varname][1]:
+            pg_rem[ptype](pname)
 
-    # Indicate that the parameters have been synchronized
-    return True
+          # If the group parameter has the correct type, update our parameter
+          else:
+            param_not_found = False
+            if self.__set_var(varname, pg_get[ptype](pname)):
+              changed.add(varname)
+
+      # If the parameter was not found in the group - it doesn't exist yet,
+      # it was removed or it had the wrong type - set it back to its default
+      # value and create it with that value. The excluded_toolbars and
+      # repeated_toolbars lists default to comma-separated strings, because we
+      # can't store ordered lists in the groups
+      if param_not_found:
+        pname, ptype, default = self.__pgtree[pgpath][varname]
+        if self.__set_var(varname, default):
+          changed.add(varname)
+        pg_set[ptype](pname, default)
+
+    return changed
@@ -0,0 +1,95 @@
+"""FreeCAD Stream Deck Addon - Performance counters class
+"""
+
+## Modules
+#
+
+from time import time
+from threading import Lock
+from collections import deque
+
+
+
+## Classes
+#
+
+class PerfCounters():
+  """Always-on counters of what the addon does - updates, input events, keys
+  rendered, bytes written to the devices... - cheap enough to be incremented
+  from any thread at any time
+  """
+
+  # Seconds over which the update rate is measured
+  rate_window = 10
+
+
+
+  def __init__(self):
+    """__init__ method
+    """
+
+    self.__lock = Lock()
+    self.__counters = {}
+    self.__tick_tstamps = deque(maxlen = 10000)
+    self.start_tstamp = time()
+
+
+
+  def count(self, name, n = 1):
+    """Add n to a counter
+    """
+
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + n
+
+
+
+  def tick(self):
+    """Count one update
+    """
+
+    now = time()
+
+    with self.__lock:
+      self.__counters["ticks"] = self.__counters.get("ticks", 0) + 1
+      self.__tick_tstamps.append(now)
+
+
+
+  def ticks_per_second(self):
+    """Return the number of updates per second over the last rate_window
+    seconds
+    """
+
+    since = time() - self.rate_window
+
+    with self.__lock:
+      while self.__tick_tstamps and self.__tick_tstamps[0] < since:
+        self.__tick_tstamps.popleft()
+
+      return len(self.__tick_tstamps) / self.rate_window
+
+
+
+  def snapshot(self):
+    """Return a copy of all the counters as a dictionary
+    """
+
+    with self.__lock:
+      return dict(self.__counters)
+
+
+
+  def reset(self):
+    """Set all the counters back to zero
+    """
+
+    with self.__lock:
+      self.__counters.clear()
+      self.__tick_tstamps.clear()
+      self.start_tstamp = time()
+
+
+
+# Counters shared by the whole addon
+counters = PerfCounters()
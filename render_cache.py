@@ -0,0 +1,77 @@
+"""FreeCAD Stream Deck Addon - Rendered key image cache class
+"""
+
+## Modules
+#
+
+from collections import OrderedDict
+
+
+
+## Classes
+#
+
+class RenderCache():
+  """Least-recently-used cache of key images already rendered in the native
+  format of the Stream Deck devices, keyed by device geometry and key
+  description, so keys don't need to be rendered again when a page is
+  displayed again or the device is reconnected
+  """
+
+  def __init__(self, max_entries = 2048):
+    """__init__ method
+    """
+
+    self.max_entries = max_entries
+
+    self.__cache = OrderedDict()
+
+    self.hits = 0
+    self.misses = 0
+
+
+
+  def get(self, geometry, key_desc):
+    """Return the rendered image for a key description on a device with the
+    given geometry, or None if it isn't in the cache
+    """
+
+    native_image = self.__cache.get((geometry, key_desc))
+
+    if native_image is None:
+      self.misses += 1
+
+    else:
+      self.hits += 1
+      self.__cache.move_to_end((geometry, key_desc))
+
+    return native_image
+
+
+
+  def put(self, geometry, key_desc, native_image):
+    """Add a rendered image to the cache, evicting the least recently used
+    images if the cache is full
+    """
+
+    self.__cache[(geometry, key_desc)] = native_image
+    self.__cache.move_to_end((geometry, key_desc))
+
+    while len(self.__cache) > self.max_entries:
+      self.__cache.popitem(last = False)
+
+
+
+  def clear(self):
+    """Empty the cache
+    """
+
+    self.__cache.clear()
+
+
+
+  def __len__(self):
+    """Return the number of images in the cache
+    """
+
+    return len(self.__cache)
@@ -0,0 +1,371 @@
+"""FreeCAD Stream Deck Addon - Key image render worker process class
+"""
+
+## Modules
+#
+
+import os
+import sys
+from time import time
+import multiprocessing
+from multiprocessing import shared_memory, spawn
+
+
+
+## Classes
+#
+
+class _KeyImageFormat():
+  """Stand-in for a Stream Deck device that only knows the format of its key
+  images, which is all the StreamDeck PIL helper needs from a device
+  """
+
+  def __init__(self, image_format):
+    """__init__ method
+    """
+
+    self.image_format = image_format
+
+
+
+  def key_image_format(self):
+    """Return the format of the key images
+    """
+
+    return self.image_format
+
+
+
+class RenderWorker():
+  """Separate process composing and encoding key images, so rendering doesn't
+  compete with FreeCAD's GUI thread for the interpreter
+
+  The worker receives the key descriptions with the raw pixels of the icons -
+  the icons themselves can only be rasterized in the GUI thread - through a
+  pipe, and returns the encoded images through a ring of fixed-size slots in
+  shared memory. Each job in flight owns a slot until its result is collected
+  """
+
+  # Seconds to wait for the worker to return a result before deeming it stuck
+  STALL_TIMEOUT = 10
+
+
+
+  def __init__(self, python_executable = "", nb_slots = 32,
+		slot_size = 65536):
+    """__init__ method
+    If python_executable is empty, look for the Python interpreter next to
+    FreeCAD's
+    """
+
+    self.python_executable = python_executable
+    self.nb_slots = nb_slots
+    self.slot_size = slot_size
+
+    self.ready = False
+    self.error = None
+
+    self.__proc = None
+    self.__conn = None
+    self.__shm = None
+
+    self.__free_slots = []
+    self.__last_reply_tstamp = None
+
+
+
+  def find_python_executable(self):
+    """Return the Python interpreter to run the worker with, or None if it
+    can't be found - see find_python_executable()
+    """
+
+    return find_python_executable(self.python_executable)
+
+
+
+  def start(self, ttf_file, ttf_size, image_files):
+    """Start the worker process with the TrueType font and the predefined prev,
+    next, blank and broken images it should use. The worker is only ready to
+    render once it has loaded them - see collect()
+    Return True if the worker process was started
+    """
+
+    python = self.find_python_executable()
+    if python is None:
+      self.error = "Python interpreter not found"
+      return False
+
+    try:
+      ctx = multiprocessing.get_context("spawn")
+
+      self.__shm = shared_memory.SharedMemory(create = True,
+					size = self.nb_slots * self.slot_size)
+      self.__conn, child_conn = ctx.Pipe()
+
+      self.__proc = ctx.Process(target = _render_worker_main,
+				args = (child_conn, self.__shm.name,
+					self.slot_size, ttf_file, ttf_size,
+					image_files),
+				name = "Stream Deck render worker",
+				daemon = True)
+
+      # Only use this interpreter for our own process, so other users of
+      # multiprocessing within FreeCAD aren't affected
+      executable = spawn.get_executable()
+      spawn.set_executable(python)
+      try:
+        self.__proc.start()
+      finally:
+        spawn.set_executable(executable)
+
+      child_conn.close()
+
+    except Exception as e:
+      self.error = str(e)
+      self.stop()
+      return False
+
+    self.__free_slots = list(range(self.nb_slots))
+    self.__last_reply_tstamp = time()
+
+    return True
+
+
+
+  def stop(self):
+    """Stop the worker process and release the shared memory. Ignore errors
+    """
+
+    if self.__conn is not None:
+      try:
+        self.__conn.send(("stop",))
+      except:
+        pass
+
+    if self.__proc is not None:
+      try:
+        self.__proc.join(timeout = 1)
+        if self.__proc.is_alive():
+          self.__proc.terminate()
+      except:
+        pass
+
+    if self.__conn is not None:
+      try:
+        self.__conn.close()
+      except:
+        pass
+
+    if self.__shm is not None:
+      try:
+        self.__shm.close()
+        self.__shm.unlink()
+      except:
+        pass
+
+    self.__proc = None
+    self.__conn = None
+    self.__shm = None
+
+    self.ready = False
+    self.__free_slots = []
+
+
+
+  def is_alive(self):
+    """Return whether the worker process is running and responsive
+    """
+
+    if self.__proc is None or self.error is not None:
+      return False
+
+    if not self.__proc.is_alive():
+      self.error = "exited with code {}".format(self.__proc.exitcode)
+      return False
+
+    if len(self.__free_slots) < self.nb_slots and \
+		time() - self.__last_reply_tstamp > self.STALL_TIMEOUT:
+      self.error = "not responding"
+      return False
+
+    return True
+
+
+
+  def submit(self, job_id, image_format, margins, image,
+		top_text = None, bottom_text = None,
+		left_bracket_color = None, right_bracket_color = None):
+    """Send a key to render to the worker process. image is a PIL image, or
+    the name of a predefined image - see StreamDeck.render_key()
+    Return False if the worker isn't ready or has no free slot, in which case
+    the key should be rendered in-process
+    """
+
+    if not self.ready or not self.__free_slots:
+      return False
+
+    pixels = image if not image or isinstance(image, str) else \
+		(image.mode, image.size, image.tobytes())
+
+    if len(self.__free_slots) == self.nb_slots:
+      self.__last_reply_tstamp = time()
+
+    slot = self.__free_slots.pop()
+
+    try:
+      self.__conn.send(("render", job_id, slot, image_format, margins, pixels,
+			top_text, bottom_text,
+			left_bracket_color, right_bracket_color))
+
+    except Exception as e:
+      self.error = str(e)
+      return False
+
+    return True
+
+
+
+  def collect(self):
+    """Collect the results sent by the worker process without waiting
+    Return a list of (job_id, native_image) for the jobs finished since the
+    last call. native_image is None if the worker couldn't render the key
+    """
+
+    results = []
+
+    try:
+      while self.__conn is not None and self.__conn.poll():
+        msg = self.__conn.recv()
+        self.__last_reply_tstamp = time()
+
+        if msg[0] == "ready":
+          self.ready = True
+
+        elif msg[0] == "error":
+          self.error = msg[1]
+          break
+
+        else:
+          _, job_id, slot, length, native_image = msg
+
+          if length >= 0 and native_image is None:
+            offset = slot * self.slot_size
+            native_image = bytes(self.__shm.buf[offset:offset + length])
+
+          self.__free_slots.append(slot)
+          results.append((job_id, native_image))
+
+    except Exception as e:
+      self.error = str(e) or type(e).__name__
+
+    return results
+
+
+
+## Routines
+#
+
+def find_python_executable(python_executable = ""):
+  """Return python_executable if it's set and exists, or the Python
+  interpreter next to FreeCAD's if python_executable is empty, or None if it
+  can't be found. FreeCAD's own executable embeds Python but can't run Python
+  scripts as a plain interpreter
+  """
+
+  if python_executable:
+    return python_executable if os.path.isfile(python_executable) else None
+
+  if os.path.basename(sys.executable).lower().startswith("python"):
+    return sys.executable
+
+  for f in ("python3", "python", "python.exe"):
+    f = os.path.join(os.path.dirname(sys.executable), f)
+    if os.path.isfile(f):
+      return f
+
+  return None
+
+
+
+def _render_worker_main(conn, shm_name, slot_size, ttf_file, ttf_size,
+			image_files):
+  """Main routine of the worker process: load the font and the predefined
+  images, then render the keys received through the pipe into the shared
+  memory slots until told to stop. Images too large to fit in a slot are
+  returned through the pipe instead
+  """
+
+  try:
+    import streamdeck_comm
+    from streamdeck_comm import compose_key_image, scale_key_image
+
+    streamdeck_comm.import_imaging_modules()
+    Image = streamdeck_comm.Image
+
+    font = streamdeck_comm.ImageFont.truetype(ttf_file, ttf_size)
+
+    prev_image, next_image, blank_image, broken_image = \
+		[Image.open(f) for f in image_files]
+    for image in (prev_image, next_image, blank_image, broken_image):
+      image.load()
+
+    shm = shared_memory.SharedMemory(name = shm_name)
+
+  except Exception as e:
+    conn.send(("error", "{}: {}".format(type(e).__name__, e)))
+    return
+
+  conn.send(("ready",))
+
+  named_images = {"": blank_image, "PAGEPREV": prev_image,
+			"PAGENEXT": next_image}
+
+  # Predefined images already scaled, keyed by name, key image format and
+  # margins
+  scaled_images = {}
+
+  while True:
+
+    try:
+      msg = conn.recv()
+    except EOFError:
+      break
+
+    if msg[0] == "stop":
+      break
+
+    _, job_id, slot, image_format, margins, pixels, tt, bt, lbc, rbc = msg
+
+    deck = _KeyImageFormat(image_format)
+
+    try:
+      if not pixels or isinstance(pixels, str):
+        key = (pixels or "", repr(image_format), tuple(margins))
+        if key not in scaled_images:
+          scaled_images[key] = scale_key_image(deck,
+					named_images.get(pixels or "",
+								broken_image),
+					margins, broken_image)
+        image = scaled_images[key]
+        prescaled = True
+
+      else:
+        image = Image.frombytes(*pixels)
+        prescaled = False
+
+      native_image = bytes(compose_key_image(deck, font, margins, image,
+						broken_image, tt, bt, lbc, rbc,
+						prescaled))
+    except:
+      conn.send(("done", job_id, slot, -1, None))
+      continue
+
+    if len(native_image) <= slot_size:
+      shm.buf[slot * slot_size:slot * slot_size + len(native_image)] = \
+		native_image
+      conn.send(("done", job_id, slot, len(native_image), None))
+
+    else:
+      conn.send(("done", job_id, slot, len(native_image), native_image))
+
+  shm.close()
@@ -0,0 +1,173 @@
+"""FreeCAD Stream Deck Addon - Asynchronous shell command class
+"""
+
+## Modules
+#
+
+import os
+import signal
+import subprocess
+from threading import Thread
+from time import time, sleep
+
+
+
+## Classes
+#
+
+class ShellCommand():
+  """Shell command executed asynchronously in a subprocess, with its output
+  captured so it can be displayed later by the caller
+  """
+
+  def __init__(self, cmd, timeout = 0, capture_output = True):
+    """__init__ method
+    If timeout is non-zero, the command is terminated if it's still running
+    after that many seconds
+    If capture_output is not asserted, the output of the command is discarded,
+    so it can keep running after the caller has exited without writing into a
+    closed pipe
+    """
+
+    self.cmd = cmd
+    self.timeout = timeout
+    self.capture_output = capture_output
+
+    self.returncode = None
+    self.timed_out = False
+
+    self.__proc = None
+    self.__reader = None
+    self.__start_tstamp = None
+    self.__output_lines = []
+
+
+
+  def start(self):
+    """Start the command in its own session - or process group in Windows - so
+    it and its children can be terminated together if it times out
+    Return True if the command was started
+    """
+
+    self.__start_tstamp = time()
+
+    try:
+      self.__proc = subprocess.Popen(self.cmd, shell = True,
+					stdin = subprocess.DEVNULL,
+					stdout = subprocess.PIPE \
+						if self.capture_output else \
+						subprocess.DEVNULL,
+					stderr = subprocess.STDOUT,
+					text = True, errors = "replace",
+					**({"creationflags":
+				subprocess.CREATE_NEW_PROCESS_GROUP} \
+						if os.name == "nt" else \
+					{"start_new_session": True}))
+
+    except Exception as e:
+      self.__output_lines.append("Error executing the command: {}".format(e))
+      self.returncode = -1
+      return False
+
+    # Collect the output of the command in a separate thread so reading it
+    # never blocks the caller
+    if self.capture_output:
+      self.__reader = Thread(target = self.__read_output, daemon = True)
+      self.__reader.start()
+
+    return True
+
+
+
+  def __read_output(self):
+    """Read the output of the command line by line until it's closed
+    """
+
+    try:
+      for l in self.__proc.stdout:
+        self.__output_lines.append(l.rstrip())
+    except:
+      pass
+
+
+
+  def poll(self):
+    """Check whether the command has finished, and terminate it if it has been
+    running for longer than its timeout
+    Return True if the command is still running
+    """
+
+    if self.__proc is None or self.returncode is not None:
+      return False
+
+    self.returncode = self.__proc.poll()
+
+    if self.returncode is None and self.timeout and \
+		time() - self.__start_tstamp > self.timeout:
+      self.timed_out = True
+      self.terminate()
+      self.returncode = self.__proc.poll()
+
+    return self.returncode is None
+
+
+
+  def wait(self, max_wait):
+    """Wait for the command to finish for at most max_wait seconds, without
+    terminating it if it's still running afterward
+    Return True if the command is still running
+    """
+
+    end_tstamp = time() + max_wait
+
+    while self.poll() and time() < end_tstamp:
+      sleep(0.05)
+
+    # If the command has finished, let the output thread collect the rest of
+    # its output in the time left
+    if self.returncode is not None and self.__reader is not None:
+      self.__reader.join(max(end_tstamp - time(), 0))
+
+    return self.returncode is None
+
+
+
+  def terminate(self):
+    """Terminate the command and all its children. Ignore errors
+    """
+
+    try:
+      if os.name == "nt":
+        self.__proc.kill()
+      else:
+        os.killpg(self.__proc.pid, signal.SIGTERM)
+    except:
+      pass
+
+
+
+  def get_output(self):
+    """Return the lines of output captured since the last call
+    """
+
+    nblines = len(self.__output_lines)
+    lines = self.__output_lines[:nblines]
+    del(self.__output_lines[:nblines])
+
+    return lines
+
+
+
+  def status(self):
+    """Return a line describing how the command ended, or None if it's still
+    running or ended successfully
+    """
+
+    if self.timed_out:
+      return "timed out after {} seconds and was terminated".\
+		format(self.timeout)
+
+    if self.returncode:
+      return "exited with status {}".format(self.returncode)
+
+    return None
@@ -8,15 +8,28 @@
 import re
 import os
 import sys
-from time import time
+import json
+from time import time, perf_counter
 
 import FreeCADGui as Gui
 from PySide import QtCore
 
 from parameters import UserParameters
-from streamdeck_comm import StreamDeck
-from gui_actions import ToolbarActions
-from streamdeck_pages import StreamDeckPages
+from tick_profiler import profiler
+from perf_counters import counters
+from input_trace import input_trace
+
+# The modules handling the Stream Deck devices, the GUI actions and the Stream
+# Deck pages pull in PIL, the StreamDeck library and friends, which take a
+# while to load. They're only imported when they're actually needed - see
+# import_streamdeck_modules() and import_page_modules() - to keep them off
+# FreeCAD's startup path
+StreamDeck = None
+find_streamdecks = None
+ToolbarActions = None
+DeckPipeline = None
+RenderCache = None
+KeyRenderer = None
 
 
 
@@ -41,14 +54,16 @@ class UserActivity():
 
 
 
-  def is_active(self, now, inactivity_time, external_activity_flags):
+  def is_active(self, now, inactivity_time, external_activity_flags,
+		track_activity = False):
     """Determine if the user is active based on cursor movements and external
     activity flags, and whether the cursor movements occur while the main
     window is active
     external_activity_flag is a list of bools, any of which being True indicates
     that the user is active even if the cursor doesn't move
     If inactivity_time is None, the check is disabled and the user is deemed
-    active all the time
+    active all the time. The user's activity is still tracked for
+    inactive_for() if track_activity is True
     If the main window isn't active, the user is busy doing something else,
     therefore reputed inactive here
     If the cursor hasn't moved within inactivity_time, return False
@@ -57,7 +72,8 @@ class UserActivity():
     prev_check_tstamp = self.last_check_tstamp
     self.last_check_tstamp = now
 
-    if inactivity_time is None:
+    if inactivity_time is None and not track_activity:
+      self.cursor_pos = None
       return True
 
     if self.cursor_pos is None:
@@ -79,27 +95,620 @@ class UserActivity():
     if any(external_activity_flags):
       self.last_activity_tstamp = now
 
+    if inactivity_time is None:
+      return True
+
     return now - self.last_activity_tstamp < inactivity_time \
 			if inactivity_time > (now - prev_check_tstamp) * 2 \
 		else self.last_activity_tstamp == now
 
 
 
+  def inactive_for(self, now):
+    """Return how many seconds the user has been inactive for, as of the last
+    call to is_active() with the activity tracked
+    """
+
+    if self.last_activity_tstamp is None:
+      return 0
+
+    return now - self.last_activity_tstamp
+
+
+
+  def mark_active(self, now):
+    """Deem the user active now, whatever the cursor does
+    """
+
+    self.last_activity_tstamp = now
+
+
+
+class DeepIdleWaker(QtCore.QObject):
+  """Application event filter and signal waking the addon up from deep idle:
+  the signal is emitted when the user uses FreeCAD again - a window is
+  activated, the main window is restored, the mouse or the keyboard is used -
+  or by the threads watching the devices when a device is touched
+  The event filter is only installed while the addon is powered down
+  """
+
+  wake = QtCore.Signal()
+
+  # Events showing that the user is using FreeCAD
+  activity_events = (QtCore.QEvent.WindowActivate, QtCore.QEvent.KeyPress,
+			QtCore.QEvent.MouseButtonPress,
+			QtCore.QEvent.MouseMove, QtCore.QEvent.Wheel)
+
+
+
+  def __init__(self, main_window):
+    """__init__ method
+    """
+
+    super().__init__()
+
+    self.main_window = main_window
+
+
+
+  def eventFilter(self, obj, event):
+    """Emit the wake signal upon user activity. Let all the events through
+    """
+
+    t = event.type()
+
+    if t in self.activity_events or \
+		(t == QtCore.QEvent.WindowStateChange and \
+			obj is self.main_window and \
+			not self.main_window.isMinimized()):
+      self.wake.emit()
+
+    return False
+
+
+
 ## Routines
 #
 
+def as_installed(f):
+  """Return the absolute path of a file in the addon's installation directory
+  """
+
+  return os.path.abspath(os.path.join(os.path.dirname(__file__), f))
+
+
+
+def addon_version():
+  """Try to extract the version number of the addon from the package.xml file
+  Return None if it can't be determined
+  """
+
+  try:
+    with open(as_installed("package.xml"), "r") as f:
+      return re.search("<version>\s*(\S+)\s*</version>", f.read())[1]
+  except:
+    return None
+
+
+
+def print_version_once():
+  """Display the version of the addon the first time it's called
+  """
+
+  global show_version
+
+  if show_version:
+    version = addon_version()
+    if version is not None:
+      print("*** Stream Deck Addon version {} ***".format(version))
+
+    show_version = False
+
+
+
+def import_streamdeck_modules():
+  """Import the Stream Deck device handling module on first use
+  """
+
+  global StreamDeck
+  global find_streamdecks
+
+  if StreamDeck is None:
+    from streamdeck_comm import StreamDeck, find_streamdecks
+
+
+
+def import_page_modules():
+  """Import the GUI actions and Stream Deck pages modules on first use, once a
+  Stream Deck device has been found
+  """
+
+  global ToolbarActions
+  global DeckPipeline
+  global RenderCache
+  global KeyRenderer
+
+  if ToolbarActions is None:
+    from gui_actions import ToolbarActions
+    from deck_pipeline import DeckPipeline
+    from render_cache import RenderCache
+    from key_renderer import KeyRenderer
+
+
+
+def report_shell_command(cmd, label):
+  """Display the output of a shell command executed asynchronously in the Report
+  view, as well as how it ended if it's finished
+  Return True if the command is still running
+  """
+
+  running = cmd.poll()
+
+  for l in cmd.get_output():
+    print("{}: {}".format(label, l))
+
+  if not running:
+    status = cmd.status()
+    if status:
+      print("{} {}".format(label, status))
+
+  return running
+
+
+
+def split_filter(f):
+  """Split a comma-separated device filter into a list of non-empty items
+  """
+
+  return [i.strip() for i in f.split(",") if i.strip()]
+
+
+
+def device_manager():
+  """Return the device manager to enumerate the Stream Deck devices with: None
+  for the StreamDeck library's, unless simulated device types - "Simulated "
+  followed by the name of a Stream Deck model - are among the device types to
+  use, in which case return a manager enumerating one simulated device of each
+  of those types, along with the real devices if other device types are also
+  requested
+  The simulated devices are kept as long as the device types and simulation
+  settings don't change, so they can be reconnected like real devices
+  If the device daemon is used, return a manager enumerating the devices it
+  owns instead, starting it if it isn't running
+  """
+
+  global params
+  global simulated_devices
+  global remote_devices
+
+  # Use the devices owned by the device daemon if requested
+  if params.daemon_enabled:
+    settings = (params.daemon_socket, params.daemon_python)
+
+    if remote_devices is None or remote_devices[0] != settings:
+      from deck_daemon import RemoteDeviceManager
+      remote_devices = (settings, RemoteDeviceManager(*settings))
+
+    return remote_devices[1]
+
+  types = split_filter(params.use_streamdeck_type)
+  models = [t[len("simulated "):] for t in types \
+		if t.lower().startswith("simulated ")]
+
+  if not models:
+    return None
+
+  settings = (tuple(types), params.sim_write_latency,
+		params.sim_write_bandwidth, params.sim_fault_rate)
+
+  if simulated_devices is None or simulated_devices[0] != settings:
+    from streamdeck_sim import SimulatedDeviceManager, simulated_streamdeck
+
+    devices = []
+    for i, model in enumerate(models):
+      try:
+        devices.append(simulated_streamdeck(model, "SIM{:09d}".format(i + 1),
+				write_latency = params.sim_write_latency / 1000,
+				write_bandwidth = \
+					params.sim_write_bandwidth * 1000,
+				fault_rate = params.sim_fault_rate / 100))
+      except ValueError as e:
+        print("Cannot simulate a Stream Deck device: {}".format(e))
+
+    real_device_manager = None
+    if len(models) < len(types):
+      from StreamDeck.DeviceManager import DeviceManager
+      real_device_manager = DeviceManager()
+
+    simulated_devices = (settings, SimulatedDeviceManager(devices,
+							real_device_manager))
+
+  return simulated_devices[1]
+
+
+
+def key_font_and_images():
+  """Return the TrueType font filename and size to write in the Stream Deck
+  keys - depending on the platform - and the filenames of the prev, next, blank
+  and broken key images
+  """
+
+  global params
+
+  font_filename = params.streamdeck_key_text_font_filename_windows \
+				if sys.platform[0:3] == "win" else \
+			params.streamdeck_key_text_font_filename_linux
+
+  image_files = [as_installed(f) for f in (params.prev_streamdeck_key_icon,
+					params.next_streamdeck_key_icon,
+					params.blank_streamdeck_key_icon,
+					params.broken_streamdeck_key_icon)]
+
+  return font_filename, params.streamdeck_key_text_font_size, image_files
+
+
+
+def bracket_colors():
+  """Return the bracket colors used in the pages
+  """
+
+  global params
+
+  return [params.bracket_color_repeated_toolbars,
+		params.bracket_color_page_nav_keys,
+		params.bracket_color_expandable_tools]
+
+
+
+def open_streamdecks():
+  """Open the Stream Deck devices matching the device filters that aren't open
+  already - all of them if we use all the matching devices, only the first
+  one otherwise - and create their key surface pipelines: one per device, or a
+  single one for all the devices if they're combined
+  Return information lines about the devices found and opened, and the number
+  of devices opened
+  """
+
+  global params
+  global decks
+
+  import_streamdeck_modules()
+
+  font_filename, font_size, image_files = key_font_and_images()
+
+  dm = device_manager()
+
+  matches, info = find_streamdecks(split_filter(params.use_streamdeck_type),
+				split_filter(params.use_streamdeck_serial),
+				[sd.id for deck in decks \
+					for sd in deck.streamdecks], dm)
+
+  # Open the matching devices. The font and the icons are only loaded once a
+  # device is opened
+  streamdecks = []
+  for dev, sn in matches:
+    streamdeck = StreamDeck(font_filename, font_size, *image_files, dm)
+
+    if streamdeck.open_device(dev, sn, info):
+      streamdecks.append(streamdeck)
+
+      if not params.use_all_streamdecks:
+        break
+
+  # Create the key surface pipelines
+  if streamdecks:
+    import_page_modules()
+
+    if params.combine_streamdecks:
+      decks.append(DeckPipeline(streamdecks))
+    else:
+      decks.extend([DeckPipeline([sd]) for sd in streamdecks])
+
+  return info, len(streamdecks)
+
+
+
+def start_render_worker():
+  """Start the render worker process if it's enabled. If it can't be started,
+  keep rendering the keys in FreeCAD
+  """
+
+  global params
+  global renderer
+
+  if not params.render_worker_enabled:
+    return
+
+  from render_worker import RenderWorker
+
+  worker = RenderWorker(params.render_worker_python)
+
+  if worker.start(*key_font_and_images()):
+    renderer.worker = worker
+    print("Rendering the Stream Deck keys in a separate process")
+
+  else:
+    print("Could not start the Stream Deck render worker process: {}".
+		format(worker.error))
+
+
+
+def close_streamdecks():
+  """Close all the Stream Deck devices and forget about the toolbar actions
+  """
+
+  global decks
+  global tbactions
+  global useractivity
+
+  leave_deep_idle(False)
+
+  for deck in decks:
+    deck.close()
+
+  if tbactions is not None:
+    tbactions.forget_actions()
+
+  decks = []
+  tbactions = None
+  useractivity = None
+
+
+
+def enter_deep_idle():
+  """Power the devices down: blank their displays, stop reading them and stop
+  the update timer. Each device's own thread waits for a touch instead, and
+  the main window's activation is watched by an event filter, to wake the
+  addon up - see leave_deep_idle()
+  Return False if a device failed while powering down, in which case the
+  update loop carries on to reconnect it
+  """
+
+  global decks
+  global timer
+  global deep_idle
+  global deep_idle_waker
+
+  for deck in decks:
+    deck.power_down(deep_idle_waker.wake.emit, deep_idle_wake_poll_every)
+
+  if not all([deck.is_open() for deck in decks]):
+    for deck in decks:
+      deck.power_up()
+    return False
+
+  timer.stop()
+  QtCore.QCoreApplication.instance().installEventFilter(deep_idle_waker)
+  deep_idle = True
+  counters.count("deep_idles")
+
+  return True
+
+
+
+def leave_deep_idle(resume_updates = True):
+  """Wake the addon up from deep idle if it's powered down: stop watching the
+  devices and the user's activity, and resume the update loop right away with
+  the user deemed active if resume_updates is True, so the displays are turned
+  back on at the next update
+  """
+
+  global decks
+  global useractivity
+  global timer
+  global deep_idle
+  global deep_idle_waker
+
+  if not deep_idle:
+    return
+
+  deep_idle = False
+  QtCore.QCoreApplication.instance().removeEventFilter(deep_idle_waker)
+
+  for deck in decks:
+    deck.power_up()
+
+  if resume_updates:
+    if useractivity is not None:
+      useractivity.mark_active(time())
+
+    timer.start(0)
+
+
+
+def report_profile():
+  """Print the percentiles of the durations of the update phases and write the
+  trace file if there is one
+  """
+
+  print("-" * 79)
+  print("Stream Deck update profile:")
+  for l in profiler.report():
+    print(l)
+
+  error = profiler.write_trace()
+  if error is not None:
+    print("Could not write the Stream Deck update trace: {}".format(error))
+  elif profiler.trace_file:
+    print("Stream Deck update trace written to {}".format(profiler.trace_file))
+
+  print("-" * 79)
+
+
+
+def stats():
+  """Return the performance counters of the addon as a dictionary. Can be
+  called from the FreeCAD Python console or from a macro:
+
+    import streamdeck_addon
+    streamdeck_addon.stats()
+  """
+
+  c = counters.snapshot()
+
+  cache_hits = renderer.render_cache.hits if renderer is not None else 0
+  cache_misses = renderer.render_cache.misses if renderer is not None else 0
+
+  return {"uptime_seconds": round(time() - counters.start_tstamp, 1),
+	"devices": [deck.name for deck in decks],
+	"ticks": c.get("ticks", 0),
+	"ticks_per_second": counters.ticks_per_second(),
+	"input_events": c.get("input_events", 0),
+	"keys_rendered": c.get("keys_rendered", 0),
+	"render_cache_hits": cache_hits,
+	"render_cache_misses": cache_misses,
+	"render_cache_hit_ratio": round(cache_hits / (cache_hits + \
+							cache_misses), 3) \
+					if cache_hits + cache_misses else None,
+	"key_writes": c.get("key_writes", 0),
+	"touchscreen_writes": c.get("touchscreen_writes", 0),
+	"usb_bytes_written": c.get("usb_bytes_written", 0),
+	"brightness_writes": c.get("brightness_writes", 0),
+	"reconnects": c.get("reconnects", 0),
+	"deep_idles": c.get("deep_idles", 0),
+	"page_rebuilds": c.get("page_rebuilds", 0),
+	"pages": [len(deck.pages.pages) for deck in decks],
+	"pages_without_packing": [deck.pages.nb_unpacked_pages \
+					for deck in decks],
+	"toolbar_actions": tbactions.stats() if tbactions is not None else None}
+
+
+
+def print_stats():
+  """Print the performance counters of the addon in the Report view
+  """
+
+  print("-" * 79)
+  print("Stream Deck statistics:")
+  for name, value in stats().items():
+    print("  {}: {}".format(name.replace("_", " ").capitalize(), value))
+  print("-" * 79)
+
+
+
+def dump_stats(filename):
+  """Write the performance counters of the addon to a JSON file
+  Return an error message, or None if the file was written
+  """
+
+  try:
+    with open(filename, "w") as f:
+      json.dump(stats(), f, indent = 2)
+
+  except Exception as e:
+    return str(e)
+
+  return None
+
+
+
+def report_page_layout(decks):
+  """Report how many pages the key surfaces have with the small toolbars
+  packed together, and how many they would have without, if it's changed
+  since the last report
+  """
+
+  global page_layout_report
+
+  report = [(deck.name, len(deck.pages.pages), deck.pages.nb_unpacked_pages) \
+		for deck in decks]
+
+  if report != page_layout_report:
+    for name, nbpages, nb_unpacked_pages in report:
+      print("Stream Deck {}: {} page{} with the small toolbars packed "
+		"together instead of {}".format(name, nbpages,
+						"" if nbpages == 1 else "s",
+						nb_unpacked_pages))
+
+  page_layout_report = report
+
+
+
+def start_input_trace():
+  """Start recording the input trace to the file set in the parameters, or
+  stop recording it if no file is set. Record all the parameters, the devices
+  already open and the toolbars already known at the start of the trace
+  """
+
+  input_trace.stop()
+
+  if not params.input_trace_file:
+    return
+
+  error = input_trace.start(params.input_trace_file)
+  if error is not None:
+    print("Could not record the Stream Deck input trace: {}".format(error))
+    return
+
+  input_trace.record("params", params = params.editor_values())
+
+  for deck in decks:
+    for sd in deck.streamdecks:
+      if sd.is_open():
+        sd.record_device()
+
+  if tbactions is not None:
+    record_toolbars()
+
+
+
+def record_toolbars():
+  """Record the toolbars and their numbers of actions in the input trace if
+  it's being recorded
+  """
+
+  input_trace.record("toolbars", toolbars = [[t,
+						len(tbactions.toolbar_actions[t])] \
+						for t in tbactions.toolbars])
+
+
+
 def shutdown():
   """Callback to clean things up before stopping
   """
 
   global params
-  global streamdeck
+  global renderer
 
-  streamdeck.close()
+  close_streamdecks()
 
-  # If we have a shell command to execute when starting, execute it
+  if renderer is not None:
+    renderer.stop()
+    renderer = None
+
+  if profiler.enabled:
+    report_profile()
+    profiler.configure(False)
+
+  input_trace.stop()
+
+  # If we have a shell command to execute when stopping, execute it. By default,
+  # don't wait for it at all so it doesn't hold up FreeCAD's shutdown: it runs
+  # in its own session, which outlives FreeCAD. Only capture its output if we
+  # wait for it, otherwise nobody is left to read it once FreeCAD has exited
   if params.exec_cmd_stop:
-    os.system(params.exec_cmd_stop)
+    from shell_commands import ShellCommand
+
+    cmd_stop = ShellCommand(params.exec_cmd_stop, capture_output = \
+				params.exec_cmd_stop_wait > 0)
+    if cmd_stop.start() and params.exec_cmd_stop_wait > 0:
+      cmd_stop.wait(params.exec_cmd_stop_wait)
+
+    if report_shell_command(cmd_stop, "Stop command"):
+      print("Stop command still running in the background")
+
+
+
+def displayed_actions(decks):
+  """Return the set of names of the actions on the current pages of the key
+  surfaces and on the pages prefetched around them
+  """
+
+  names = set()
+  for deck in decks:
+    names |= deck.pages.actions_around_current_page(params.prefetch_pages)
+
+  return names
 
 
 
@@ -113,69 +722,104 @@ def action_changed():
 
 
 def streamdeck_update():
-  """Mirror the current content of the Freecad toolbars onto the stream deck
+  """Mirror the current content of the Freecad toolbars onto the stream decks
   """
 
   global params
 
   global main_window
 
-  global streamdeck
-  global streamdeck_was_open
+  global decks
+  global streamdecks_were_open
   global show_help
   global retry_open_at_tstamp
+  global retry_open_every
 
   global update_actions
 
   global tbactions
-  global pages
   global useractivity
-
-  global last_action_pressed
+  global renderer
 
   global timer
   global timer_reschedule_every_ms
   global next_actions_update_tstamp
+  global next_profile_report_tstamp
+  global next_stats_report_tstamp
+  global main_window_was_minimized
+
+  global cmd_start
 
   now = time()
+  tick_tstamp = perf_counter()
+  counters.tick()
+
+  # Synchronize the parameters that have changed
+  with profiler.phase("param sync"):
+    changed_params = params.sync()
+
+  # If the profiling settings have changed, report the profile so far when
+  # profiling is turned off, and start afresh when it's turned on
+  if changed_params & params.PROFILE_PARAMS:
+    if profiler.enabled and not params.profile_updates:
+      report_profile()
+    profiler.configure(params.profile_updates, params.profile_trace_file)
+    next_profile_report_tstamp = now + params.profile_report_every
+
+  # If the input trace file has changed, start or stop recording the input
+  # trace. Otherwise record the parameters that have changed in the trace if
+  # it's being recorded
+  if changed_params & params.TRACE_PARAMS:
+    start_input_trace()
+  elif changed_params and input_trace.recording:
+    input_trace.record("params", params = params.editor_values(changed_params))
+
+  # If the list of toolbars excluded from the Stream Deck display or the list
+  # of toolbars displayed on every Stream Deck page have changed, force a full
+  # update of the list of toolbars and toolbar actions, and rebuilding of the
+  # Stream Deck pages
+  if changed_params & params.REBUILD_PARAMS:
+    update_actions = True
+    next_actions_update_tstamp = 0
 
-  update_streamdeck_keys = False
-
-  # Synchronize the parameters
-  parameters_synchronized =  params.sync()
-  if parameters_synchronized:
-
-    # If the list of toolbars excluded from the Stream Deck display, the list
-    # of toolbars displayed on every Stream Deck page or any of the bracket
-    # colors have changed, force a full update of the list of toolbars and
-    # toolbar actions, and rebuilding of the Stream Deck pages
-    if params.excluded_toolbars != params.prev_excluded_toolbars or \
-	params.repeated_toolbars != params.prev_repeated_toolbars or \
-	params.bracket_color_repeated_toolbars != \
-			 params.prev_bracket_color_repeated_toolbars or \
-	params.bracket_color_page_nav_keys != \
-			params.prev_bracket_color_page_nav_keys or \
-	params.bracket_color_expandable_tools != \
-			params.prev_bracket_color_expandable_tools:
-      update_actions = True
+    # If the toolbars are to be ordered by usage, rank them afresh
+    if "order_toolbars_by_usage" in changed_params and tbactions is not None:
+      tbactions.toolbar_ranks = None
+
+  # If only the bracket colors have changed, the pages just need rebuilding
+  # from the toolbar actions we already know
+  restyle_pages = bool(changed_params & params.RESTYLE_PARAMS)
+
+  # If only the brightness settings have changed, the brightness is set again
+  # below with the user deemed active, so the change is visible right away
+  brightness_changed = bool(changed_params & params.BRIGHTNESS_PARAMS)
 
-    # Has any parameter affecting the connection with the Stream Deck device
-    # changed?
-    if params.prev_addon_enabled != params.addon_enabled or \
-	(params.prev_use_streamdeck_type != params.use_streamdeck_type) or \
-	(params.prev_use_streamdeck_serial != params.use_streamdeck_serial):
+  # If the render worker settings have changed, restart the worker process
+  if changed_params & params.RENDER_PARAMS and renderer is not None:
+    renderer.stop_worker()
+    start_render_worker()
 
-      # Close the device if needed
-      if streamdeck.is_open():
-        streamdeck.close()
-        del(tbactions)
-        del(pages)
-        del(useractivity)
+  if "render_threads" in changed_params and renderer is not None:
+    renderer.set_nb_threads(params.render_threads)
 
-      # Try to reopen the device immediately with an unknown previous status, so
-      # information is displayed upon trying to open the device
-      streamdeck_was_open = None
-      retry_open_at_tstamp = 0
+  # Has any parameter affecting the connection with the Stream Deck devices
+  # changed?
+  if changed_params & params.RECONNECT_PARAMS:
+
+    # Close the devices if needed
+    close_streamdecks()
+
+    # Try to reopen the devices immediately with an unknown previous status,
+    # so information is displayed upon trying to open the devices
+    streamdecks_were_open = None
+    retry_open_at_tstamp = 0
+    retry_open_every = 30
+
+  # Report the output of the start command while it's running, and forget about
+  # it once it's done
+  if cmd_start is not None and not report_shell_command(cmd_start,
+							"Start command"):
+    cmd_start = None
 
   # If the addon is disabled, reschedule ourselves to recheck the parameeters
   # in 1 second
@@ -183,52 +827,79 @@ def streamdeck_update():
     timer.start(1000)
     return
 
-  # Is the Stream Deck closed
-  if not streamdeck.is_open():
-
-    # If it's too early to try opening it, reschedule ourselves to rechech the
-    # parameters in 1 second
-    if now < retry_open_at_tstamp:
-      timer.start(1000)
-      return
-
-    # Try opening the device
-    streamdecks_info = streamdeck.open(params.use_streamdeck_type,
-					params.use_streamdeck_serial)
-
-    # If the open failed, reschedule ourselves to run in a while to let the
+  # Should we look for Stream Deck devices to open? We look for devices if none
+  # is open, or for additional devices if we use all the matching devices
+  # separately. If the start command should complete before trying to open
+  # devices and it's still running, wait for it
+  if now >= retry_open_at_tstamp and \
+	(not decks or \
+		(params.use_all_streamdecks and \
+			not params.combine_streamdecks)) and \
+	(cmd_start is None or not params.exec_cmd_start_wait):
+
+    # Try opening the devices
+    streamdecks_info, nb_opened = open_streamdecks()
+
+    # Look for devices again in 30 seconds, or look for additional devices
+    # twice as long after the last time if none turned up, up to 2 minutes.
+    # Stop looking for additional devices once all the serial numbers we look
+    # for are open - until a device is lost or the filters change
+    if nb_opened or not decks:
+      retry_open_every = 30
+    else:
+      retry_open_every = min(retry_open_every * 2, 120)
+
+    serial_numbers = set([sn.lower() for sn in \
+				split_filter(params.use_streamdeck_serial)])
+    if serial_numbers and serial_numbers <= \
+		set([sd.serial_number.lower() for deck in decks \
+			for sd in deck.streamdecks if sd.serial_number]):
+      retry_open_at_tstamp = float("inf")
+    else:
+      retry_open_at_tstamp = now + retry_open_every
+
+    # If no device is open, reschedule ourselves to run in a while to let the
     # FreeCAD UI breathe a bit, as it takes long enough to try opening a Stream
     # Deck device that the FreeCAD UI freezes for a short time, which is not
     # desirable
-    if not streamdeck.is_open():
+    if not decks:
 
       # Show information about the Stream Decks if a Stream Deck was open before
       # or its status is unknown
-      if streamdeck_was_open is None or streamdeck_was_open:
+      if streamdecks_were_open is None or streamdecks_were_open:
+        print_version_once()
         print("-" * 79)
         for l in streamdecks_info:
           print(l)
         print("Retrying every 30 seconds...")
 
-      streamdeck_was_open = False
-      retry_open_at_tstamp = now + 30
+      streamdecks_were_open = False
 
       # Reschedule ourselves to recheck the parameeters in 1 second
       timer.start(1000)
       return
 
-    tbactions = ToolbarActions(main_window, action_changed)
-    update_actions = True
+    # Did we open new devices?
+    if nb_opened:
 
-    pages = StreamDeckPages(streamdeck.nbkeys, streamdeck.nbdials == 0)
+      # Get the toolbars and actions and rebuild all the pages right away
+      if tbactions is None:
+        tbactions = ToolbarActions(main_window, action_changed)
+        useractivity = UserActivity(main_window)
 
-    useractivity = UserActivity(main_window)
+      if renderer is None:
+        renderer = KeyRenderer(RenderCache(), None, params.render_threads)
+        start_render_worker()
 
-    last_action_pressed = None
+      # Render the static keys of the new devices ahead of time
+      for deck in decks:
+        deck.prerender_static_keys(renderer, bracket_colors())
 
-    # Show information about the Stream Decks if no Stream Deck was open before
-    if not streamdeck_was_open:
+      update_actions = True
+      next_actions_update_tstamp = 0
 
+      # Show information about the Stream Decks
+      print_version_once()
       print("-" * 79)
       for l in streamdecks_info:
         print(l)
@@ -241,238 +912,322 @@ def streamdeck_update():
 		format(params.bracket_color_expandable_tools.lower()))
         print("Buttons between {} brackets are available on all pages".
 		format(params.bracket_color_repeated_toolbars.lower()))
-        if streamdeck.nbdials > 0:
+        if any([deck.nbdials > 0 for deck in decks]):
           print("Spin the dials to change pages")
 
         show_help = False
 
       print("-" * 79)
 
-      streamdeck_was_open = True
+      streamdecks_were_open = True
 
-  # Get Stream Deck key press events
-  try:
-    input_events = streamdeck.get_input_events(params.long_keypress_duration)
-  except:
-    streamdeck.close()
-    del(tbactions)
-    del(pages)
-    del(useractivity)
-
-  # Is the Stream Deck still open?
-  if streamdeck.is_open():
-
-    # Process Stream Deck input events if a current page is displayed
-    if pages.current_page:
-      keystrings = pages.current_page.split(pages.SK)
-
-      for event_type, val in input_events:
-
-        # Is the event a key press?
-        if event_type in (streamdeck.SHORT_KEYPRESS, streamdeck.LONG_KEYPRESS):
-
-          # Get the action name
-          n = keystrings[val].split(pages.SV)[1]
-
-          # Is the key occupied?
-          if n:
-
-            # Change the page
-            if n in ("PAGEPREV", "PAGENEXT"):
-              last_action_pressed = None
-              if pages.flip(1 if n == "PAGENEXT" else -1):
-                update_streamdeck_keys = True
-
-            # Act upon a real action
-            else:
-              last_action_pressed = tbactions.actions[n]
-
-              # Is the event a long key press?
-              if event_type == streamdeck.LONG_KEYPRESS:
-
-                # If the action is expandable, toggle its expansion and
-                # force-rebuild all the pages
-                if n in tbactions.expanded_actions:
-                  tbactions.expanded_actions[n] = \
-			not tbactions.expanded_actions[n]
-                  update_actions = True
-                  next_actions_update_tstamp = 0
-
-                # If the action is a subaction of another action toggle the
-                # parent action's expansion and force-rebuild all the pages
-                elif tbactions.actions[n].issubactionof is not None and \
-			tbactions.actions[n].issubactionof in \
-					tbactions.expanded_actions:
-                  tbactions.expanded_actions[
-				tbactions.actions[n].issubactionof] = \
-			not tbactions.expanded_actions[
-				tbactions.actions[n].issubactionof]
-                  update_actions = True
-                  next_actions_update_tstamp = 0
-
-              # If the event is a short key press and the action is enabled,
-              # execute it
-              elif tbactions.actions[n].enabled:
-                tbactions.actions[n].action.trigger()
-
-        # Is the event a dial spin?
-        elif event_type == streamdeck.DIAL_SPIN_CLICKS:
-
-          # Flip as many pages as we got dial clicks
-          last_action_pressed = None
-          if pages.flip(val):
-            update_streamdeck_keys = True
-
-    # Should we get the current state of the FreeCAD toolbars and update the
-    # Stream Deck pages?
-    if not update_streamdeck_keys and now > next_actions_update_tstamp:
-
-      # Get the list of toolbars and toolbar actions currently displayed
-      if tbactions.extract_toolbar_actions_from_gui(params.excluded_toolbars,
-							update_actions):
-        update_actions = False
-
-        # Find out the first of the new toolbars, if there are new toolbars, so
-        # we can switch to it on the Stream Deck display
-        new_toolbar = None
-        for t in tbactions.toolbars:
-          if t not in tbactions.previous_toolbars and \
+  # No device is open yet: reschedule ourselves to recheck the parameters
+  if not decks:
+    timer.start(timer_reschedule_every_ms)
+    return
+
+  # Try to reconnect the devices closed because of an error quickly, keeping
+  # their pages. If a key surface can't be reconnected, give up on it and look
+  # for devices normally
+  for deck in decks[:]:
+    if not deck.is_open():
+      if not deck.reconnect(now, params.reconnect_max_attempts,
+				params.reconnect_first_delay,
+				params.reconnect_max_delay,
+				[sd.id for d in decks if d is not deck \
+					for sd in d.streamdecks]):
+        print("Stream Deck {} lost".format(deck.name))
+        deck.close()
+        decks.remove(deck)
+        retry_open_at_tstamp = 0
+        retry_open_every = 30
+
+      # If the key surface is back, bring its pages up to date with the
+      # toolbar actions, which may have changed - or been forgotten - while it
+      # was closed
+      elif deck.is_open():
+        deck.rebuild_pages(tbactions, params, None, {})
+
+  if not decks:
+    close_streamdecks()
+    timer.start(timer_reschedule_every_ms)
+    return
+
+  open_decks = [deck for deck in decks if deck.is_open()]
+
+  # Collect the keys rendered by the render worker process. If the worker
+  # stopped working, render the keys in FreeCAD from now on
+  if renderer.worker is not None and not renderer.worker.is_alive():
+    print("Stream Deck render worker process stopped: {}. Rendering the keys "
+		"in FreeCAD instead".format(renderer.worker.error))
+    renderer.stop_worker()
+    keys_rendered = True
+
+  else:
+    with profiler.phase("worker collect"):
+      keys_rendered = renderer.collect()
+
+  # Get and process the Stream Deck input events
+  all_input_events = []
+  for deck in open_decks:
+    with profiler.phase("input read"):
+      input_events = deck.get_input_events(params.long_keypress_duration)
+    all_input_events.extend(input_events)
+    counters.count("input_events", len(input_events))
+
+    with profiler.phase("input handling"):
+      if deck.process_input_events(input_events, tbactions):
+        update_actions = True
+        next_actions_update_tstamp = 0
+
+  open_decks = [deck for deck in open_decks if deck.is_open()]
+
+  # If the page styling has changed, rebuild the pages from the toolbar
+  # actions we already know, unless all the toolbar actions are about to be
+  # updated and the pages rebuilt anyway
+  if restyle_pages and not update_actions:
+    built_pages = {}
+    for deck in open_decks:
+      deck.rebuild_pages(tbactions, params, None, built_pages)
+
+  # If the page styling has changed, render the static keys again in the new
+  # bracket colors
+  if restyle_pages:
+    renderer.clear_static_keys()
+    for deck in open_decks:
+      deck.prerender_static_keys(renderer, bracket_colors())
+
+  # Should we get the current state of the FreeCAD toolbars and update the
+  # Stream Deck pages? Don't do it if keys need updating already, so page
+  # changes are displayed as fast as possible
+  if not any([deck.update_keys_needed for deck in open_decks]) and \
+	now > next_actions_update_tstamp:
+
+    # Get the list of toolbars and toolbar actions currently displayed. Only
+    # query the state of the actions that are displayed or about to be: the
+    # state of the others is queried when their pages come into view
+    with profiler.phase("gui extraction"):
+      actions_updated = tbactions.extract_toolbar_actions_from_gui(
+						params.excluded_toolbars,
+						update_actions,
+						displayed_actions(open_decks))
+    if actions_updated:
+      update_actions = False
+
+      # Record the toolbars in the input trace if they've changed
+      if input_trace.recording and \
+		tbactions.toolbars != tbactions.previous_toolbars:
+        record_toolbars()
+
+      # Forget about the actions that haven't been in the toolbars for a while
+      tbactions.forget_unseen_actions(params.forget_actions_after_refreshes,
+				params.forget_actions_after_minutes * 60)
+
+      # If the toolbars are ordered by usage, rank them when they change - when
+      # switching workbenches typically - but not in-between, so the pages
+      # don't move around while they're being used
+      if params.order_toolbars_by_usage and \
+		(tbactions.toolbar_ranks is None or \
+			tbactions.toolbars != tbactions.previous_toolbars):
+        tbactions.rank_toolbars()
+
+      # Find out the first of the new toolbars, if there are new toolbars, so
+      # we can switch to it on the Stream Deck display
+      new_toolbar = None
+      for t in tbactions.toolbars:
+        if t not in tbactions.previous_toolbars and \
 		t not in params.repeated_toolbars:
-            new_toolbar = t
-            break
-
-        # Rebuild the entire set of Stream Deck pages using the updated toolbars
-        # and actions
-        pages.rebuild_pages(tbactions, params.repeated_toolbars,
-				params.bracket_color_repeated_toolbars,
-				params.bracket_color_page_nav_keys,
-				params.bracket_color_expandable_tools)
-
-        # Find the new location of the current page in the newly-rebuilt pages
-        # and update it
-        pages.locate_current_page(new_toolbar, last_action_pressed)
-
-        update_streamdeck_keys = True
-
-      # Calculate the next time we need to get the list of toolbars and actions
-      next_actions_update_tstamp = now + params.check_toolbar_updates_every
-
-    # Should we update the Stream Deck keys?
-    if update_streamdeck_keys:
-
-      # Update the keys that need updating
-      if not pages.current_page:
-
-        # Clear all the Stream Deck keys if we don't have a current page anymore
-        if pages.previous_current_page:
-          for keyno in range(streamdeck.nbkeys):
-            try:
-              streamdeck.set_key(keyno, None)
-            except:
-              streamdeck.close()
-              del(tbactions)
-              del(pages)
-              del(useractivity)
-              break
-
-      # Update the keys to display the current page as needed
-      else:
-        keystrings = pages.current_page.split(pages.SK)
-        if pages.previous_current_page:
-          prev_keystrings = pages.previous_current_page.split(pages.SK)
-
-        for keyno, ks in enumerate(keystrings):
-          if not pages.previous_current_page or ks != prev_keystrings[keyno]:
-
-            _, n, _, _, tt, bt, lbc, rbc = ks.split(pages.SV)
-            img = n if n in ("", "PAGEPREV", "PAGENEXT") else \
-		tbactions.actions[n].icon_as_pil_image()
-
-            try:
-              streamdeck.set_key(keyno, img, tt, bt, lbc, rbc)
-            except:
-              streamdeck.close()
-              del(tbactions)
-              del(pages)
-              del(useractivity)
-              break
-
-  # Determine if the user is active and set the brightness of the Stream Deck's
-  # display accordingly
-  if streamdeck.is_open():
-
-    ua = useractivity.is_active(now, params.fade_after_secs_inactivity \
+          new_toolbar = t
+          break
+
+      # Rebuild the entire set of Stream Deck pages using the updated toolbars
+      # and actions - once per key surface size - and find the new location of
+      # the current pages in the newly-rebuilt pages
+      built_pages = {}
+      for deck in open_decks:
+        deck.rebuild_pages(tbactions, params, new_toolbar, built_pages)
+
+      if params.pack_toolbars:
+        report_page_layout(open_decks)
+
+    # Calculate the next time we need to get the list of toolbars and actions
+    next_actions_update_tstamp = now + params.check_toolbar_updates_every
+
+  # If pages with actions whose state wasn't queried while they were out of
+  # view have come into view, query their state and rebuild the pages if it
+  # has changed
+  with profiler.phase("action refresh"):
+    actions_refreshed = tbactions.refresh_actions(displayed_actions(open_decks))
+  if actions_refreshed:
+    built_pages = {}
+    for deck in open_decks:
+      deck.rebuild_pages(tbactions, params, None, built_pages)
+
+  # Update the keys that need updating, and the keys whose images have just
+  # been rendered by the worker process, for as long as the key update budget
+  # allows. The icons are converted only once for all the key surfaces
+  deadline = perf_counter() + params.key_update_budget / 1000 \
+		if params.key_update_budget else None
+  icon_images = {}
+  for deck in open_decks:
+    if deck.update_keys_needed or (deck.keys_pending and keys_rendered):
+      with profiler.phase("key update"):
+        deck.update_keys(tbactions, renderer, icon_images, deadline)
+
+  # Show where the current page is on the touchscreens of the devices that have
+  # one, if it's changed
+  for deck in open_decks:
+    with profiler.phase("touchscreen update"):
+      deck.update_touchscreens(params.touchscreen_enabled)
+
+  # Determine if the user is active and set the brightness of the Stream Decks'
+  # displays accordingly
+  ua = useractivity.is_active(now, params.fade_after_secs_inactivity \
 					if params.fading_enabled else None,
-					[input_events, parameters_synchronized])
-    try:
-      streamdeck.set_brightness(params.min_brightness, params.max_brightness,
-				params.fade_time, ua)
-    except:
-      streamdeck.close()
-      del(tbactions)
-      del(pages)
-      del(useractivity)
-
-  # Reschedule ourselves
-  timer.start(timer_reschedule_every_ms)
+					[all_input_events, brightness_changed],
+					params.deep_idle_enabled and \
+					params.deep_idle_after_secs > 0)
+  with profiler.phase("brightness"):
+    for deck in open_decks:
+      if deck.is_open():
+        deck.set_brightness(params.min_brightness, params.max_brightness,
+				params.fade_time, ua, max(params.fade_gamma, 0.1))
+
+  # Time the whole update, and report the profile regularly
+  profiler.record("tick", tick_tstamp, perf_counter())
+
+  if profiler.enabled and now >= next_profile_report_tstamp:
+    report_profile()
+    next_profile_report_tstamp = now + params.profile_report_every
+
+  # Report the statistics regularly if requested
+  if params.stats_report_every and now >= next_stats_report_tstamp:
+    if params.stats_in_report_view:
+      print_stats()
+
+    if params.stats_file:
+      error = dump_stats(params.stats_file)
+      if error is not None:
+        print("Could not write the Stream Deck statistics: {}".format(error))
+
+    next_stats_report_tstamp = now + params.stats_report_every
+
+  # Power the devices down and stop updating if the user has been inactive for
+  # long enough, or if the main window has just been minimized. If a device
+  # wakes the addon up while the main window is still minimized, stay awake
+  # until the user is inactive for long enough again
+  if params.deep_idle_enabled:
+    minimized = main_window.isMinimized()
+
+    if all([deck.is_open() for deck in open_decks]) and \
+	((params.deep_idle_when_minimized and minimized and \
+		not main_window_was_minimized) or \
+	(params.deep_idle_after_secs and \
+		useractivity.inactive_for(now) >= params.deep_idle_after_secs)):
+      main_window_was_minimized = minimized
+      if enter_deep_idle():
+        return
+
+    main_window_was_minimized = minimized
+
+  # Reschedule ourselves, sooner if a device needs reconnecting, if keys are
+  # left to update or if keys are being rendered by the worker process, to
+  # upload them as soon as they're ready
+  delays = [d for d in [deck.reconnect_delay(time()) for deck in decks] \
+		if d is not None]
+  if renderer.has_pending():
+    delays.append(0.01)
+
+  # If keys couldn't all be updated within the budget, update the rest at the
+  # next turn of the event loop
+  if any([deck.update_keys_needed for deck in open_decks if deck.is_open()]):
+    delays.append(0)
+  timer.start(min([timer_reschedule_every_ms] + \
+			[round(d * 1000) for d in delays]))
 
 
 
 ## Main routine
 #
 
-def start(FreeCAD):
+def start(FreeCAD, startup_tstamp = None):
   """Start the addon
+  startup_tstamp is the perf_counter() timestamp at which the addon started
+  loading, if known, to report how long the addon takes to start
   """
 
   global params
 
   global main_window
 
-  global streamdeck
-  global streamdeck_was_open
+  global decks
+  global streamdecks_were_open
   global show_help
+  global show_version
   global retry_open_at_tstamp
+  global retry_open_every
+
+  global tbactions
+  global useractivity
+  global renderer
+  global simulated_devices
+  global remote_devices
 
   global timer
   global timer_reschedule_every_ms
   global next_actions_update_tstamp
+  global next_profile_report_tstamp
+  global next_stats_report_tstamp
+  global deep_idle
+  global deep_idle_waker
+  global deep_idle_wake_poll_every
+  global main_window_was_minimized
+  global page_layout_report
 
-  # Determine the platform
-  is_win = sys.platform[0:3] == "win"
+  global cmd_start
 
-  # Determine the installation directory
-  install_dir = os.path.dirname(__file__)
-  as_installed = lambda f: os.path.abspath(os.path.join(install_dir, f))
-
-  # If the package.xml file is around, try to extract the version number from it
-  # and display it
-  try:
-    with open(as_installed("package.xml"), "r") as f:
-      print("*** Stream Deck Addon version {} ***".
-		format(re.search("<version>\s*(\S+)\s*</version>",
-			f.read())[1]))
-  except Exception as e:
-    pass
+  start_tstamp = perf_counter()
 
   # Create the parameters
   params = UserParameters(FreeCAD)
 
-  # Get the name of the appropriate font to write in the Stream Deck keys
-  # depending on the platform
-  font_filename = params.streamdeck_key_text_font_filename_windows \
-				if is_win else \
-			params.streamdeck_key_text_font_filename_linux
+  # Profile the updates if requested, and report the profile regularly
+  profiler.configure(params.profile_updates, params.profile_trace_file)
+  next_profile_report_tstamp = time() + params.profile_report_every
+
+  # When to report the statistics next if requested
+  next_stats_report_tstamp = time() + params.stats_report_every
 
-  # Initialize the streamdeck object
-  streamdeck = StreamDeck(font_filename, params.streamdeck_key_text_font_size,
-				as_installed(params.prev_streamdeck_key_icon),
-				as_installed(params.next_streamdeck_key_icon),
-				as_installed(params.blank_streamdeck_key_icon),
-				as_installed(params.broken_streamdeck_key_icon))
-  streamdeck_was_open = None
+  # The Stream Deck objects are only created when the addon is enabled, and
+  # their font and icons are only loaded when a device is found
+  decks = []
+  streamdecks_were_open = None
   show_help = True
+  show_version = True
   retry_open_at_tstamp = 0
+  retry_open_every = 30
+
+  # The toolbar actions and the user activity are shared by all the devices.
+  # They're created when the first device is opened
+  tbactions = None
+  useractivity = None
+
+  # Rendered key images are cached as long as the addon runs, are shared by all
+  # the devices and survive reconnections. The renderer and its optional worker
+  # process are created when the first device is opened
+  renderer = None
+
+  # The page counts are only reported when they change
+  page_layout_report = None
+
+  # Simulated devices are only created if simulated device types are used
+  simulated_devices = None
+
+  # The device daemon is only connected to if it's used
+  remote_devices = None
+
+  # Record the input trace if requested
+  start_input_trace()
 
   # Timer interval in milliseconds
   timer_reschedule_every_ms = round(params.check_streamdeck_every * 1000)
@@ -488,12 +1243,41 @@ def start(FreeCAD):
   timer.setSingleShot(True)
   timer.timeout.connect(streamdeck_update)
 
-  # If we have a shell command to execute when starting, execute it
+  # The addon isn't powered down to begin with. When it is, the devices'
+  # watcher threads block waiting for a touch - or check once a second for
+  # the devices that can't be read blocking - and they and the user's
+  # activity in FreeCAD wake it up through the waker's signal, in the main
+  # thread
+  deep_idle = False
+  deep_idle_wake_poll_every = 1
+  main_window_was_minimized = False
+  deep_idle_waker = DeepIdleWaker(main_window)
+  deep_idle_waker.wake.connect(leave_deep_idle, QtCore.Qt.QueuedConnection)
+
+  # If we have a shell command to execute when starting, start it in the
+  # background. Its output is reported and its completion is checked by the
+  # Stream Deck update routine
+  cmd_start = None
   if params.exec_cmd_start:
-    os.system(params.exec_cmd_start)
+    from shell_commands import ShellCommand
+
+    cmd_start = ShellCommand(params.exec_cmd_start,
+				params.exec_cmd_start_timeout)
+    cmd_start.start()
 
   # Connect the main window's destroyed() signal to the shutdown callback
   main_window.destroyed.connect(shutdown)
 
   # Schedule the timer for the first itme
   timer.start()
+
+  # Report how long the addon took to load and start if requested
+  if params.report_startup_time:
+    now = perf_counter()
+    if startup_tstamp is None:
+      startup_tstamp = start_tstamp
+    print("Stream Deck Addon: {:.1f} ms added to FreeCAD startup "
+		"({:.1f} ms importing, {:.1f} ms starting)".
+		format((now - startup_tstamp) * 1000,
+			(start_tstamp - startup_tstamp) * 1000,
+			(now - start_tstamp) * 1000))
@@ -4,13 +4,286 @@
 ## Modules
 #
 
+import ctypes
 from time import time
-
-from PIL import Image, ImageDraw, ImageFont
+from threading import Thread, Condition, Event, Lock
+from collections import OrderedDict
 
 from StreamDeck.Devices.StreamDeck import ControlType, DialEventType
 from StreamDeck.DeviceManager import DeviceManager
-from StreamDeck.ImageHelpers import PILHelper
+
+from tick_profiler import profiler
+from perf_counters import counters
+from input_trace import input_trace, encode_control_states
+
+# PIL and the StreamDeck PIL helper are only imported once a device is found -
+# see import_imaging_modules()
+Image = None
+ImageDraw = None
+ImageFont = None
+PILHelper = None
+key_labels = None
+
+
+
+## Routines
+#
+
+def import_imaging_modules():
+  """Import PIL and the StreamDeck PIL helper on first use
+  """
+
+  global Image
+  global ImageDraw
+  global ImageFont
+  global PILHelper
+  global key_labels
+
+  if PILHelper is None:
+    from PIL import Image, ImageDraw, ImageFont
+    from StreamDeck.ImageHelpers import PILHelper
+    from key_labels import key_labels
+
+
+
+def compose_key_image(deck, font, margins, image, broken_image,
+			top_text = None, bottom_text = None,
+			left_bracket_color = None, right_bracket_color = None,
+			prescaled = False):
+  """Compose an image for a Stream Deck key with optional text at the top and
+  at the bottom, and optional colored brackets left and right of the image
+  deck is any object whose key_image_format() method returns the format of
+  the key images - a device or a stand-in - so keys can also be composed
+  without a device, in a render worker process for example
+  In case of error scaling the image, scale broken_image instead
+  If prescaled is True, the image is already scaled to the key with the
+  margins - see scale_key_image() - and is only copied
+  Return the image in the device's native format
+  """
+
+  image = image.copy() if prescaled else \
+		scale_key_image(deck, image, margins, broken_image)
+
+  xr = image.width - 1	# Right horizontal coordinate in the image
+  yb = image.height - 1	# Bottom vertical coordinate in the image
+
+  # Do we have text or brackets to add to the icon?
+  if top_text or bottom_text or left_bracket_color or right_bracket_color:
+
+    # If we have text, blit the labels fitted to the width of the key on top
+    # of the image
+    for text, anchor in ((top_text, "mt"), (bottom_text, "mb")):
+      if text:
+        mask, position = key_labels.get(text, anchor, font, image.size)
+        if mask is not None:
+          image.paste("white", position, mask)
+
+    # If we have brackets, draw them. If the color name is incorrect, default
+    # to dark grey
+    draw = ImageDraw.Draw(image)
+
+    if left_bracket_color:
+      for color in (left_bracket_color, "darkslategrey"):
+        try:
+          draw.line([(margins[3] - 2, margins[0] + 2),
+			(4, margins[0] + 2),
+			(4, yb - margins[2] - 2),
+			(margins[3] - 2, yb - margins[2] - 2)],
+			width = 5, fill = color)
+          break
+        except:
+          pass
+
+    if right_bracket_color:
+      for color in (right_bracket_color, "darkslategrey"):
+        try:
+          draw.line([(xr - margins[1] + 2, margins[0] + 2),
+			(xr - 4, margins[0] + 2),
+			(xr - 4, yb - margins[2] - 2),
+			(xr - margins[1] + 2, yb - margins[2] - 2)],
+			width = 5, fill = color)
+          break
+        except:
+          pass
+
+  # Convert the image to the device's native format
+  with profiler.phase("encode"):
+    return PILHelper.to_native_key_format(deck, image)
+
+
+
+def scale_key_image(deck, image, margins, broken_image):
+  """Scale an image to the size of a key with margins around it - see
+  compose_key_image(). In case of error, scale broken_image instead
+  """
+
+  try:
+    return PILHelper.create_scaled_image(deck, image, margins = margins)
+
+  except:
+    return PILHelper.create_scaled_image(deck, broken_image, margins = margins)
+
+
+
+def fade_steps(start, end, duration, gamma = 1, min_interval = 0):
+  """Return the distinct brightness steps of a fade from the start brightness
+  to the end brightness - in percent - over duration seconds, as a list of
+  (seconds since the start of the fade, brightness) in order
+  The gamma-th root of the brightness changes linearly over time: a gamma of
+  1 fades linearly, a gamma around 2.2 fades evenly to the eye
+  Each step is due when the exact brightness crosses halfway to it, so it's
+  the rounded brightness at that time. Steps less than min_interval seconds
+  after the previous one are skipped, except the last one, which is delayed
+  """
+
+  start = int(start)
+  end = int(end)
+
+  if start == end:
+    return []
+
+  if duration <= 0:
+    return [(0, end)]
+
+  p = lambda b: (max(b, 0) / 100) ** (1 / gamma)
+  p_start, p_end = p(start), p(end)
+
+  direction = 1 if end > start else -1
+
+  steps = []
+  for b in range(start + direction, end + direction, direction):
+    t = min(max(duration * (p(b - direction / 2) - p_start) / \
+				(p_end - p_start), 0), duration)
+
+    if steps and t < steps[-1][0] + min_interval:
+      if b != end:
+        continue
+      t = steps[-1][0] + min_interval
+
+    steps.append((t, b))
+
+  return steps
+
+
+
+def wait_for_hid_report(dev, timeout):
+  """Block until a device opened with the StreamDeck library's HIDAPI
+  transport sends an input report, for at most timeout seconds. The report is
+  read straight from HIDAPI without taking the library's locks, so the device
+  can still be written to meanwhile
+  Return True if a report came in - it's dropped - False if the timeout
+  expired, or None if the device's transport can't do blocking reads
+  Raise an IOError if the read fails
+  """
+
+  transport = getattr(dev, "device", None)
+  handle = getattr(transport, "device_handle", None)
+  hidapi = getattr(getattr(transport, "hidapi", None), "HIDAPI_INSTANCE", None)
+
+  if not handle or hidapi is None:
+    return None
+
+  hidapi.hid_read_timeout.argtypes = [ctypes.c_void_p,
+					ctypes.POINTER(ctypes.c_char),
+					ctypes.c_size_t, ctypes.c_int]
+  hidapi.hid_read_timeout.restype = ctypes.c_int
+
+  report = ctypes.create_string_buffer(1024)
+  result = hidapi.hid_read_timeout(handle, report, len(report),
+					int(timeout * 1000))
+  if result < 0:
+    raise IOError("Failed to read in report ({})".format(result))
+
+  return result > 0
+
+
+
+def find_streamdecks(device_types, serial_numbers, exclude_ids = (),
+			device_manager = None):
+  """Find the available Stream Deck devices matching any of the specified
+  device types and any of the specified serial numbers (case-independent)
+  If device_types is empty, any device type is valid
+  If serial_numbers is empty, any serial number is valid
+  Devices whose IDs are in exclude_ids - devices already open - are ignored
+  Devices without displays and devices of other types are ignored without
+  being opened, and devices are only opened to get their serial numbers if
+  serial_numbers isn't empty, as they may be in use by other applications
+  If device_manager is None, the devices are enumerated by the StreamDeck
+  library's DeviceManager
+  Return a list of (device, serial number or None if it wasn't needed) for
+  the matching devices, sorted in the order of the device types then serial
+  numbers they match, and information lines summarizing what devices were
+  found
+  """
+
+  types = [t.lower() for t in device_types]
+  sns = [sn.lower() for sn in serial_numbers]
+
+  info = []
+
+  # Get a list of available Stream Deck devices
+  try:
+    devs = [d for d in (device_manager if device_manager is not None \
+				else DeviceManager()).enumerate() \
+		if d.id() not in exclude_ids]
+    if devs:
+      info.append("Stream Deck devices found:")
+
+  except Exception as e:
+    info.append("Error finding available Stream Deck devices: {}".format(e))
+    return [], info
+
+  # Get the serial numbers of the available Stream Deck devices of the right
+  # types if we look for specific serial numbers and if possible. Ignore the
+  # devices without displays, like the Stream Deck Pedal
+  dev_sns = {}
+  for dev in devs:
+    if not dev.is_visual() or (types and dev.deck_type().lower() not in types):
+      info.append('  Type "{}": ignored'.format(dev.deck_type()))
+      continue
+
+    dev_sns[dev] = None
+
+    if not sns:
+      info.append('  Type "{}"'.format(dev.deck_type()))
+      continue
+
+    try:
+      dev.device.open()
+      dev_sns[dev] = dev.get_serial_number()
+      info.append('  Type "{}": serial number "{}"'.
+			format(dev.deck_type(), dev_sns[dev]))
+    except Exception as e:
+      info.append('  Type "{}": could not get serial number: {}'.
+			format(dev.deck_type(), e))
+
+    try:
+      dev.close()
+    except:
+      pass
+
+  # Find the matching devices
+  matches = []
+  for i, dev in enumerate(dev_sns):
+    t = dev.deck_type().lower()
+    sn = dev_sns[dev].lower() if dev_sns[dev] else None
+
+    if not sns or sn in sns:
+      matches.append(((types.index(t) if types else 0,
+			sns.index(sn) if sns else 0, i), dev, dev_sns[dev]))
+
+  if not matches:
+    info.append("Stream Deck {}{}not found".format(
+			"" if not device_types else \
+			"type {} ".format(" or ".join(['"{}"'.format(t) \
+						for t in device_types])),
+			"" if not serial_numbers else \
+			"with serial number {} ".
+				format(" or ".join(['"{}"'.format(sn) \
+						for sn in serial_numbers]))))
+
+  return [(dev, sn) for _, dev, sn in sorted(matches, key = lambda m: m[0])], \
+		info
 
 
 
@@ -26,31 +299,86 @@ class StreamDeck():
   LONG_KEYPRESS = 1
   DIAL_SPIN_CLICKS = 2
 
+  # Shortest time between two brightness steps of a fade, in seconds
+  MIN_FADE_STEP_INTERVAL = 0.02
+
+  # Longest time a wake watcher blocks reading a device before checking
+  # whether it should stop, in seconds
+  WAKE_WATCH_READ_TIMEOUT = 1
+
 
 
   def __init__(self, ttf_file, ttf_size, prev_image_file, next_image_file,
-		blank_image_file, broken_image_file):
+		blank_image_file, broken_image_file, device_manager = None):
     """__init__ method
-    Load the specified TrueType font of the specified size and load the
-    predefined images
+    Record the specified TrueType font of the specified size and the
+    predefined images. They are only loaded when a device is first opened
+    If device_manager is None, the devices are enumerated by the StreamDeck
+    library's DeviceManager. Otherwise they are enumerated by the
+    device_manager object's enumerate() method - to use simulated devices for
+    example
     """
 
     self.dev = None
+    self.id = None
+    self.serial_number = None
     self.nbkeys = None
     self.nbdials = None
+    self.geometry = None
+
+    self.__writer = None
+    self.__writer_queue = OrderedDict()
+    self.__writer_cond = Condition()
+    self.__writer_stop = False
+    self.__writer_error = None
+
+    self.__watcher = None
+    self.__watcher_stop = Event()
+    self.__watcher_lock = Lock()
+    self.__watcher_reading = False	# The watcher may be blocked reading
+    self.__watcher_closes_device = False	# The watcher closes the device
+						# once it's done reading it
+
+    self.__device_manager = device_manager
+    self.__last_device = None
 
     self.__key_states_tstamps = None
     self.__brightness = None
     self.__fade_start_tstamp = None
+    self.__fade_steps = []	# (due timestamp, brightness) of the steps of
+				# the current fade left to write
+
+    self.__ttf_file = ttf_file
+    self.__ttf_size = ttf_size
+    self.__image_files = (prev_image_file, next_image_file,
+				blank_image_file, broken_image_file)
+
+    self.font = None
+    self.__touchscreen_font = None
+    self.__scaled_images = {}
+
+
+
+  def __load_resources(self):
+    """Load the TrueType font and the predefined images if they haven't been
+    loaded already
+    """
+
+    if self.font is not None:
+      return
+
+    import_imaging_modules()
 
     # Load the TrueType font
-    self.font = ImageFont.truetype(ttf_file, ttf_size)
+    self.font = ImageFont.truetype(self.__ttf_file, self.__ttf_size)
 
-    # Preload icons for the Stream Deck keys
-    self.prev_image = Image.open(prev_image_file)
-    self.next_image = Image.open(next_image_file)
-    self.blank_image = Image.open(blank_image_file)
-    self.broken_image = Image.open(broken_image_file)
+    # Preload icons for the Stream Deck keys. Load them fully right away, so
+    # keys can be rendered from several threads at once
+    self.prev_image, self.next_image, self.blank_image, self.broken_image = \
+		[Image.open(f) for f in self.__image_files]
+    for image in (self.prev_image, self.next_image, self.blank_image,
+			self.broken_image):
+      image.load()
 
     # Determine the margins between the icon and the edges of the Stream Deck
     # keys to leave just enough space for the top and bottom text
@@ -60,93 +388,122 @@ class StreamDeck():
 
 
 
-  def open(self, device_type, serial_number):
-    """Try to open and reset the Stream Deck device with the specified device
-    type and serial number (case-independent)
+  def open(self, device_type, serial_number, exclude_ids = ()):
+    """Try to open and reset the first Stream Deck device with the specified
+    device type and serial number (case-independent)
     If device_type is None, any device type is valid
     If serial_number is None, any serial number is valid
+    Devices whose IDs are in exclude_ids are ignored
     Return information lines summarizing what devices were found and which was
     opened, or what happened if the open failed
     """
 
+    matches, info = find_streamdecks([device_type] if device_type else [],
+					[serial_number] if serial_number else [],
+					exclude_ids, self.__device_manager)
+
+    # Try to open the matching devices in turn until one opens
     self.dev = None
-    self.__key_states_tstamps = None
+    for dev, sn in matches:
+      if self.open_device(dev, sn, info):
+        break
+
+    return info
 
-    dev_sns = None
-    info = []
 
-    # Get a list of available Stream Deck devices and their serial numbers if
-    # possible
+
+  def open_device(self, dev, serial_number, info):
+    """Try to open and reset a Stream Deck device found by find_streamdecks()
+    Append information lines about what happened to info
+    Return True if the device was opened
+    """
+
+    self.dev = dev
+    self.__key_states_tstamps = None
+
+    # Open the device, and get its serial number if it wasn't needed to find
+    # it
     try:
-      dev_sns = {d: None for d in DeviceManager().enumerate()}
-      if dev_sns:
-        info.append("Stream Deck devices found:")
+      self.dev.device.open()
+      self.dev._reset_key_stream()
+
+      if serial_number is None:
+        try:
+          serial_number = self.dev.get_serial_number()
+        except:
+          pass
+
+      error = None
 
     except Exception as e:
-      info.append("Error finding available Stream Deck devices: {}".format(e))
-      dev_sns = None
+      error = e
 
-    # Did we find devices?
-    if dev_sns is not None:
+    info.append('Using Stream Deck type "{}" {}'.
+		format(self.dev.deck_type(),
+			'with serial number "{}"'.format(serial_number) \
+				if serial_number else ""))
 
-      # Get the serial numbers of the available Stream Deck devices if possible
-      for self.dev in dev_sns:
-        try:
-          self.dev.device.open()
-          dev_sns[self.dev] = self.dev.get_serial_number()
-          info.append('  Type "{}": serial number "{}"'.
-			format(self.dev.deck_type(), dev_sns[self.dev]))
-        except Exception as e:
-          info.append('  Type "{}": could not get serial number: {}'.
-			format(self.dev.deck_type(), e))
-
-        if self.dev is not None:
-          try:
-            self.dev.close()
-          except:
-            pass
+    if error is not None:
+      info.append('  Error opening the device: {}"'.format(error))
+      try:
+        self.dev.close()
+      except:
+        pass
+      self.dev = None
+      return False
 
-      # Try to match a device to open
-      for self.dev in dev_sns:
-        if not device_type or \
-		self.dev.deck_type().lower() == device_type.lower():
-          if not serial_number or \
-		(dev_sns[self.dev] and \
-			dev_sns[self.dev].lower() == serial_number.lower()):
-            info.append('Using Stream Deck type "{}" {}'.
-			format(self.dev.deck_type(),
-				'with serial number "{}"'.
-					format(dev_sns[self.dev]) \
-						if dev_sns[self.dev] else ""))
-
-            # Open the device
-            try:
-              self.dev.device.open()
-              self.dev._reset_key_stream()
-
-            except Exception as e:
-              info.append('  Error opening the device: {}"'.format(e))
-              try:
-                self.dev.close()
-              except:
-                pass
-              self.dev = None
-
-            # If the open was successful, stop trying
-            if self.dev is not None:
-              self.nbkeys = self.dev.key_count()
-              self.nbdials = self.dev.dial_count()
-              break
-
-      else:
-        info.append("Stream Deck {}{}not found".format(
-			"" if not device_type else \
-			'type "{}" '.format(device_type),
-			"" if not serial_number else \
-			'with serial number "{}" '.format(serial_number)))
-        self.dev = None
+    self.__load_resources()
+    self.nbkeys = self.dev.key_count()
+    self.nbdials = self.dev.dial_count()
 
-    return info
+    # Describe the geometry and native format of the key images, so rendered
+    # images can be reused for any device of the same kind
+    f = self.dev.key_image_format()
+    self.geometry = (tuple(f["size"]), f["format"], tuple(f["flip"]),
+			f["rotation"]) if f else None
+
+    # Scale the predefined images for the device once and for all
+    if f:
+      self.__scaled_images = {n: scale_key_image(self.dev, image,
+							self.margins,
+							self.broken_image) \
+				for n, image in (("", self.blank_image),
+						("PAGEPREV", self.prev_image),
+						("PAGENEXT", self.next_image))}
+
+    self.serial_number = serial_number
+    self.__last_device = (self.dev.deck_type(), serial_number)
+    self.id = self.dev.id()
+
+    self.record_device()
+
+    return True
+
+
+
+  def record_device(self):
+    """Record the device in the input trace if it's being recorded, so the
+    input read from it can be replayed on a simulated device of the same kind
+    """
+
+    input_trace.record("device", id = self.id, type = self.dev.deck_type(),
+			keys = self.nbkeys, dials = self.nbdials)
+
+
+
+  def reopen(self, exclude_ids = ()):
+    """Try to reopen the device that was last opened successfully, after it was
+    closed because of an error
+    Devices whose IDs are in exclude_ids are ignored
+    Return True if the device was reopened
+    """
+
+    if self.__last_device is None:
+      return False
+
+    self.open(*self.__last_device, exclude_ids)
+
+    return self.is_open()
 
 
 
@@ -157,29 +514,45 @@ class StreamDeck():
 
     if self.dev is not None:
 
-      # Try to reset the Stream Deck
-      try:
-        self.dev.reset()
-      except:
-        pass
+      # Stop the writer thread and drop whatever it hasn't written yet, and
+      # stop watching the device without waiting for the watcher to finish
+      # the read it may be blocked in
+      self.stop_writer()
+      self.stop_wake_watcher()
 
-      # Set the brightness of the Stream Deck's display to 0 to preserve it
-      try:
-        self.dev.set_brightness(0)
-      except:
-        pass
+      # Try to reset the Stream Deck and set the brightness of its display to
+      # 0 to preserve it, unless the device daemon owns it: the daemon keeps
+      # displaying our keys for a while and blanks the device itself
+      if not getattr(self.dev, "owned_by_daemon", False):
 
-      # Try to close the Stream Deck
-      try:
-        self.dev.close()
-      except:
-        pass
+        try:
+          self.dev.reset()
+        except:
+          pass
+
+        try:
+          self.dev.set_brightness(0)
+        except:
+          pass
+
+      # Try to close the Stream Deck, or let the wake watcher close it if
+      # it's still reading it
+      with self.__watcher_lock:
+        if self.__watcher_reading:
+          self.__watcher_closes_device = True
+
+        else:
+          try:
+            self.dev.close()
+          except:
+            pass
 
       self.dev = None
       self.nbkeys = None
       self.__key_states_tstamps = None
       self.__brightness = None
       self.__fade_start_tstamp = None
+      self.__fade_steps = []
 
 
   def is_open(self):
@@ -197,8 +570,20 @@ class StreamDeck():
     a long press
     Also detect dial spin clicks if the device has dials
     Return a list of (event_type, keyno or dial_spin_clicks) tuples
+    Also raise the error that stopped the writer thread if any, so a failed
+    write is noticed even if nothing else is written afterward
     """
 
+    if self.__writer_error is not None:
+      raise self.__writer_error
+
+    # Don't read the device while the wake watcher is still finishing the
+    # read it was blocked in when it was told to stop
+    if self.__watcher is not None:
+      if self.__watcher.is_alive():
+        return []
+      self.__watcher = None
+
     input_events = []
 
     # Get and process input events until we run out
@@ -208,8 +593,12 @@ class StreamDeck():
 
       prev_key_states_tstamps = self.__key_states_tstamps
 
-      # Read events from the Stream Deck
+      # Read events from the Stream Deck, and record them in the input trace
+      # if it's being recorded
       events = self.dev._read_control_states()
+      if events is not None and input_trace.recording:
+        input_trace.record("read", id = self.id,
+				states = encode_control_states(events))
       key_states = None
       dial_spin_clicks = 0	# -n = dials spun n clicks counterclockwise,
 				# +n = dials spun n clicks clockwise
@@ -292,121 +681,436 @@ class StreamDeck():
 
 
 
-  def set_key(self, keyno, image,
+  def render_key(self, image,
 		top_text = None, bottom_text = None,
 		left_bracket_color = None, right_bracket_color = None):
-    """Upload an image to a Stream Deck key number with optional text at the top
-    and at the bottom, and optional colored brackets left and right of the
-    image
-    If image is None or "", load the blank icon
-    If image is "PAGEPREV", load the previous icon
-    If image is "PAGENEXT", load the next icon
-    If image is a string, treat it as a filename load this image file
-    In case of error loading the image file and/or scaling it, load and scale a
-    "broken image" icon instead
+    """Render an image for a Stream Deck key with optional text at the top and
+    at the bottom, and optional colored brackets left and right of the image
+    If image is None or "", use the blank icon
+    If image is "PAGEPREV", use the previous icon
+    If image is "PAGENEXT", use the next icon
+    Those predefined icons are scaled only once for the device
+    In case of error scaling the image, scale a "broken image" icon instead
+    Return the image in the device's native format
     """
 
-    if not image:
-      image = self.blank_image
+    with profiler.phase("render"):
 
-    elif image == "PAGEPREV":
-      image = self.prev_image
+      # Use the predefined images already scaled for this device
+      if not image or image in ("PAGEPREV", "PAGENEXT"):
+        return compose_key_image(self.dev, self.font, self.margins,
+				self.__scaled_images[image or ""],
+				self.broken_image, top_text, bottom_text,
+				left_bracket_color, right_bracket_color, True)
 
-    elif image == "PAGENEXT":
-      image = self.next_image
+      return compose_key_image(self.dev, self.font, self.margins, image,
+				self.broken_image, top_text, bottom_text,
+				left_bracket_color, right_bracket_color)
+
+
+
+  def touchscreen_regions(self):
+    """Return the regions of the touchscreen above each dial, as a list of
+    (x, y, width, height), or an empty list if the device doesn't have a
+    touchscreen
+    """
+
+    f = self.dev.touchscreen_image_format()
+    if not f or not f.get("format") or not f.get("size") or \
+		not f["size"][0] or not self.nbdials:
+      return []
+
+    width, height = f["size"]
+    w = width // self.nbdials
+
+    return [(i * w, 0, w, height) for i in range(self.nbdials)]
 
-    try:
-      image = PILHelper.create_scaled_image(self.dev, image,
-						margins = self.margins)
 
-    except:
-      image = PILHelper.create_scaled_image(self.dev, broken_image,
-						margins = self.margins)
 
-    xm = image.width / 2	# Middle horizontal coordinate in the image
-    xr = image.width - 1	# Right horizontal coordinate in the image
-    yb = image.height - 1	# Bottom vertical coordinate in the image
+  def render_touchscreen_region(self, size, title, text):
+    """Render an image for a region of the touchscreen of the specified size,
+    with a small title at the top and a larger text below it, shortened to
+    fit the region if needed
+    Return the image in the device's native touchscreen format
+    """
+
+    with profiler.phase("render"):
 
-    # Do we have text or brackets to add to the icon?
-    if top_text or bottom_text or left_bracket_color or right_bracket_color:
+      # Load the larger font on first use
+      if self.__touchscreen_font is None:
+        self.__touchscreen_font = ImageFont.truetype(self.__ttf_file,
+						round(self.__ttf_size * 1.5))
 
-      # If we have text, write it on top of the image
+      image = Image.new("RGB", size, "black")
       draw = ImageDraw.Draw(image)
 
-      if top_text:
-        draw.text((xm, 0), text = top_text,
-			font = self.font, anchor = "mt", fill = "white")
+      width, height = size
+
+      if title:
+        draw.text((width / 2, height * 0.3), title, font = self.font,
+			fill = "gray", anchor = "mm")
+
+      if text:
+        fits = lambda t: draw.textlength(t, font = self.__touchscreen_font) \
+				<= width - 8
+        if not fits(text):
+          while len(text) > 1 and not fits(text + "\u2026"):
+            text = text[:-1]
+          text = text.rstrip() + "\u2026"
+
+        draw.text((width / 2, height * 0.65), text,
+			font = self.__touchscreen_font, fill = "white",
+			anchor = "mm")
+
+      return PILHelper.to_native_touchscreen_format(self.dev, image)
+
+
+
+  def start_writer(self):
+    """Start a thread that writes the key images and the brightness to the
+    device, so the caller doesn't wait for the USB transfers. Once it's
+    started, set_key_image() and set_brightness() only queue the writes
+    """
+
+    if self.__writer is not None:
+      return
+
+    self.__writer_queue.clear()
+    self.__fade_steps = []
+    self.__writer_stop = False
+    self.__writer_error = None
+
+    self.__writer = Thread(target = self.__write_loop, daemon = True,
+				name = "Stream Deck writer {}".format(self.id))
+    self.__writer.start()
+
+
+
+  def stop_writer(self):
+    """Stop the writer thread if it's running and drop the pending writes
+    """
+
+    if self.__writer is None:
+      return
+
+    with self.__writer_cond:
+      self.__writer_stop = True
+      self.__writer_queue.clear()
+      self.__fade_steps = []
+      self.__writer_cond.notify()
+
+    self.__writer.join(timeout = 1)
+    self.__writer = None
+
+
+
+  def start_wake_watcher(self, wake, poll_every):
+    """Start a thread that waits for input from the device while the update
+    loop doesn't read it, and calls wake() from that thread as soon as the
+    device is touched or fails. The thread blocks reading the device if its
+    transport allows it, so a touch wakes it up right away without polling
+    the device. Otherwise - simulated devices or devices owned by the device
+    daemon - it reads the device every poll_every seconds. The input that
+    wakes the device up is dropped, so touching a blank device doesn't trigger
+    anything
+    """
+
+    if self.__watcher is not None:
+      if self.__watcher.is_alive() and not self.__watcher_stop.is_set():
+        return
+
+      # Let the watcher we last told to stop finish first
+      self.__watcher.join(timeout = self.WAKE_WATCH_READ_TIMEOUT + 1)
 
-      if bottom_text:
-        draw.text((xm, yb), text = bottom_text,
-			font = self.font, anchor = "mb", fill = "white")
+    self.__watcher_stop.clear()
+    self.__watcher_reading = True
 
-      # If we have brackets, draw them. If the color name is incorrect, default
-      # to dark grey
-      if left_bracket_color:
-        for color in (left_bracket_color, "darkslategrey"):
+    self.__watcher = Thread(target = self.__watch_loop,
+				args = (self.dev, wake, poll_every),
+				daemon = True,
+				name = "Stream Deck watcher {}".format(self.id))
+    self.__watcher.start()
+
+
+
+  def stop_wake_watcher(self):
+    """Tell the wake watcher thread to stop if it's running, without waiting
+    for it to finish the read it may be blocked in: get_input_events() doesn't
+    read the device until it has, and a touch it reads meanwhile is dropped
+    """
+
+    if self.__watcher is not None:
+      self.__watcher_stop.set()
+
+
+
+  def __watch_loop(self, dev, wake, poll_every):
+    """Wake watcher thread: wait for input from the device until stopped or
+    until it's touched or fails, then call wake(). If the device was closed
+    while the thread was reading it, close it once done
+    """
+
+    try:
+      while not self.__watcher_stop.is_set():
+
+        try:
+          touched = wait_for_hid_report(dev, self.WAKE_WATCH_READ_TIMEOUT)
+
+          if touched is None:
+            if self.__watcher_stop.wait(poll_every):
+              return
+
+            with dev:
+              touched = dev._read_control_states() is not None
+
+        except:
+          touched = True
+
+        if touched:
+          wake()
+          return
+
+    finally:
+      with self.__watcher_lock:
+        self.__watcher_reading = False
+
+        if self.__watcher_closes_device:
+          self.__watcher_closes_device = False
           try:
-            draw.line([(self.margins[3] - 2, self.margins[0] + 2),
-			(4, self.margins[0] + 2),
-			(4, yb - self.margins[2] - 2),
-			(self.margins[3] - 2, yb - self.margins[2] - 2)],
-			width = 5, fill = color)
-            break
+            dev.close()
           except:
             pass
 
-      if right_bracket_color:
-        for color in (right_bracket_color, "darkslategrey"):
-          try:
-            draw.line([(xr - self.margins[1] + 2, self.margins[0] + 2),
-			(xr - 4, self.margins[0] + 2),
-			(xr - 4, yb - self.margins[2] - 2),
-			(xr - self.margins[1] + 2, yb - self.margins[2] - 2)],
-			width = 5, fill = color)
+
+
+  def __write_loop(self):
+    """Writer thread: write the queued key images and brightness to the device,
+    and the steps of the current fade when they're due, until stopped or until
+    a write fails. Key images queued again for the same key before being
+    written replace the previous ones. Fade steps go before the queued writes
+    so they're written on time
+    """
+
+    while True:
+
+      with self.__writer_cond:
+        while not self.__writer_stop:
+          delay = self.__fade_steps[0][0] - time() \
+			if self.__fade_steps else None
+
+          if self.__writer_queue or (delay is not None and delay <= 0):
             break
-          except:
-            pass
 
-    # Upload the image to the key
-    self.dev.set_key_image(keyno, PILHelper.to_native_key_format(self.dev,
-									image))
+          self.__writer_cond.wait(delay)
+
+        if self.__writer_stop:
+          return
+
+        if self.__fade_steps and self.__fade_steps[0][0] <= time():
+          what, data = "brightness", self.__fade_steps.pop(0)[1]
+        else:
+          what, data = self.__writer_queue.popitem(last = False)
+
+      try:
+        with self.dev, profiler.phase("usb write"):
+          if what == "brightness":
+            self.dev.set_brightness(data)
+          elif isinstance(what, tuple):
+            self.dev.set_touchscreen_image(data, *what[1:])
+          else:
+            self.dev.set_key_image(what, data)
+        self.__count_write(what, data)
+
+      # Record the error so it's raised in the caller's thread at the next
+      # write, and stop writing
+      except Exception as e:
+        self.__writer_error = e
+        return
+
+
+
+  def __count_write(self, what, data):
+    """Count a key image, touchscreen image or brightness written to the
+    device
+    """
+
+    if what == "brightness":
+      counters.count("brightness_writes")
+    elif isinstance(what, tuple):
+      counters.count("touchscreen_writes")
+      counters.count("usb_bytes_written", len(data))
+    else:
+      counters.count("key_writes")
+      counters.count("usb_bytes_written", len(data))
+
+
+
+  def __queue_write(self, what, data):
+    """Queue a key image, touchscreen image or brightness write for the writer
+    thread, after raising the error that stopped the writer thread if any
+    """
+
+    if self.__writer_error is not None:
+      raise self.__writer_error
+
+    with self.__writer_cond:
+      self.__writer_queue[what] = data
+      self.__writer_cond.notify()
+
+
+
+  def set_key_image(self, keyno, native_image):
+    """Upload an image already in the device's native format to a Stream Deck
+    key number
+    """
+
+    if self.__writer is not None:
+      self.__queue_write(keyno, native_image)
+    else:
+      self.dev.set_key_image(keyno, native_image)
+      self.__count_write(keyno, native_image)
+
+
+
+  def set_touchscreen_image(self, native_image, x, y, width, height):
+    """Upload an image already in the device's native touchscreen format to a
+    region of the touchscreen. Images queued again for the same region before
+    being written replace the previous ones
+    """
+
+    what = ("touchscreen", x, y, width, height)
+
+    if self.__writer is not None:
+      self.__queue_write(what, native_image)
+    else:
+      self.dev.set_touchscreen_image(native_image, x, y, width, height)
+      self.__count_write(what, native_image)
+
+
+
+  def set_key_images(self, key_images):
+    """Upload images already in the device's native format to several Stream
+    Deck key numbers at once. key_images is a list of (keyno, native_image)
+    The writer thread gets them all in one go, in the order of the list
+    """
+
+    if self.__writer is not None:
+      if self.__writer_error is not None:
+        raise self.__writer_error
+
+      with self.__writer_cond:
+        for keyno, native_image in key_images:
+          self.__writer_queue[keyno] = native_image
+        self.__writer_cond.notify()
+
+    else:
+      for keyno, native_image in key_images:
+        self.dev.set_key_image(keyno, native_image)
+        self.__count_write(keyno, native_image)
+
+
+
+  def __write_brightness(self, brightness):
+    """Set the brightness of the Stream Deck's display directly or through the
+    writer thread
+    """
+
+    if self.__writer is not None:
+      self.__queue_write("brightness", brightness)
+    else:
+      self.dev.set_brightness(brightness)
+      self.__count_write("brightness", brightness)
+
+
+
+  def set_key(self, keyno, image,
+		top_text = None, bottom_text = None,
+		left_bracket_color = None, right_bracket_color = None):
+    """Render an image for a Stream Deck key number - see render_key() - and
+    upload it to the key
+    """
+
+    self.set_key_image(keyno, self.render_key(image, top_text, bottom_text,
+						left_bracket_color,
+						right_bracket_color))
+
+
+
+  def __set_fade_steps(self, steps):
+    """Replace the steps of the current fade left to write - none to cancel
+    the fade. steps is a list of (due timestamp, brightness) in order
+    """
+
+    with self.__writer_cond:
+      self.__fade_steps = steps
+      self.__writer_cond.notify()
+
+
+
+  def blank(self):
+    """Turn the Stream Deck's display off, keeping the key images, until the
+    next set_brightness() with the user active
+    """
+
+    self.__fade_start_tstamp = None
+    self.__set_fade_steps([])
+
+    if self.__brightness != 0:
+      self.__brightness = 0
+      self.__write_brightness(self.__brightness)
 
 
 
   def set_brightness(self, min_brightness, max_brightness, fade_time,
-			user_active = True):
+			user_active = True, fade_gamma = 1):
     """Set the brightness of the Stream Deck's display
-    If the user is active, set the maximum brightness
-    If the user is inactive, set the brightness according to how long they have
-    been inactive, down the the minimum brightness
+    If the user is active, cancel the fade if any and set the maximum
+    brightness
+    If the user has just become inactive, fade the brightness down to the
+    minimum brightness over fade_time seconds, following a gamma curve - see
+    fade_steps(). The fade is precomputed once, and its steps are written by
+    the writer thread at their exact due times if it's running, or by the
+    following calls otherwise
     """
 
     # Is the user active?
     if user_active:
       self.__fade_start_tstamp = None
 
+      # Cancel the fade if it's still going on
+      if self.__fade_steps:
+        self.__set_fade_steps([])
+
       # Set the maximum brightness if it's not already set
       if self.__brightness is None or self.__brightness != max_brightness:
         self.__brightness = max_brightness
-        self.dev.set_brightness(self.__brightness)
+        self.__write_brightness(self.__brightness)
 
-    # The user is inactive
-    else:
+      return
+
+    # If the user was previously active, start fading from the current
+    # brightness
+    if self.__fade_start_tstamp is None:
       now = time()
+      self.__fade_start_tstamp = now
 
-      # If the user was previously active, mark the start of the inactivity
-      if self.__fade_start_tstamp is None:
-        self.__fade_start_tstamp = now
-
-      # Calculate the brightness based on how long the user has been inactive
-      if fade_time == 0 or now - self.__fade_start_tstamp > fade_time:
-        b = min_brightness
-      else:
-        b = round(max(min_brightness,
-			max_brightness - (now - self.__fade_start_tstamp) * \
-			(max_brightness - min_brightness) / fade_time))
-
-      # Set the brightness value if it's different from the one already set
-      if b != self.__brightness:
-        self.__brightness = b
-        self.dev.set_brightness(self.__brightness)
+      steps = [(now + t, b) for t, b in \
+			fade_steps(self.__brightness \
+					if self.__brightness is not None \
+					else max_brightness,
+					min_brightness, fade_time, fade_gamma,
+					self.MIN_FADE_STEP_INTERVAL)]
+      self.__brightness = min_brightness
+
+      if self.__writer_error is not None:
+        raise self.__writer_error
+
+      self.__set_fade_steps(steps)
+
+    # Without the writer thread, write the last step that's due
+    if self.__writer is None and self.__fade_steps:
+      now = time()
+      due = [b for t, b in self.__fade_steps if t <= now]
+      if due:
+        self.__fade_steps = self.__fade_steps[len(due):]
+        self.__write_brightness(due[-1])
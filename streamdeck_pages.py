@@ -29,6 +29,10 @@ class StreamDeckPages():
     self.previous_pages = []
     self.pages = []
 
+    # Number of pages the toolbars would take up if each toolbar started on a
+    # new page, in the order of the GUI
+    self.nb_unpacked_pages = 0
+
     self.previous_current_page = None
     self.current_page = None
     self.current_page_no = None
@@ -38,9 +42,16 @@ class StreamDeckPages():
   def rebuild_pages(self, tbactions, repeated_toolbars,
 			bracket_color_repeated_toolbars,
 			bracket_color_page_nav_keys,
-			brackets_color_expandable_tools):
+			brackets_color_expandable_tools,
+			pack_toolbars = False, toolbar_ranks = None):
     """Rebuild Stream Deck pages given a list of toolbars and actions passed as
     a ToolbarActions object
+    If pack_toolbars is True, toolbars small enough to fit in the free keys
+    left on a page by the toolbars before them share that page instead of
+    starting a new page - see plan_toolbar_layout()
+    If toolbar_ranks is defined, the toolbars are laid out in the order of
+    their ranks - a dictionary of toolbar names and ranks - instead of the
+    order of the GUI, with the toolbars without a rank last
     """
 
     # Get the lowercase color names
@@ -106,6 +117,19 @@ class StreamDeckPages():
 
     last_empty_new_page_i = len(empty_new_pages) - 1
 
+    # Decide in what order to lay out the toolbars and which ones share pages
+    toolbars = [t for t in tbactions.toolbars if t not in repeated_toolbars]
+    if toolbar_ranks:
+      toolbars.sort(key = lambda t: toolbar_ranks.get(t, len(toolbar_ranks)))
+
+    layout, nb_unpacked_sets = self.plan_toolbar_layout(
+				[(t, len(tbactions.toolbar_actions[t])) \
+					for t in toolbars],
+				self.nb_streamdeck_keys - nbkeys - \
+					reserve_nb_last_keys,
+				pack_toolbars)
+    self.nb_unpacked_pages = nb_unpacked_sets * len(empty_new_pages)
+
     # Create the pages of action keys
     self.previous_pages = self.pages
     self.pages = []
@@ -114,11 +138,10 @@ class StreamDeckPages():
     indiv_toolbar_page_maker_ctr = 0
     page_marker = lambda: "{}#{}".format(t, indiv_toolbar_page_maker_ctr)
 
-    for t in tbactions.toolbars:
-      if t not in repeated_toolbars:
+    for layout_i, (t, _) in enumerate(layout):
 
-        # Get the list of key strings for this toolbar
-        keys = ["{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}".
+      # Get the list of key strings for this toolbar
+      keys = ["{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}{sv}{}".
 		format(t, n, 1 if tbactions.actions[n].enabled else 0,
 			tbactions.actions[n].iconid,
 			tbactions.actions[n].title, t,
@@ -128,47 +151,47 @@ class StreamDeckPages():
 			sv = self.SV)
 		for n in tbactions.toolbar_actions[t]]
 
-        indiv_toolbar_page_maker_ctr = 0
+      indiv_toolbar_page_maker_ctr = 0
 
-        # Add all the keys to the pages
-        for key in keys:
+      # Add all the keys to the pages
+      for key in keys:
 
-          # If we don't have empty key slots left, add empty pages
-          if not self.pages or "[key]" not in self.pages[-1]:
+        # If we don't have empty key slots left, add empty pages
+        if not self.pages or "[key]" not in self.pages[-1]:
 
-            # If we have navigation keys, replace the previous page's [pagenext]
-            # placeholder if any
-            if self.with_nav_keys and self.pages:
-              self.pages[-1] = self.pages[-1].replace("[pagenext]",
+          # If we have navigation keys, replace the previous page's [pagenext]
+          # placeholder if any
+          if self.with_nav_keys and self.pages:
+            self.pages[-1] = self.pages[-1].replace("[pagenext]",
 							"{}{sv}PAGENEXT{sv}{sv}"
 							"{sv}{sv}{}{sv}{sv}{}".
 							format(page_marker(),
 								t, nkbc,
 								sv = self.SV))
 
-            # Add new pages. Mark all the new pages' keys with a unique page
-            # marker.
-            for i, p in enumerate(empty_new_pages):
+          # Add new pages. Mark all the new pages' keys with a unique page
+          # marker.
+          for i, p in enumerate(empty_new_pages):
 
-              indiv_toolbar_page_maker_ctr += 1
+            indiv_toolbar_page_maker_ctr += 1
 
-              new_page = p.replace("[toolbar]", page_marker())
+            new_page = p.replace("[toolbar]", page_marker())
 
-              # Do we have navigation keys?
-              if self.with_nav_keys:
+            # Do we have navigation keys?
+            if self.with_nav_keys:
 
-                # If we have more than one new page, replace the [pagenext]
-                # placeholder in all but the last new page
-                if i < last_empty_new_page_i:
-                  new_page = new_page.replace("[pagenext]",
+              # If we have more than one new page, replace the [pagenext]
+              # placeholder in all but the last new page
+              if i < last_empty_new_page_i:
+                new_page = new_page.replace("[pagenext]",
 						"{}{sv}PAGENEXT{sv}{sv}{sv}{sv}"
 						"{}{sv}{sv}{}".
 						format(page_marker(), t, nkbc,
 							sv = self.SV))
 
-                # Replace the first [pageprev] placeholder
-                if i == 0:
-                  new_page = new_page.replace("[pageprev]",
+              # Replace the first [pageprev] placeholder
+              if i == 0:
+                new_page = new_page.replace("[pageprev]",
 						"{}{sv}PAGEPREV{sv}{sv}{sv}{sv}"
 						"{}{sv}{}{sv}".
 						format(page_marker(),
@@ -180,24 +203,28 @@ class StreamDeckPages():
 						format(page_marker(), nkbc,
 							sv = self.SV), 1)
 
-                # Replace the remaining [pageprev] placeholders if any
-                else:
-                  new_page = new_page.replace("[pageprev]",
+              # Replace the remaining [pageprev] placeholders if any
+              else:
+                new_page = new_page.replace("[pageprev]",
 						"{}{sv}PAGEPREV{sv}{sv}{sv}{sv}"
 						"{}{sv}{}{sv}".
 						format(page_marker(), t, nkbc,
 							sv = self.SV))
 
-              # Add the new page to the pages
-              self.pages.append(new_page)
+            # Add the new page to the pages
+            self.pages.append(new_page)
 
-            prev_page_toolbar = t
+          prev_page_toolbar = t
 
-          # Insert the next key into the pages
-          self.pages[-1] = self.pages[-1].replace("[key]", key, 1)
+        # Insert the next key into the pages
+        self.pages[-1] = self.pages[-1].replace("[key]", key, 1)
 
-        # Add blank keys to complete the last page for this toolbar
-        self.pages[-1] = self.pages[-1].replace("[key]", "{}{sv}{sv}{sv}{sv}"
+      # Add blank keys to complete the last page for this toolbar, unless
+      # the next toolbar shares it
+      if self.pages and (layout_i == len(layout) - 1 or \
+				layout[layout_i + 1][1]):
+        self.pages[-1] = self.pages[-1].replace("[key]",
+						"{}{sv}{sv}{sv}{sv}"
 						"{sv}{sv}{sv}".
 						format(page_marker(),
 							sv = self.SV))
@@ -211,6 +238,162 @@ class StreamDeckPages():
 
 
 
+  @staticmethod
+  def plan_toolbar_layout(toolbar_sizes, nbfree, pack_toolbars):
+    """Plan the layout of the toolbars on the pages. toolbar_sizes is a list
+    of (toolbar name, number of actions) in the order to lay them out, and
+    nbfree the number of keys available for actions on a page - or on the
+    last page of a set of pages, if the toolbars repeated on every page take
+    up more than a page
+    Without packing, each toolbar starts a new page
+    With packing, each toolbar small enough to fit entirely in the free keys
+    left on the last page of the toolbars already laid out goes on the first
+    of those pages it fits on - first-fit bin packing - so small toolbars
+    share pages. Toolbars larger than a page still start a new page and take
+    up consecutive pages, so flipping through them doesn't change
+    Return the layout as a list of (toolbar name, whether it starts a new
+    page) in the order the toolbars appear in the pages, and the number of
+    pages - or sets of pages - the toolbars would take up without packing
+    """
+
+    nb_unpacked = sum([-(-size // nbfree) for _, size in toolbar_sizes \
+				if size]) if nbfree > 0 else 0
+
+    if not pack_toolbars or nbfree <= 0:
+      return [(t, True) for t, _ in toolbar_sizes], nb_unpacked
+
+    # Groups of toolbars laid out one after the other, each starting a new
+    # page, with the number of free keys left on their last page
+    groups = []
+
+    for t, size in toolbar_sizes:
+
+      if 0 < size <= nbfree:
+        for g in groups:
+          if g[1] >= size:
+            g[0].append(t)
+            g[1] -= size
+            break
+        else:
+          groups.append([[t], nbfree - size])
+
+      else:
+        groups.append([[t], -size % nbfree])
+
+    return [(t, i == 0) for g in groups for i, t in enumerate(g[0])], \
+		nb_unpacked
+
+
+
+  def static_key_descs(self, bracket_colors):
+    """Return the descriptions of the keys that don't depend on the toolbars -
+    i.e. the key strings without the toolbar marker: the blank key, the blank
+    key shown when there isn't any page, and the blank keys with a left or
+    right bracket of each of the bracket colors, like the placeholders of the
+    page navigation keys
+    """
+
+    key_descs = ["", self.SV * 6]
+
+    for c in bracket_colors:
+      key_descs.extend([self.SV * 5 + c.lower() + self.SV,
+				self.SV * 6 + c.lower()])
+
+    return key_descs
+
+
+
+  def actions_around_current_page(self, nbpages):
+    """Return the set of names of the actions on the current page and on the
+    nbpages pages before and after it
+    """
+
+    if self.current_page_no is None:
+      return set()
+
+    names = set()
+
+    for page in self.pages[max(0, self.current_page_no - nbpages):
+				self.current_page_no + nbpages + 1]:
+      for ks in page.split(self.SK):
+        n = ks.split(self.SV, 2)[1]
+        if n and n not in ("PAGEPREV", "PAGENEXT"):
+          names.add(n)
+
+    return names
+
+
+
+  def page_toolbar(self, page_no):
+    """Return the name of the toolbar a page belongs to - the first toolbar
+    laid out on it if small toolbars are packed together
+    """
+
+    return self.pages[page_no].split(self.SV, 1)[0].rsplit("#", 1)[0]
+
+
+
+  def page_toolbars(self, page_no):
+    """Return the names of all the toolbars with actions on a page, joined with
+    " + " and in the order they're laid out on the page, or the name of the
+    toolbar the page belongs to if it doesn't have actions of its own
+    """
+
+    toolbars = []
+
+    # The action keys are the keys whose toolbar marker is their bottom text:
+    # the other keys are marked with the page marker
+    for ks in self.pages[page_no].split(self.SK):
+      fields = ks.split(self.SV)
+      if fields[0] == fields[5] and fields[0] not in toolbars:
+        toolbars.append(fields[0])
+
+    return " + ".join(toolbars) if toolbars else self.page_toolbar(page_no)
+
+
+
+  def current_page_position(self):
+    """Return where the current page is: the names of its toolbars - see
+    page_toolbars() - its position among the pages of the toolbar it belongs
+    to - from 1 - and their number, the names of the toolbars of the pages
+    before and after the pages of that toolbar, or None if there are none, and
+    its position among all the pages - from 1 - and their number
+    Return None if there isn't a current page
+    """
+
+    if self.current_page_no is None:
+      return None
+
+    t = self.page_toolbar(self.current_page_no)
+
+    first = self.current_page_no
+    while first > 0 and self.page_toolbar(first - 1) == t:
+      first -= 1
+
+    last = self.current_page_no
+    while last < len(self.pages) - 1 and self.page_toolbar(last + 1) == t:
+      last += 1
+
+    return (self.page_toolbars(self.current_page_no),
+		self.current_page_no - first + 1, last - first + 1,
+		self.page_toolbars(first - 1) if first > 0 else None,
+		self.page_toolbars(last + 1) if last < len(self.pages) - 1 \
+			else None,
+		self.current_page_no + 1, len(self.pages))
+
+
+
+  def share_pages(self, other):
+    """Use the pages just rebuilt by another StreamDeckPages object with the
+    same number of keys and navigation keys, instead of rebuilding them
+    """
+
+    self.previous_pages = self.pages
+    self.pages = other.pages
+    self.nb_unpacked_pages = other.nb_unpacked_pages
+
+
+
   def locate_current_page(self, new_toolbar = None, last_action_pressed = None):
     """Find the new location of the current page by finding the page in the
     current set of pages that best matches it, then update the current page and
@@ -0,0 +1,618 @@
+"""FreeCAD Stream Deck Addon - Simulated Stream Deck devices
+"""
+
+## Modules
+#
+
+from time import time, sleep
+from random import Random
+from threading import RLock
+
+from StreamDeck.Devices.StreamDeck import ControlType, DialEventType
+
+
+
+## Classes
+#
+
+class SimulatedFault(IOError):
+  """Error raised by simulated devices when a fault is injected
+  """
+
+
+
+class _SimulatedTransport():
+  """Stand-in for the low-level transport device of the StreamDeck library's
+  devices, which is what gets opened before talking to the device
+  """
+
+  def __init__(self, deck):
+    """__init__ method
+    """
+
+    self.deck = deck
+    self.opened = False
+
+
+
+  def open(self):
+    """Open the simulated device
+    """
+
+    self.deck.check_fault("open")
+    self.opened = True
+
+
+
+  def close(self):
+    """Close the simulated device
+    """
+
+    self.opened = False
+
+
+
+  def is_open(self):
+    """Return whether the simulated device is open
+    """
+
+    return self.opened
+
+
+
+  def connected(self):
+    """Return whether the simulated device is plugged in
+    """
+
+    return self.deck.is_plugged()
+
+
+
+class SimulatedStreamDeck():
+  """Simulated Stream Deck device with the same interface as the StreamDeck
+  library's devices, to run the addon and measure its I/O path without any
+  hardware
+
+  Writes can be slowed down to the latency and bandwidth of a real USB
+  device. Input can be scripted ahead of time. Faults can be injected per
+  operation - "open", "read", "write" (key images and touchscreen images) and
+  "brightness" - on demand or at random, to test how the addon recovers from
+  USB errors. The device can also be unplugged for a while, during which it
+  can't be enumerated and all the operations fail
+  """
+
+  # Geometry and key image format of the Stream Deck models, as defined by the
+  # StreamDeck library, for simulated_streamdeck()
+  MODELS = {
+	"Stream Deck Mini":		{"key_count": 6, "key_cols": 3,
+					 "key_size": (80, 80),
+					 "key_format": "BMP",
+					 "key_flip": (False, True),
+					 "key_rotation": 90},
+	"Stream Deck Original":		{"key_count": 15, "key_cols": 5,
+					 "key_size": (72, 72),
+					 "key_format": "BMP"},
+	"Stream Deck Original V2":	{"key_count": 15, "key_cols": 5,
+					 "key_size": (72, 72)},
+	"Stream Deck MK.2":		{"key_count": 15, "key_cols": 5,
+					 "key_size": (72, 72)},
+	"Stream Deck XL":		{"key_count": 32, "key_cols": 8,
+					 "key_size": (96, 96)},
+	"Stream Deck Neo":		{"key_count": 8, "key_cols": 4,
+					 "key_size": (96, 96),
+					 "touch_key_count": 2,
+					 "screen_size": (248, 58)},
+	"Stream Deck +":		{"key_count": 8, "key_cols": 4,
+					 "key_size": (120, 120),
+					 "key_flip": (False, False),
+					 "dial_count": 4,
+					 "touchscreen_size": (800, 100)},
+	"Stream Deck + XL":		{"key_count": 36, "key_cols": 9,
+					 "key_size": (112, 112),
+					 "key_flip": (False, False),
+					 "key_rotation": 90,
+					 "dial_count": 6,
+					 "touchscreen_size": (1200, 100)},
+	"Stream Deck Studio":		{"key_count": 32, "key_cols": 16,
+					 "key_size": (80, 120),
+					 "key_flip": (False, False),
+					 "dial_count": 2},
+	"Stream Deck Pedal":		{"key_count": 3, "key_cols": 3,
+					 "visual": False}}
+
+  # Alternative model names
+  MODEL_ALIASES = {"Stream Deck Plus": "Stream Deck +",
+			"Stream Deck Plus XL": "Stream Deck + XL"}
+
+
+
+  def __init__(self, deck_type = "Stream Deck Original", serial_number = None,
+		key_count = 15, key_cols = 5, key_size = (72, 72),
+		key_format = "JPEG", key_flip = (True, True), key_rotation = 0,
+		dial_count = 0, touch_key_count = 0, visual = True,
+		touchscreen_size = None, screen_size = None,
+		write_latency = 0, write_bandwidth = 0,
+		fault_rate = 0, seed = None):
+    """__init__ method
+    write_latency is how many seconds each write takes, plus the size of the
+    data divided by write_bandwidth in bytes per second if it isn't 0
+    fault_rate is the probability of any operation failing at random, with a
+    pseudo-random generator seeded with seed
+    """
+
+    self.DECK_TYPE = deck_type
+    self.KEY_COUNT = key_count
+    self.KEY_COLS = key_cols
+    self.KEY_ROWS = (key_count + key_cols - 1) // key_cols
+    self.DIAL_COUNT = dial_count
+    self.TOUCH_KEY_COUNT = touch_key_count
+    self.DECK_VISUAL = visual
+
+    self.serial_number = serial_number if serial_number is not None else \
+				"SIM{:09d}".format(id(self) % 1000000000)
+
+    # Image formats, empty like the StreamDeck library's for the displays the
+    # device doesn't have
+    self.image_format = {"size": tuple(key_size) if visual else (0, 0),
+				"format": key_format if visual else "",
+				"flip": tuple(key_flip) if visual else \
+						(False, False),
+				"rotation": key_rotation if visual else 0}
+    self.touchscreen_format = {"size": tuple(touchscreen_size) \
+					if touchscreen_size else (0, 0),
+				"format": "JPEG" if touchscreen_size else "",
+				"flip": (False, False),
+				"rotation": 0}
+    self.screen_format = {"size": tuple(screen_size) \
+				if screen_size else (0, 0),
+				"format": "JPEG" if screen_size else "",
+				"flip": (True, True),
+				"rotation": 0}
+
+    self.write_latency = write_latency
+    self.write_bandwidth = write_bandwidth
+    self.fault_rate = fault_rate
+
+    self.device = _SimulatedTransport(self)
+
+    self.update_lock = RLock()
+
+    # State of the simulated displays
+    self.key_images = [None] * key_count
+    self.touchscreen_images = []	# (image, x, y, width, height)
+    self.screen_image = None
+    self.brightness = None
+
+    # Operation counters
+    self.nb_key_writes = 0
+    self.nb_touchscreen_writes = 0
+    self.nb_brightness_writes = 0
+    self.nb_bytes_written = 0
+    self.nb_reads = 0
+    self.nb_faults = 0
+
+    self.__faults = {}
+    self.__random = Random(seed)
+    self.__unplugged_until = None
+
+    self.__key_states = [False] * key_count
+    self.__pending_events = []
+    self.__scripted_events = []	# (timestamp, action, value)
+
+
+
+  # Fault injection
+
+  def inject_fault(self, operation, count = 1):
+    """Make the next count calls to an operation fail
+    """
+
+    self.__faults[operation] = self.__faults.get(operation, 0) + count
+
+
+
+  def unplug(self, duration = None):
+    """Simulate the device being unplugged, for duration seconds or until
+    replug() is called if duration is None
+    """
+
+    self.__unplugged_until = time() + duration if duration is not None \
+				else float("inf")
+    self.device.opened = False
+
+
+
+  def replug(self):
+    """Simulate the device being plugged back in
+    """
+
+    self.__unplugged_until = None
+
+
+
+  def is_plugged(self):
+    """Return whether the device is plugged in
+    """
+
+    if self.__unplugged_until is not None and \
+		time() >= self.__unplugged_until:
+      self.__unplugged_until = None
+
+    return self.__unplugged_until is None
+
+
+
+  def check_fault(self, operation):
+    """Raise a SimulatedFault if the device is unplugged or if a fault was
+    injected for this operation
+    """
+
+    if not self.is_plugged():
+      raise SimulatedFault("Simulated device unplugged")
+
+    if self.__faults.get(operation):
+      self.__faults[operation] -= 1
+      self.nb_faults += 1
+      raise SimulatedFault("Simulated {} fault".format(operation))
+
+    if self.fault_rate and self.__random.random() < self.fault_rate:
+      self.nb_faults += 1
+      raise SimulatedFault("Simulated random {} fault".format(operation))
+
+
+
+  def __write_delay(self, nbbytes):
+    """Take as long as a write of nbbytes bytes takes on the simulated device
+    """
+
+    delay = self.write_latency + (nbbytes / self.write_bandwidth \
+					if self.write_bandwidth else 0)
+    if delay > 0:
+      sleep(delay)
+
+
+
+  # Simulated input
+
+  def press_key(self, keyno, down = True):
+    """Queue a key state change, to be returned by the next read
+    """
+
+    self.__key_states[keyno] = down
+    self.__pending_events.append({ControlType.KEY: list(self.__key_states)})
+
+
+
+  def turn_dials(self, clicks):
+    """Queue a dial turn of the first dial, to be returned by the next read
+    """
+
+    turns = [0] * self.DIAL_COUNT
+    turns[0] = clicks
+    self.__pending_events.append({ControlType.DIAL:
+					{DialEventType.TURN: turns}})
+
+
+
+  def script_input(self, script):
+    """Schedule input events, returned by the reads once they're due. script
+    is a list of (delay, action, value): delay in seconds from now, action
+    "press" or "release" and the key number as value, action "turn" and the
+    number of clicks to turn the first dial by as value - negative clicks turn
+    it counterclockwise - or action "states" and control states as returned by
+    _read_control_states() as value, to replay recorded input
+    """
+
+    now = time()
+
+    self.__scripted_events.extend([(now + delay, action, value) \
+					for delay, action, value in script])
+    self.__scripted_events.sort(key = lambda e: e[0])
+
+
+
+  def script_pending(self):
+    """Return whether scripted input events are still to come
+    """
+
+    return bool(self.__scripted_events)
+
+
+
+  def __queue_scripted_events(self):
+    """Queue the scripted input events that are due
+    """
+
+    now = time()
+
+    while self.__scripted_events and self.__scripted_events[0][0] <= now:
+      _, action, value = self.__scripted_events.pop(0)
+
+      if action in ("press", "release"):
+        self.press_key(value, action == "press")
+      elif action == "turn":
+        self.turn_dials(value)
+      elif action == "states":
+        if ControlType.KEY in value:
+          self.__key_states = list(value[ControlType.KEY])
+        self.__pending_events.append(value)
+
+
+
+  # StreamDeck library device interface
+
+  def __enter__(self):
+    """Lock the device for exclusive use
+    """
+
+    self.update_lock.acquire()
+
+
+
+  def __exit__(self, type, value, traceback):
+    """Release the device
+    """
+
+    self.update_lock.release()
+
+
+
+  def id(self):
+    """Return the unique ID of the simulated device
+    """
+
+    return "sim:" + self.serial_number
+
+
+
+  def deck_type(self):
+    """Return the type of the simulated device
+    """
+
+    return self.DECK_TYPE
+
+
+
+  def get_serial_number(self):
+    """Return the serial number of the simulated device
+    """
+
+    self.check_fault("read")
+
+    return self.serial_number
+
+
+
+  def key_count(self):
+    """Return the number of keys
+    """
+
+    return self.KEY_COUNT
+
+
+
+  def touch_key_count(self):
+    """Return the number of touch keys
+    """
+
+    return self.TOUCH_KEY_COUNT
+
+
+
+  def dial_count(self):
+    """Return the number of dials
+    """
+
+    return self.DIAL_COUNT
+
+
+
+  def key_layout(self):
+    """Return the number of rows and columns of keys
+    """
+
+    return self.KEY_ROWS, self.KEY_COLS
+
+
+
+  def is_visual(self):
+    """Return whether the keys have displays
+    """
+
+    return self.DECK_VISUAL
+
+
+
+  def key_image_format(self):
+    """Return the format of the key images
+    """
+
+    return dict(self.image_format)
+
+
+
+  def touchscreen_image_format(self):
+    """Return the format of the touchscreen images
+    """
+
+    return dict(self.touchscreen_format)
+
+
+
+  def screen_image_format(self):
+    """Return the format of the screen images
+    """
+
+    return dict(self.screen_format)
+
+
+
+  def is_open(self):
+    """Return whether the simulated device is open
+    """
+
+    return self.device.is_open()
+
+
+
+  def connected(self):
+    """Return whether the simulated device is plugged in
+    """
+
+    return self.device.connected()
+
+
+
+  def close(self):
+    """Close the simulated device
+    """
+
+    self.device.close()
+
+
+
+  def _reset_key_stream(self):
+    """Reset the key image stream
+    """
+
+    self.check_fault("write")
+
+
+
+  def reset(self):
+    """Reset the simulated device: blank all the keys
+    """
+
+    self.check_fault("write")
+
+    self.key_images = [None] * self.KEY_COUNT
+    self.touchscreen_images = []
+    self.screen_image = None
+
+
+
+  def set_brightness(self, percent):
+    """Set the brightness of the simulated display
+    """
+
+    self.check_fault("brightness")
+    self.__write_delay(0)
+
+    self.brightness = min(max(int(percent), 0), 100)
+    self.nb_brightness_writes += 1
+
+
+
+  def set_key_image(self, key, image):
+    """Set the image of a key, already in the native format
+    """
+
+    if not self.DECK_VISUAL:
+      raise TypeError("Simulated device has no display")
+
+    self.check_fault("write")
+    self.__write_delay(len(image) if image else 0)
+
+    self.key_images[key] = image
+    self.nb_key_writes += 1
+    self.nb_bytes_written += len(image) if image else 0
+
+
+
+  def set_touchscreen_image(self, image, x_pos = 0, y_pos = 0, width = 0,
+				height = 0):
+    """Set the image of a region of the touchscreen, already in the native
+    format
+    """
+
+    if not self.touchscreen_format["format"]:
+      raise TypeError("Simulated device has no touchscreen")
+
+    self.check_fault("write")
+    self.__write_delay(len(image) if image else 0)
+
+    self.touchscreen_images.append((image, x_pos, y_pos, width, height))
+    del(self.touchscreen_images[:-64])
+    self.nb_touchscreen_writes += 1
+    self.nb_bytes_written += len(image) if image else 0
+
+
+
+  def set_screen_image(self, image):
+    """Set the image of the screen, already in the native format
+    """
+
+    if not self.screen_format["format"]:
+      raise TypeError("Simulated device has no screen")
+
+    self.check_fault("write")
+    self.__write_delay(len(image) if image else 0)
+
+    self.screen_image = image
+    self.nb_bytes_written += len(image) if image else 0
+
+
+
+  def _read_control_states(self):
+    """Return the next queued input event, or None if there isn't any
+    """
+
+    self.check_fault("read")
+
+    self.nb_reads += 1
+
+    self.__queue_scripted_events()
+
+    return self.__pending_events.pop(0) if self.__pending_events else None
+
+
+
+class SimulatedDeviceManager():
+  """Stand-in for the StreamDeck library's DeviceManager, which enumerates
+  simulated devices - those that are plugged in - optionally along with the
+  real devices enumerated by another device manager
+  """
+
+  def __init__(self, devices = None, device_manager = None):
+    """__init__ method
+    """
+
+    self.devices = list(devices) if devices is not None else \
+			[SimulatedStreamDeck()]
+    self.device_manager = device_manager
+
+
+
+  def enumerate(self):
+    """Return the simulated devices that are plugged in, after the real devices
+    if there's a device manager for them
+    """
+
+    return (self.device_manager.enumerate() \
+		if self.device_manager is not None else []) + \
+		[d for d in self.devices if d.is_plugged()]
+
+
+
+## Routines
+#
+
+def simulated_streamdeck(model, serial_number = None, **kwargs):
+  """Create a simulated device of a Stream Deck model - see
+  SimulatedStreamDeck.MODELS and MODEL_ALIASES - named "Simulated <model>".
+  The model name is case-independent. kwargs are passed on to
+  SimulatedStreamDeck()
+  Raise a ValueError if the model is unknown
+  """
+
+  # Model names and aliases: (model name, model)
+  models = {m.lower(): (m, m) for m in SimulatedStreamDeck.MODELS}
+  models.update({a.lower(): (a, m) \
+			for a, m in SimulatedStreamDeck.MODEL_ALIASES.items()})
+
+  name, m = models.get(model.strip().lower(), (None, None))
+  if m is None:
+    raise ValueError('Unknown Stream Deck model "{}"'.format(model))
+
+  return SimulatedStreamDeck("Simulated " + name, serial_number,
+				**dict(SimulatedStreamDeck.MODELS[m], **kwargs))
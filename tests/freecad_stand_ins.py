@@ -0,0 +1,135 @@
+"""FreeCAD Stream Deck Addon - Stand-ins for FreeCAD's parameters
+
+Used by the tests and the benchmarks, to run the addon's code outside FreeCAD
+"""
+
+## Classes
+#
+
+class ParameterGroup():
+  """Stand-in for a FreeCAD parameter group, notifying the observers attached
+  to the parameters of changes like FreeCAD does
+  """
+
+  # Parameter Editor type names as reported to the observers
+  fc_types = {"String": "FCText", "Integer": "FCInt", "Float": "FCFloat",
+		"Boolean": "FCBool", "Unsigned Long": "FCUInt"}
+
+  defaults = {"String": "", "Integer": 0, "Float": 0.0, "Boolean": False,
+		"Unsigned Long": 0}
+
+
+
+  def __init__(self, parameters, path):
+    """__init__ method
+    """
+
+    self.parameters = parameters
+    self.path = path
+    self.values = {}	# (name, type): value
+
+    # Get<type>(), Set<type>() and Rem<type>() methods for all the types
+    for ptype, suffix in (("String", "String"), ("Integer", "Int"),
+				("Float", "Float"), ("Boolean", "Bool"),
+				("Unsigned Long", "Unsigned")):
+      setattr(self, "Get" + suffix,
+		lambda name, default = None, ptype = ptype: \
+			self.get(ptype, name, default))
+      setattr(self, "Set" + suffix,
+		lambda name, value, ptype = ptype: self.set(ptype, name, value))
+      setattr(self, "Rem" + suffix,
+		lambda name, ptype = ptype: self.remove(ptype, name))
+
+
+
+  def GetGroupName(self):
+    """Return the name of the group
+    """
+
+    return self.path.rsplit("/", 1)[-1]
+
+
+
+  def GetContents(self):
+    """Return the (type, name, value) of the parameters in the group, or None
+    if the group is empty
+    """
+
+    return [(t, n, v) for (n, t), v in self.values.items()] or None
+
+
+
+  def AttachManager(self, observer):
+    """Attach an observer to the parameters
+    """
+
+    self.parameters.observers.append(observer)
+
+
+
+  def get(self, ptype, name, default = None):
+    """Return the value of a parameter
+    """
+
+    return self.values.get((name, ptype), default if default is not None \
+						else self.defaults[ptype])
+
+
+
+  def set(self, ptype, name, value):
+    """Set the value of a parameter
+    """
+
+    self.values[(name, ptype)] = value
+    self.parameters.notify(self, self.fc_types[ptype], name, str(value))
+
+
+
+  def remove(self, ptype, name):
+    """Remove a parameter
+    """
+
+    self.values.pop((name, ptype), None)
+    self.parameters.notify(self, self.fc_types[ptype], name, "")
+
+
+
+class FreeCADStandIn():
+  """Stand-in for the FreeCAD module, with only the parameters
+  """
+
+  def __init__(self):
+    """__init__ method
+    """
+
+    self.groups = {}
+    self.observers = []
+
+
+
+  def ParamGet(self, path):
+    """Return a parameter group, created if it doesn't exist
+    """
+
+    if path not in self.groups:
+      self.groups[path] = ParameterGroup(self, path)
+
+    return self.groups[path]
+
+
+
+  def notify(self, group, ptype, name, value):
+    """Notify the observers of a parameter change
+    """
+
+    for observer in self.observers:
+      observer.slotParamChanged(group, ptype, name, value)
+
+
+
+  def set_param(self, group, ptype, name, value):
+    """Set a parameter of the addon
+    """
+
+    self.ParamGet("User parameter:BaseApp/StreamDeckAddon" + group).\
+							set(ptype, name, value)
@@ -0,0 +1,214 @@
+"""FreeCAD Stream Deck Addon - Key surface pipeline reconnection tests
+
+Run from the addon's directory:
+
+  python3 -m pytest tests
+"""
+
+## Modules
+#
+
+import io
+import os
+import sys
+from time import time, sleep
+
+import pytest
+
+addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, addon_dir)
+sys.path.insert(0, os.path.join(addon_dir, "benchmarks"))
+
+from PIL import Image, ImageFont
+
+from streamdeck_comm import StreamDeck
+from streamdeck_sim import simulated_streamdeck, SimulatedDeviceManager
+from deck_pipeline import DeckPipeline
+from render_cache import RenderCache
+from key_renderer import KeyRenderer
+from perf_counters import counters
+from benchmark_pages import SyntheticToolbarActions
+
+
+
+## Parameters
+#
+
+# Reconnection parameters
+first_delay = 0.01
+max_delay = 0.08
+
+
+
+## Routines
+#
+
+def wait_for(condition, timeout = 5):
+  """Wait until condition() is true, for at most timeout seconds
+  Return whether it became true
+  """
+
+  end = time() + timeout
+  while not condition():
+    if time() >= end:
+      return False
+    sleep(0.001)
+
+  return True
+
+
+
+@pytest.fixture
+def deck():
+  """Open a simulated Stream Deck Original in a key surface pipeline, with
+  pages of synthetic toolbar actions, and display the first page
+  Yield the simulated device, the pipeline, the toolbar actions and the key
+  renderer
+  """
+
+  dev = simulated_streamdeck("Stream Deck Original")
+
+  # Use Pillow's default font, which is the only one that's always there
+  font_file = io.BytesIO(ImageFont.load_default(14).path.getvalue())
+
+  sd = StreamDeck(font_file, 14,
+			*[os.path.join(addon_dir, f) \
+				for f in ("prev.png", "next.png", "blank.png",
+						"broken.png")],
+			device_manager = SimulatedDeviceManager([dev]))
+  sd.open(dev.deck_type(), None)
+  assert sd.is_open()
+
+  tbactions = SyntheticToolbarActions(60, 3)
+  icon = Image.new("RGB", (64, 64), "gray")
+  for action in tbactions.actions.values():
+    action.icon_as_pil_image = lambda: icon
+
+  pipeline = DeckPipeline([sd])
+  pipeline.pages.rebuild_pages(tbactions, "", "Blue", "Red", "Green")
+  pipeline.pages.locate_current_page()
+
+  # Render all the keys of a page at once, before any of them is written
+  renderer = KeyRenderer(RenderCache(), None, pipeline.nbkeys)
+
+  pipeline.update_keys(tbactions, renderer, {})
+  assert wait_for(lambda: dev.nb_key_writes == dev.key_count())
+
+  yield dev, pipeline, tbactions, renderer
+
+  pipeline.close()
+  renderer.stop()
+
+
+
+def reconnect_until_open(pipeline, max_attempts = 100):
+  """Call the pipeline's reconnect() when the next attempt is due until the
+  key surface is open again
+  Return the delays between the failed attempts and the next ones
+  """
+
+  delays = []
+
+  while not pipeline.is_open():
+    now = time()
+    assert pipeline.reconnect(now, max_attempts, first_delay, max_delay)
+
+    if not pipeline.is_open():
+      delays.append(pipeline.reconnect_delay(now))
+      sleep(delays[-1])
+
+  return delays
+
+
+
+def test_write_fault_reconnects_once_and_pushes_the_current_page(deck):
+  """A failed key write closes the device, which is reopened right away with
+  the same pages and render cache, and only the keys of the current page are
+  written again
+  """
+
+  dev, pipeline, tbactions, renderer = deck
+
+  pages = pipeline.pages
+  all_pages = pages.pages
+  reconnects = counters.snapshot().get("reconnects", 0)
+
+  # Flip to the next page and fail writing its first key
+  dev.inject_fault("write")
+  assert pages.flip(1)
+  current_page_no = pages.current_page_no
+  pipeline.update_keys(tbactions, renderer, {})
+  nb_cached_keys = len(renderer.render_cache)
+  nb_key_writes = dev.nb_key_writes
+
+  # The failure is noticed at the next read
+  assert wait_for(lambda: pipeline.get_input_events(1) == [] and \
+				not pipeline.is_open())
+  assert pipeline.reconnect_delay(time()) == 0
+
+  assert reconnect_until_open(pipeline) == []
+  assert counters.snapshot()["reconnects"] == reconnects + 1
+
+  assert pipeline.pages is pages
+  assert pages.pages is all_pages
+  assert pages.current_page_no == current_page_no
+
+  assert pipeline.update_keys_needed
+  pipeline.update_keys(tbactions, renderer, {})
+  assert wait_for(lambda: dev.nb_key_writes == \
+				nb_key_writes + dev.key_count())
+  assert len(renderer.render_cache) == nb_cached_keys
+
+  # Nothing else is written afterward
+  sleep(0.05)
+  pipeline.update_keys(tbactions, renderer, {})
+  sleep(0.05)
+  assert dev.nb_key_writes == nb_key_writes + dev.key_count()
+
+
+
+def test_unplugged_device_reconnects_with_exponential_backoff(deck):
+  """A device unplugged for a while is reopened once it's back, with the
+  delays between the attempts doubling from first_delay up to max_delay
+  """
+
+  dev, pipeline, tbactions, renderer = deck
+
+  pages = pipeline.pages
+  nb_key_writes = dev.nb_key_writes
+
+  dev.unplug(0.3)
+  pipeline.get_input_events(1)
+  assert not pipeline.is_open()
+
+  delays = reconnect_until_open(pipeline)
+
+  assert len(delays) >= 4
+  for n, delay in enumerate(delays, 1):
+    assert delay == pytest.approx(min(max_delay, first_delay * 2 ** (n - 1)))
+
+  assert pipeline.pages is pages
+  pipeline.update_keys(tbactions, renderer, {})
+  assert wait_for(lambda: dev.nb_key_writes == \
+				nb_key_writes + dev.key_count())
+
+
+
+def test_reconnection_gives_up_after_max_attempts(deck):
+  """reconnect() returns False once a device that stays unplugged has failed
+  to reopen max_attempts times
+  """
+
+  dev, pipeline, tbactions, renderer = deck
+
+  dev.unplug()
+  pipeline.get_input_events(1)
+
+  results = []
+  now = time()
+  while not results or results[-1]:
+    results.append(pipeline.reconnect(now, 3, first_delay, max_delay))
+    now += max_delay
+
+  assert results == [True, True, False]
+  assert not pipeline.is_open()
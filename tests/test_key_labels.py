@@ -0,0 +1,67 @@
+"""FreeCAD Stream Deck Addon - Key label cache tests
+
+Run from the addon's directory:
+
+  python3 -m pytest tests
+"""
+
+## Modules
+#
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+from PIL import ImageFont
+
+from key_labels import KeyLabels
+
+
+
+## Routines
+#
+
+@pytest.mark.parametrize("size", [6, 8, 9, 14])
+def test_fit_ellipsizes_text_too_long_at_any_font_size(size):
+  """A text too long for the width is ellipsized to fit, including with fonts
+  already at or below the minimum size they can be shrunk to
+  """
+
+  font = ImageFont.load_default(size)
+  text = "Constraint horizontal distance"
+  width = 30
+
+  fitted_text, fitted_font = KeyLabels().fit(text, font, width)
+
+  assert fitted_text.endswith(KeyLabels.ellipsis)
+  assert fitted_font.getlength(fitted_text) <= width
+  assert fitted_font.size <= size
+
+
+
+def test_fit_keeps_text_that_fits():
+  """A text that fits is kept as is with the same font
+  """
+
+  font = ImageFont.load_default(8)
+
+  assert KeyLabels().fit("Pad", font, 100) == ("Pad", font)
+
+
+
+def test_get_label_fits_within_key():
+  """The mask of a label too long for a small key with a small font fits
+  within the key
+  """
+
+  font = ImageFont.load_default(8)
+
+  mask, position = KeyLabels().get("Constraint horizontal distance", "mt",
+					font, (40, 40))
+
+  assert mask is not None
+  assert position[0] >= 0 and position[0] + mask.width <= 40
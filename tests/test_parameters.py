@@ -0,0 +1,98 @@
+"""FreeCAD Stream Deck Addon - User parameters synchronization tests
+
+Run from the addon's directory:
+
+  python3 -m pytest tests
+"""
+
+## Modules
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+from parameters import UserParameters
+from freecad_stand_ins import FreeCADStandIn
+
+
+
+## Parameters
+#
+
+top_level_group = "User parameter:BaseApp/StreamDeckAddon"
+screen_saver_group = top_level_group + "/Device/Display/ScreenSaver"
+
+
+
+## Routines
+#
+
+def test_sync_returns_only_the_changed_parameters():
+  """Only the parameters reported as changed whose values differ are
+  returned, and nothing is returned when nothing changed
+  """
+
+  fc = FreeCADStandIn()
+  params = UserParameters(fc)
+
+  assert params.sync() == set()
+
+  fc.set_param("/Device/Display/ScreenSaver", "Unsigned Long",
+		"FadeTimeSeconds", 3)
+  fc.set_param("/Device/Display/ScreenSaver", "Float", "FadeGamma", 2.2)
+  fc.set_param("/Device/Display/Brightness", "Unsigned Long",
+		"BrightnessPercent", params.max_brightness)
+
+  assert params.sync() == {"fade_time", "fade_gamma"}
+  assert params.fade_time == 3
+  assert params.fade_gamma == 2.2
+
+  assert params.sync() == set()
+
+
+
+def test_group_change_resyncs_everything():
+  """A parameter changed without being reported individually is picked up
+  once a group change is reported
+  """
+
+  fc = FreeCADStandIn()
+  params = UserParameters(fc)
+  params.sync()
+
+  group = fc.ParamGet(screen_saver_group)
+  group.values[("FadeToBrightness", "Unsigned Long")] = 20
+
+  assert params.sync() == set()
+
+  fc.notify(group, "FCParamGroup", "ScreenSaver", "")
+
+  assert params.sync() == {"min_brightness"}
+  assert params.min_brightness == 20
+
+
+
+def test_removed_parameter_falls_back_to_its_default():
+  """A removed parameter gets its default value back, and is recreated in
+  the Parameter Editor with that value
+  """
+
+  fc = FreeCADStandIn()
+  params = UserParameters(fc)
+
+  default = params.fade_after_secs_inactivity
+
+  fc.set_param("/Device/Display/ScreenSaver", "Unsigned Long",
+		"FadeWhenUserInactiveForSeconds", default + 60)
+  assert params.sync() == {"fade_after_secs_inactivity"}
+
+  fc.ParamGet(screen_saver_group).RemUnsigned(
+					"FadeWhenUserInactiveForSeconds")
+
+  assert params.sync() == {"fade_after_secs_inactivity"}
+  assert params.fade_after_secs_inactivity == default
+  assert fc.ParamGet(screen_saver_group).GetUnsigned(
+			"FadeWhenUserInactiveForSeconds", None) == default
@@ -0,0 +1,150 @@
+"""FreeCAD Stream Deck Addon - Stream Deck device handling tests
+
+Run from the addon's directory:
+
+  python3 -m pytest tests
+"""
+
+## Modules
+#
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				".."))
+
+from streamdeck_comm import find_streamdecks, fade_steps
+from streamdeck_sim import simulated_streamdeck, SimulatedDeviceManager
+
+
+
+## Routines
+#
+
+def simulated_devices():
+  """Return a simulated Stream Deck Pedal, Stream Deck XL and Stream Deck
+  Original
+  """
+
+  return [simulated_streamdeck(model, "SN{}".format(i)) \
+		for i, model in enumerate(("Stream Deck Pedal", "Stream Deck XL",
+						"Stream Deck Original"))]
+
+
+
+def test_find_streamdecks_without_serial_numbers_opens_nothing():
+  """Without serial numbers to look for, the devices are found without being
+  opened, and the devices without displays are ignored
+  """
+
+  pedal, xl, original = simulated_devices()
+  for dev in (pedal, xl, original):
+    dev.inject_fault("open")
+
+  matches, _ = find_streamdecks([], [],
+				device_manager = SimulatedDeviceManager([pedal,
+								xl, original]))
+
+  assert matches == [(xl, None), (original, None)]
+  assert [dev.nb_faults for dev in (pedal, xl, original)] == [0, 0, 0]
+
+
+
+def test_find_streamdecks_only_opens_devices_of_the_right_types():
+  """With serial numbers to look for, only the devices of the types looked
+  for are opened to get their serial numbers
+  """
+
+  pedal, xl, original = simulated_devices()
+  for dev in (pedal, original):
+    dev.inject_fault("open")
+
+  matches, _ = find_streamdecks(["Simulated Stream Deck XL"], ["sn1"],
+				device_manager = SimulatedDeviceManager([pedal,
+								xl, original]))
+
+  assert matches == [(xl, "SN1")]
+  assert [dev.nb_faults for dev in (pedal, xl, original)] == [0, 0, 0]
+
+
+
+def test_fade_steps_without_change_or_duration():
+  """A fade to the same brightness has no steps, and a fade without duration
+  goes straight to the end brightness
+  """
+
+  assert fade_steps(40, 40, 10) == []
+  assert fade_steps(80, 0, 0) == [(0, 0)]
+  assert fade_steps(0, 80, -1, 2.2) == [(0, 80)]
+
+
+
+@pytest.mark.parametrize("start, end", [(0, 4), (4, 0), (10, 14)])
+def test_fade_steps_at_the_halfway_crossings(start, end):
+  """Each step of a linear fade is due when the brightness crosses halfway to
+  it
+  """
+
+  direction = 1 if end > start else -1
+
+  steps = fade_steps(start, end, 4)
+
+  assert [b for _, b in steps] == list(range(start + direction,
+						end + direction, direction))
+  assert [t for t, _ in steps] == pytest.approx([0.5, 1.5, 2.5, 3.5])
+
+
+
+@pytest.mark.parametrize("start, end", [(0, 100), (100, 5)])
+def test_fade_steps_with_gamma(start, end):
+  """With a gamma other than 1, the gamma-th root of the brightness changes
+  linearly over time, and each step is still due when the brightness crosses
+  halfway to it
+  """
+
+  gamma = 2.2
+  duration = 3
+  direction = 1 if end > start else -1
+
+  steps = fade_steps(start, end, duration, gamma)
+
+  assert [b for _, b in steps] == list(range(start + direction,
+						end + direction, direction))
+
+  root = lambda b: (b / 100) ** (1 / gamma)
+  for t, b in steps:
+    brightness = 100 * (root(start) + (root(end) - root(start)) * \
+				t / duration) ** gamma
+    assert brightness == pytest.approx(b - direction / 2)
+
+  # Evenly to the eye: the steps get sparser as the brightness goes up
+  times = [t for t, _ in steps]
+  intervals = [t1 - t0 for t0, t1 in zip(times, times[1:])]
+  assert intervals == sorted(intervals, reverse = direction > 0)
+
+
+
+def test_fade_steps_spaced_at_least_min_interval():
+  """Steps closer than min_interval to the previous one are skipped, except
+  the last one, which is delayed
+  """
+
+  min_interval = 0.05
+
+  steps = fade_steps(0, 100, 1, 1, min_interval)
+
+  times = [t for t, _ in steps]
+  assert all([t1 - t0 >= min_interval - 1e-9 \
+		for t0, t1 in zip(times, times[1:])])
+  assert 18 <= len(steps) <= 21
+
+  # The brightness only goes up, every step but the last one is the rounded
+  # brightness at its time, and the last one is the end brightness
+  assert [b for _, b in steps] == sorted(set([b for _, b in steps]))
+  for t, b in steps[:-1]:
+    assert b == round(100 * t + 0.5)
+  assert steps[-1][1] == 100
+  assert steps[-1][0] <= 1 + min_interval
@@ -0,0 +1,183 @@
+"""FreeCAD Stream Deck Addon - Stream Deck pages layout tests
+
+Run from the addon's directory:
+
+  python3 -m pytest tests
+"""
+
+## Modules
+#
+
+import os
+import sys
+
+import pytest
+
+addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, addon_dir)
+sys.path.insert(0, os.path.join(addon_dir, "benchmarks"))
+
+from streamdeck_pages import StreamDeckPages
+from benchmark_pages import SyntheticAction, SyntheticToolbarActions
+
+
+
+## Classes
+#
+
+class ToolbarActionsStandIn():
+  """Stand-in for a ToolbarActions object with toolbars of the given sizes,
+  as a list of (toolbar name, number of actions)
+  """
+
+  def __init__(self, toolbar_sizes):
+    """__init__ method
+    """
+
+    self.toolbars = [t for t, _ in toolbar_sizes]
+    self.toolbar_actions = {t: ["{}_{}".format(t, i) for i in range(size)] \
+				for t, size in toolbar_sizes}
+    self.actions = {n: SyntheticAction(t, n, n, 0) \
+			for t, ns in self.toolbar_actions.items() for n in ns}
+    self.expanded_actions = {}
+
+
+
+## Routines
+#
+
+def rebuild(pages, tbactions, repeated_toolbars = (), pack_toolbars = True,
+		toolbar_ranks = None):
+  """Rebuild the pages and return the key strings of each page, each split
+  into its fields
+  """
+
+  pages.rebuild_pages(tbactions, repeated_toolbars, "Blue", "Red", "Green",
+			pack_toolbars, toolbar_ranks)
+
+  return [[ks.split(pages.SV) for ks in p.split(pages.SK)] \
+		for p in pages.pages]
+
+
+
+def action_names(page):
+  """Return the names of the actions on a page, in order
+  """
+
+  return [fields[1] for fields in page \
+		if fields[1] not in ("", "PAGEPREV", "PAGENEXT")]
+
+
+
+def test_plan_toolbar_layout_packs_first_fit():
+  """Small toolbars go on the first page they fit on, toolbars larger than a
+  page start a new page, and the unpacked page count is that of the toolbars
+  each starting a new page
+  """
+
+  layout, nb_unpacked = StreamDeckPages.plan_toolbar_layout(
+				[("A", 8), ("B", 6), ("Big", 25), ("C", 5),
+					("D", 3)], 10, True)
+
+  assert layout == [("A", True), ("B", True), ("D", False), ("Big", True),
+			("C", False)]
+  assert nb_unpacked == 1 + 1 + 3 + 1 + 1
+
+  layout, _ = StreamDeckPages.plan_toolbar_layout(
+				[("A", 8), ("B", 6), ("Big", 25)], 10, False)
+
+  assert layout == [("A", True), ("B", True), ("Big", True)]
+
+
+
+def test_repeated_toolbars_stay_on_every_page():
+  """The actions of the repeated toolbars are the first keys of every page,
+  with the toolbars packed together
+  """
+
+  tbactions = ToolbarActionsStandIn([("Repeated", 2), ("A", 3), ("B", 20),
+					("C", 4), ("D", 2)])
+  pages = StreamDeckPages(15, True)
+
+  rebuilt = rebuild(pages, tbactions, ["Repeated"])
+
+  assert len(rebuilt) > 1
+  for page in rebuilt:
+    assert action_names(page)[:2] == ["Repeated_0", "Repeated_1"]
+    assert "Repeated_0" not in action_names(page)[2:]
+
+
+
+def test_large_toolbar_spans_consecutive_pages():
+  """A toolbar larger than a page takes up consecutive pages in order, with
+  the page navigation keys of its pages leading from one to the next
+  """
+
+  tbactions = ToolbarActionsStandIn([("A", 5), ("Big", 30), ("B", 4)])
+  pages = StreamDeckPages(15, True)
+
+  rebuilt = rebuild(pages, tbactions)
+
+  big_pages = [i for i, page in enumerate(rebuilt) \
+		if any([n.startswith("Big_") for n in action_names(page)])]
+
+  assert big_pages == list(range(big_pages[0], big_pages[0] + 3))
+  assert sum([action_names(rebuilt[i]) for i in big_pages], []) == \
+		tbactions.toolbar_actions["Big"]
+
+  for i in big_pages:
+    prev_key, next_key = rebuilt[i][-2:]
+    assert prev_key[1] == "PAGEPREV"
+    assert next_key[1] == ("PAGENEXT" if i < len(rebuilt) - 1 else "")
+    if i > big_pages[0]:
+      assert prev_key[5] == "Big"
+    if i < big_pages[-1]:
+      assert next_key[5] == "Big"
+
+
+
+@pytest.mark.parametrize("pack_toolbars", [False, True])
+def test_toolbar_ranks_order_is_stable(pack_toolbars):
+  """The toolbars are ordered by rank, the toolbars of the same rank and the
+  toolbars without a rank staying in the order of the GUI
+  """
+
+  tbactions = ToolbarActionsStandIn([(t, 14) for t in "ABCDEF"])
+  pages = StreamDeckPages(15, True)
+
+  rebuilt = rebuild(pages, tbactions, [], pack_toolbars,
+			{"E": 0, "C": 1, "F": 1})
+
+  order = []
+  for page in rebuilt:
+    for n in action_names(page):
+      t = n.split("_")[0]
+      if t not in order:
+        order.append(t)
+
+  assert order == ["E", "C", "F", "A", "B", "D"]
+
+
+
+@pytest.mark.parametrize("nbkeys", [6, 8, 15, 32])
+@pytest.mark.parametrize("nbrepeated", [0, 3])
+def test_packing_never_takes_more_pages(nbkeys, nbrepeated):
+  """The pages with the toolbars packed together are never more than the
+  pages without packing, and all the actions are laid out once
+  """
+
+  for seed in range(10):
+    tbactions = SyntheticToolbarActions(200, 30, nbrepeated, seed)
+    repeated_toolbars = ["Repeated"] if nbrepeated else []
+    pages = StreamDeckPages(nbkeys, True)
+
+    unpacked = rebuild(pages, tbactions, repeated_toolbars, False)
+    assert len(unpacked) == pages.nb_unpacked_pages
+
+    packed = rebuild(pages, tbactions, repeated_toolbars, True)
+    assert len(packed) <= pages.nb_unpacked_pages
+
+    laid_out = sum([action_names(page)[nbrepeated:] for page in packed], [])
+    assert sorted(laid_out) == sorted([n for t in tbactions.toolbars \
+						if t not in repeated_toolbars \
+						for n in tbactions.toolbar_actions[t]])
@@ -0,0 +1,231 @@
+"""FreeCAD Stream Deck Addon - Update profiler class
+"""
+
+## Modules
+#
+
+import os
+import json
+from time import perf_counter
+from threading import Lock, current_thread
+from collections import deque
+
+
+
+## Classes
+#
+
+class _NoPhase():
+  """Phase context manager that does nothing, used when profiling is disabled
+  """
+
+  __slots__ = ()
+
+
+
+  def __enter__(self):
+    """Enter the phase
+    """
+
+    return self
+
+
+
+  def __exit__(self, *args):
+    """Exit the phase
+    """
+
+    return False
+
+
+
+class _Phase():
+  """Context manager timing one phase of an update
+  """
+
+  __slots__ = ("profiler", "name", "start")
+
+  def __init__(self, profiler, name):
+    """__init__ method
+    """
+
+    self.profiler = profiler
+    self.name = name
+
+
+
+  def __enter__(self):
+    """Start timing the phase
+    """
+
+    self.start = perf_counter()
+    return self
+
+
+
+  def __exit__(self, *args):
+    """Stop timing the phase and record its duration
+    """
+
+    self.profiler.record(self.name, self.start, perf_counter())
+    return False
+
+
+
+class TickProfiler():
+  """Profiler timing the phases of the Stream Deck updates - whether they run
+  in FreeCAD's GUI thread, in the rendering threads or in the writer threads -
+  keeping the durations of the most recent occurrences of each phase to
+  report their percentiles, and optionally recording them as Chrome trace
+  events that can be loaded in chrome://tracing or Perfetto
+
+  When the profiler is disabled, timing a phase costs next to nothing
+  """
+
+  _no_phase = _NoPhase()
+
+
+
+  def __init__(self, window = 1000, max_trace_events = 100000):
+    """__init__ method
+    window is the number of most recent durations kept per phase
+    max_trace_events is the number of most recent trace events kept
+    """
+
+    self.window = window
+
+    self.enabled = False
+    self.trace_file = ""
+
+    self.__lock = Lock()
+    self.__durations = {}	# Phase name: deque of durations in seconds
+    self.__trace_events = deque(maxlen = max_trace_events)
+    self.__thread_names = {}	# Thread ID: thread name
+    self.__t0 = perf_counter()
+
+
+
+  def configure(self, enabled, trace_file = ""):
+    """Enable or disable the profiler, and set the file the trace events are
+    written to - no trace events are recorded if it's empty. Start afresh if
+    the profiler is enabled
+    """
+
+    if enabled and not self.enabled:
+      self.clear()
+
+    self.enabled = enabled
+    self.trace_file = trace_file
+
+
+
+  def clear(self):
+    """Forget about all the durations and trace events recorded so far
+    """
+
+    with self.__lock:
+      self.__durations.clear()
+      self.__trace_events.clear()
+      self.__thread_names.clear()
+      self.__t0 = perf_counter()
+
+
+
+  def phase(self, name):
+    """Return a context manager timing a phase:
+
+      with profiler.phase("render"):
+        ...
+    """
+
+    return _Phase(self, name) if self.enabled else self._no_phase
+
+
+
+  def record(self, name, start, end):
+    """Record the start and end perf_counter() timestamps of a phase
+    """
+
+    if not self.enabled:
+      return
+
+    with self.__lock:
+      durations = self.__durations.get(name)
+      if durations is None:
+        durations = self.__durations[name] = deque(maxlen = self.window)
+      durations.append(end - start)
+
+      if self.trace_file:
+        thread = current_thread()
+        self.__thread_names.setdefault(thread.ident, thread.name)
+        self.__trace_events.append({"name": name, "ph": "X",
+					"ts": (start - self.__t0) * 1e6,
+					"dur": (end - start) * 1e6,
+					"pid": os.getpid(),
+					"tid": thread.ident})
+
+
+
+  def percentiles(self):
+    """Return the (number of samples, 50th, 95th and 99th percentile durations
+    in milliseconds) of the recent occurrences of each phase, keyed by phase
+    name
+    """
+
+    with self.__lock:
+      all_durations = {name: sorted(durations) \
+				for name, durations in self.__durations.items()}
+
+    stats = {}
+    for name, durations in all_durations.items():
+      n = len(durations)
+      stats[name] = (n,) + tuple([durations[min(n - 1, int(n * p))] * 1000 \
+					for p in (0.50, 0.95, 0.99)])
+
+    return stats
+
+
+
+  def report(self):
+    """Return the percentiles of the phases as lines of text ready to print
+    """
+
+    lines = ["{:<20} {:>8} {:>9} {:>9} {:>9}".
+		format("Phase", "Samples", "p50 ms", "p95 ms", "p99 ms")]
+
+    for name, (n, p50, p95, p99) in sorted(self.percentiles().items()):
+      lines.append("{:<20} {:>8} {:>9.3f} {:>9.3f} {:>9.3f}".
+			format(name, n, p50, p95, p99))
+
+    return lines
+
+
+
+  def write_trace(self):
+    """Write the trace events recorded so far to the trace file in Chrome's
+    trace event format, if there is a trace file
+    Return an error message, or None if the trace was written
+    """
+
+    if not self.trace_file:
+      return None
+
+    with self.__lock:
+      events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(),
+			"tid": tid, "args": {"name": name}} \
+			for tid, name in self.__thread_names.items()] + \
+			list(self.__trace_events)
+
+    try:
+      with open(self.trace_file, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    except Exception as e:
+      return str(e)
+
+    return None
+
+
+
+# Profiler shared by the whole addon
+profiler = TickProfiler()